@@ -0,0 +1,78 @@
+import asyncio
+import os
+import random
+import shutil
+import tempfile
+import time as t
+
+from ..div.emit import ObservableEmit
+from ..emitdriver.sqliteemitdriver import SqliteEmitDriver
+from ..model import thing as aqt
+
+# Compares the indexed Sqlite table with the compressed archive, size on disk and a long-range scan:
+#   python -m smoothieaq.bench.archivebench [observables] [days]
+
+
+def _emits(observables: int, days: int, start: float) -> list[ObservableEmit]:
+    # a slowly drifting temperature rounded to 2 decimals every minute, with some jitter on the stamps, and a
+    # pump switching on and off
+    emits = []
+    for o in range(observables):
+        value = 24.
+        for i in range(days * 24 * 60):
+            value += random.gauss(0, 0.02)
+            emits.append(ObservableEmit(observable_id=f"{o}:A", stamp=start + i * 60 + random.uniform(0, 0.05),
+                                        value=round(value, 2)))
+            if i % 30 == 0:
+                emits.append(ObservableEmit(observable_id=f"{o}:B", stamp=start + i * 60 + 0.5,
+                                            enumValue="on" if i % 60 else "off"))
+    return emits
+
+
+async def _scan(driver: SqliteEmitDriver, observables: int, start: float, end: float) -> tuple[float, int]:
+    t0 = t.perf_counter()
+    rows = 0
+    for o in range(min(observables, 5)):
+        async for _ in driver.history(f"{o}:A", start, end):
+            rows += 1
+    return t.perf_counter() - t0, rows
+
+
+async def bench(observables: int = 20, days: int = 14) -> None:
+    dir = os.path.join(tempfile.gettempdir(), "smoothieaq-bench-archive")
+    shutil.rmtree(dir, ignore_errors=True)
+    os.makedirs(dir)
+    db_file = os.path.join(dir, "emits.db")
+    start = (t.time() // 86400 - days - 2) * 86400
+    end = start + days * 86400
+    emits = _emits(observables, days, start)
+    print(f"{len(emits)} emits from {observables * 2} observables over {days} days")
+
+    driver = SqliteEmitDriver(aqt.EmitDriver(id=SqliteEmitDriver.id))
+    await driver.init("archive", {'db_file': db_file, 'archive_dir': os.path.join(dir, "archive"),
+                                  'archive_after': '1', 'partition_days': '1'})
+    await driver.start()
+    for i in range(0, len(emits), 5000):
+        await driver.emit(emits[i:i + 5000])
+    await driver.flush()
+    await driver.connection.executescript("VACUUM; PRAGMA wal_checkpoint(TRUNCATE)")
+    db_size = os.path.getsize(db_file)
+    db_time, rows = await _scan(driver, observables, start, end)
+    print(f"sqlite   {db_size / 1e6:8.2f} MB  {db_size / len(emits):6.1f} bytes/emit   "
+          f"scan {rows} emits {db_time * 1000:8.0f} ms")
+
+    t0 = t.perf_counter()
+    await driver.writer.archive_closed()
+    archive_time = t.perf_counter() - t0
+    await driver.connection.executescript("VACUUM; PRAGMA wal_checkpoint(TRUNCATE)")
+    archive_size = sum(e.stat().st_size for e in os.scandir(os.path.join(dir, "archive")))
+    scan_time, rows = await _scan(driver, observables, start, end)
+    print(f"archive  {archive_size / 1e6:8.2f} MB  {archive_size / len(emits):6.1f} bytes/emit   "
+          f"scan {rows} emits {scan_time * 1000:8.0f} ms   (archiving took {archive_time:.1f} s, "
+          f"{db_size / archive_size:.0f}x smaller)")
+    await driver.stop()
+
+
+if __name__ == '__main__':
+    import sys
+    asyncio.run(bench(*map(int, sys.argv[1:])))
@@ -0,0 +1,82 @@
+import asyncio
+import gc
+import os
+import random
+import sys
+import time as t
+from typing import Any
+
+from ..device import devices as dv
+from ..div.emit import RawEmit, ObservableEmit, emit_to_transport
+from ..model import thing as aqt
+
+# Emit records allocated per emit by the pipeline, their size, time per emit and RSS, for Measures with decimals and limits and a
+# few websocket clients converting every emit to transport format:
+#   python -m smoothieaq.bench.emitbench [observables] [emits] [clients]
+
+
+def _rss() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _size(o: Any) -> int:
+    return sys.getsizeof(o) + (sys.getsizeof(o.__dict__) if hasattr(o, "__dict__") else 0)
+
+
+def _count_records() -> list[int]:
+    # counts RawEmits and ObservableEmits made, by wrapping their __init__
+    made = [0]
+    for cls in (RawEmit, ObservableEmit):
+        def counting(self, *args, __init__=cls.__init__, **kwargs) -> None:
+            made[0] += 1
+            __init__(self, *args, **kwargs)
+        cls.__init__ = counting
+    return made
+
+
+async def bench(observables: int = 5000, emits: int = 50000, clients: int = 3) -> None:
+    rss = _rss()
+    await dv.init()
+    for i in range(observables):
+        await dv._add_device(aqt.Device(id=str(i + 1), name=f"Bench {i + 1}", observables=[
+            aqt.Measure(id="A", name="temperature", driver=aqt.DriverRef(id="MemoryDriver"), precision=0.01,
+                        require=aqt.ValueRequire(warningAbove=26., warningBelow=22., alarmAbove=28., alarmBelow=20.))
+        ]))
+    await asyncio.sleep(1)
+    gc.collect()
+    rss = _rss() - rss
+
+    sent: list[Any] = []
+    received = 0
+    last = 0.
+
+    async def client(e: ObservableEmit) -> None:
+        nonlocal received, last
+        sent.append(emit_to_transport(e))
+        received += 1
+        last = t.perf_counter()
+    for _ in range(clients):
+        await dv.rx_all_observables.subscribe_async(client)
+
+    drivers = [o.driver._rx_observers['A'] for o in dv.observables.values()]
+    values = [RawEmit(value=round(random.gauss(24., 1.), 3)) for _ in range(1009)]
+    made = _count_records()
+    t0 = t.perf_counter()
+    for i in range(emits):
+        await drivers[i % observables].asend(values[i % 1009])
+        if i % 100 == 0:
+            await asyncio.sleep(0)
+            sent.clear()
+    while t.perf_counter() - last < 0.5:  # until emits queued on the way have been received
+        await asyncio.sleep(0.1)
+    elapsed = last - t0
+    e = ObservableEmit(observable_id="1:A", stamp=t.time(), value=1.)
+    print(f"{observables} Measures, {clients} clients: {made[0] / emits:.1f} emit records per emit of "
+          f"{_size(RawEmit(value=1.))}/{_size(e)} bytes, {elapsed / emits * 1e6:.1f} us per emit, "
+          f"{received / clients / emits:.2f} received per emit, "
+          f"{rss / observables / 1e3:.1f} kB RSS per observable")
+
+
+if __name__ == '__main__':
+    asyncio.run(bench(*map(int, sys.argv[1:])))
@@ -0,0 +1,140 @@
+import asyncio
+import random
+import time as t
+
+import aioreactive as rx
+
+from ..device import devices as dv
+from ..device import expressiongraph
+from ..device.expression import as_observable, compile_expr, find_rx_observables
+from ..div import enums
+from ..div.emit import RawEmit
+from ..model import enum as aqe
+from ..model import thing as aqt
+from ..model.expression import BinaryOpExpr, ObservableExpr, ValueExpr, BinaryOp, ConvertExpr, Expr
+from ..modelobject import objectstore as os
+
+# Cost of evaluating the lumen expressions ChihirosDiscover puts on a 4 color Chihiros light, per evaluation of the
+# compiled expression and per emit through as_observable, and the evaluations and emits of the light's lumen
+# observables when its max lumen changes:
+#   python -m smoothieaq.bench.exprbench [evaluations]
+
+
+def _lumen_exprs(color_ids: str = "R:G:B:W", colors: str = "880000:880000:880000:888888", lum: float = 3260
+                 ) -> dict[str, Expr]:
+    # as in ChihirosDiscover._new_bt_device
+    subjective = [0.21, 0.72, 0.07]
+    color_id = color_ids.split(":")
+    color_elm = [[int(col[0:2], 16), int(col[2:4], 16), int(col[4:6], 16)] for col in colors.split(":")]
+    tot_elm = [sum([cl[i] for cl in color_elm]) for i in range(3)]
+    weight = [sum([cl[i] / tot_elm[i] * subjective[i] for i in range(3)]) for cl in color_elm]
+
+    exprs: dict[str, Expr] = {}
+    for i, id in enumerate(color_id):
+        exprs[id + "1"] = BinaryOpExpr(op=BinaryOp.MULTIPLY, expr1=ObservableExpr('A2'), expr2=ValueExpr(weight[i]))
+        exprs[id + "3"] = BinaryOpExpr(op=BinaryOp.MULTIPLY, expr1=ObservableExpr(id + '1'),
+                                       expr2=ConvertExpr(expr=ObservableExpr(id + '2'), quantity='fraction',
+                                                         fromUnit='%', toUnit='_fraction'))
+
+    def add(ids: list[str]) -> Expr:
+        oe = ObservableExpr(ids[0] + '3')
+        return oe if len(ids) == 1 else BinaryOpExpr(op=BinaryOp.ADD, expr1=oe, expr2=add(ids[1:]))
+    exprs["A2"] = ValueExpr(lum)
+    exprs["A3"] = add(color_id)
+    exprs["A5"] = BinaryOpExpr(op=BinaryOp.MULTIPLY, expr1=ValueExpr(100),
+                               expr2=BinaryOpExpr(op=BinaryOp.DIVIDE, expr1=ObservableExpr('A3'),
+                                                  expr2=ObservableExpr('A2')))
+    return exprs
+
+
+async def _load_enums() -> None:
+    os._objects[aqe.Enum] = dict((await os._load_type_from_yaml_file(aqe.Enum, "enums")).map(lambda e: (e.id, e)))
+    await enums.load()
+
+
+def _evaluations(expr: Expr, evaluations: int) -> float:
+    ids = list(find_rx_observables(expr, "1").keys())
+    evaluate = compile_expr(expr, dict((id, i) for i, id in enumerate(ids)))
+    slots = [RawEmit(value=random.uniform(1, 100)) for _ in ids]
+    t0 = t.perf_counter()
+    for _ in range(evaluations):
+        evaluate(slots)
+    return (t.perf_counter() - t0) / evaluations
+
+
+async def _emits(expr: Expr, subjects: dict[str, rx.AsyncSubject[RawEmit]], emits: int) -> float:
+    received = 0
+
+    async def count(_) -> None:
+        nonlocal received
+        received += 1
+    disposable = await as_observable(expr, "1").subscribe_async(count)
+    inputs = [s for id, s in subjects.items() if id[2:] in find_rx_observables(expr, "1")]
+    for s in inputs:
+        await s.asend(RawEmit(value=random.uniform(1, 100)))
+    await asyncio.sleep(0.01)
+    received = 0
+    t0 = t.perf_counter()
+    for i in range(emits):
+        await inputs[i % len(inputs)].asend(RawEmit(value=float(i + 1)))
+        await asyncio.sleep(0)  # expressions are evaluated once per tick
+    elapsed = t.perf_counter() - t0
+    await disposable.dispose_async()
+    assert received >= emits, f"{received} of {emits}"
+    return elapsed / emits
+
+
+async def _changes(changes: int) -> None:
+    # max lumen and brightness from memory drivers, instead of a constant and the led driver
+    exprs = _lumen_exprs()
+    ids = list(exprs.keys()) + [id[0] + "2" for id in exprs.keys() if id[0] != "A"]
+    m_device = aqt.Device(id="99", name="Chihiros", observables=[
+        aqt.Amount(id=id, name=id, expr=None if id == "A2" or id[1] == "2" else exprs[id],
+                   driver=aqt.DriverRef(id="MemoryDriver") if id == "A2" or id[1] == "2" else None)
+        for id in ids])
+    await dv._add_device(m_device)
+    for id in ids:
+        if id[1] == "2":
+            await dv.get_observable("99:" + id).set_value(50. if id != "A2" else 3000.)
+    emits: dict[str, list[float]] = {"A3": [], "A5": []}
+    for id, values in emits.items():
+        async def append(e, values=values) -> None:
+            values.append(e.value)
+        await dv.get_observable("99:" + id).rx_observable.subscribe_async(append)
+    await asyncio.sleep(0.1)
+    for values in emits.values():
+        values.clear()
+    evaluations = expressiongraph.evaluations
+    for i in range(changes):
+        await dv.get_observable("99:A2").set_value(3000. + i * 10)
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+    await asyncio.sleep(0.1)
+    for id, values in emits.items():
+        print(f"{id}: {len(values) / changes:.1f} emits per max lumen change")
+    # A5 is the lumen in % of max lumen, and does not change with max lumen
+    transient = sum(1 for v in emits["A5"] if abs(v - emits["A5"][-1]) > 1e-9)
+    print(f"A5: {transient} transient values")
+    print(f"{(expressiongraph.evaluations - evaluations) / changes:.1f} evaluations per max lumen change")
+
+
+async def bench(evaluations: int = 200000) -> None:
+    await _load_enums()
+    exprs = _lumen_exprs()
+    subjects: dict[str, rx.AsyncSubject[RawEmit]] = {}
+    for id in list(exprs.keys()) + [id[0] + "2" for id in exprs.keys() if id[0] != "A"]:
+        subjects["1:" + id] = rx.AsyncSubject()
+        dv.rx_observables["1:" + id] = subjects["1:" + id]
+    for id, expr in exprs.items():
+        per_evaluation = _evaluations(expr, evaluations)
+        if not find_rx_observables(expr, "1"):
+            print(f"{id:4} {per_evaluation * 1e9:8.0f} ns/evaluation   constant")
+            continue
+        per_emit = await _emits(expr, subjects, evaluations // 10)
+        print(f"{id:4} {per_evaluation * 1e9:8.0f} ns/evaluation   {per_emit * 1e9:8.0f} ns/emit and tick through as_observable")
+    await _changes(100)
+
+
+if __name__ == '__main__':
+    import sys
+    asyncio.run(bench(*map(int, sys.argv[1:])))
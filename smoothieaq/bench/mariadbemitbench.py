@@ -0,0 +1,74 @@
+import asyncio
+import random
+import time as t
+
+import aiomysql
+from pymysql import TimestampFromTicks
+
+from ..div.emit import ObservableEmit
+from ..emitdriver.mariadbemitdriver import MariadbEmitDriver
+from ..model import thing as aqt
+
+# Sustained rows/s into MariaDB (or anything speaking the MySQL protocol), comparing a single connection doing
+# executemany per batch (as the driver used to) with the pooled, multi-row, pipelined MariadbEmitDriver:
+#   python -m smoothieaq.bench.mariadbemitbench [host] [port] [user] [password] [batches] [batch size]
+# Uses (and creates) the database smoothieaq_bench.
+
+_db = "smoothieaq_bench"
+
+
+def _batch(size: int, stamp: float) -> list[ObservableEmit]:
+    return [ObservableEmit(observable_id=f"{o % 300}:A", stamp=stamp, value=random.gauss(24, 1.5)) for o in range(size)]
+
+
+async def _single_connection(params: dict[str, str], batches: list[list[ObservableEmit]]) -> float:
+    connection = await aiomysql.connect(host=params['host'], port=int(params['port']), user=params['user'],
+                                        password=params['password'], db=_db)
+    t0 = t.perf_counter()
+    for emits in batches:
+        cur = await connection.cursor()
+        await cur.executemany(
+            "INSERT INTO smoothieaq_emits (observable_id, stamp, value, enumValue, note) VALUES (%s, %s, %s, %s, %s)",
+            [(e.observable_id, TimestampFromTicks(e.stamp), e.value, e.enumValue, e.note) for e in emits])
+        await connection.commit()
+        await cur.close()
+    elapsed = t.perf_counter() - t0
+    connection.close()
+    return elapsed
+
+
+async def _driver(params: dict[str, str], batches: list[list[ObservableEmit]], concurrent: int) -> float:
+    driver = MariadbEmitDriver(aqt.EmitDriver(id=MariadbEmitDriver.id))
+    await driver.init(_db, params | {'db': _db})
+    await driver.start()
+    t0 = t.perf_counter()
+    for i in range(0, len(batches), concurrent):
+        await asyncio.gather(*[driver.emit(emits) for emits in batches[i:i + concurrent]])
+    elapsed = t.perf_counter() - t0
+    await driver.stop()
+    return elapsed
+
+
+async def bench(host: str = '127.0.0.1', port: str = '3306', user: str = 'root', password: str = '',
+                batches: int = 200, batch_size: int = 1000) -> None:
+    params = {'host': host, 'port': port, 'user': user, 'password': password}
+    connection = await aiomysql.connect(host=host, port=int(port), user=user, password=password)
+    async with connection.cursor() as cur:
+        await cur.execute(f"CREATE DATABASE IF NOT EXISTS {_db}")
+    connection.close()
+
+    start = t.time() - batches
+    data = [_batch(int(batch_size), start + i) for i in range(int(batches))]
+    rows = int(batches) * int(batch_size)
+    await _driver(params, data[:1], 1)  # creates the tables
+    print(f"{rows} rows in {batches} batches of {batch_size}")
+    elapsed = await _single_connection(params, data)
+    print(f"single connection, executemany  {rows / elapsed:10.0f} rows/s")
+    for concurrent in [1, 4]:
+        elapsed = await _driver(params, data, concurrent)
+        print(f"pool, multi-row, {concurrent} batch(es) at a time {rows / elapsed:10.0f} rows/s")
+
+
+if __name__ == '__main__':
+    import sys
+    asyncio.run(bench(*sys.argv[1:]))
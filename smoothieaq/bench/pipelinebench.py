@@ -0,0 +1,166 @@
+import asyncio
+import gc
+import os
+import random
+import resource
+import tempfile
+import time as t
+import tracemalloc
+import smoothieaq.model.expression as ex
+from ..device import devices as dv
+from ..device import lastemits
+from ..div.emit import ObservableEmit, RawEmit
+from ..driver.driver import Driver
+from ..model import thing as aqt
+
+# Drives emits from synthetic device fleets through the whole observable pipeline (prefilter, require, status,
+# expressions, publish) to devices.rx_all_observables, and measures throughput, latency, CPU and memory:
+#   python -m smoothieaq.bench.pipelinebench [emits/s, 0 for as fast as possible] [seconds] [observables ...]
+#
+# Each device has a Measure with thresholds, an Amount, a State with an alarm value, all on their own MemoryDriver,
+# and a Measure and a State with an expression over the other observables of the device.
+
+_per_device = 5
+_tick = 0.01
+
+
+def _m_device(id: str) -> aqt.Device:
+    def driver() -> aqt.DriverRef:
+        return aqt.DriverRef(id="MemoryDriver")
+    return aqt.Device(id=id, name=f"Bench {id}", observables=[
+        aqt.Measure(id="A", name="temperature", driver=driver(), precision=0.01,
+                    require=aqt.ValueRequire(warningAbove=26., warningBelow=22., alarmAbove=28., alarmBelow=20.)),
+        aqt.Amount(id="B", name="dosed", driver=driver()),
+        aqt.State(id="C", name="pump", driver=driver(), require=aqt.EnumRequire(alarmIfIn=["off"])),
+        aqt.Measure(id="D", name="sum", expr=ex.BinaryOpExpr(
+            expr1=ex.ObservableExpr(observableRef="A"), op=ex.BinaryOp.ADD, expr2=ex.ObservableExpr(observableRef="B"))),
+        aqt.State(id="E", name="heater", expr=ex.IfExpr(
+            ifExpr=ex.BinaryOpExpr(expr1=ex.ObservableExpr(observableRef="A"), op=ex.BinaryOp.GT,
+                                   expr2=ex.ValueExpr(24.)),
+            thenExpr=ex.EnumValueExpr("off"), elseExpr=ex.EnumValueExpr("on"))),
+    ])
+
+
+def _emit(key: str, i: int) -> RawEmit:
+    if key == "A":
+        return RawEmit(value=random.gauss(24., 2.))
+    if key == "B":
+        return RawEmit(value=float(i))
+    return RawEmit(enumValue="off" if i % 50 == 0 else "on")
+
+
+def _percentile(sorted_values: list[float], p: float) -> float:
+    if not sorted_values:
+        return float('nan')
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+class _Fleet:
+
+    def __init__(self, first_device: int, observables: int) -> None:
+        self.ids = [str(d) for d in range(first_device, first_device + max(1, observables // _per_device))]
+        self.drivers: list[tuple[str, Driver]] = []
+        self.sent: dict[str, float] = {}
+        self.latencies: list[float] = []
+        self.received = 0
+
+    async def add(self) -> None:
+        for id in self.ids:
+            await dv._add_device(_m_device(id))
+            for key in "ABC":
+                observable = dv.get_observable(id + ":" + key)
+                self.drivers.append((observable.id, observable.driver))
+
+    async def stop(self) -> None:
+        for id in self.ids:
+            device = dv.devices.pop(id)
+            await device.stop()
+            del dv.rx_observables[device.status_id]
+            for observable in device.observables.values():
+                del dv.observables[observable.id]
+                del dv.rx_observables[observable.status_id]
+                dv.rx_observables.pop(observable.id, None)
+
+    async def on_emit(self, e: ObservableEmit) -> None:
+        self.received += 1
+        if (sent := self.sent.pop(e.observable_id, None)) is not None:
+            self.latencies.append(t.perf_counter() - sent)
+
+    async def settle(self, quiet: float = 0.5, at_most: float = 120) -> None:
+        # until the initial status and expression emits have passed through
+        end = t.perf_counter() + at_most
+        received = -1
+        while received != self.received and t.perf_counter() < end:
+            received = self.received
+            await asyncio.sleep(quiet)
+        self.received = 0
+        self.sent.clear()
+
+    async def drive(self, rate: float, seconds: float) -> int:
+        # round-robin over the driver observables, at rate emits/s in ticks of _tick seconds, or as fast as possible
+        emits = 0
+        end = t.perf_counter() + seconds
+        per_tick = max(1, int(rate * _tick)) if rate else 500
+        next_tick = t.perf_counter()
+        while (now := t.perf_counter()) < end:
+            if rate and now < next_tick:
+                await asyncio.sleep(next_tick - now)
+            next_tick += _tick
+            for _ in range(per_tick):
+                (id, driver) = self.drivers[emits % len(self.drivers)]
+                self.sent[id] = t.perf_counter()
+                await driver._rx_observers['A'].asend(_emit(id[-1], emits))
+                emits += 1
+            if not rate:
+                await asyncio.sleep(0)
+        await asyncio.sleep(0.2)  # debounced require and expression emits
+        return emits
+
+
+async def _run(first_device: int, observables: int, rate: float, seconds: float) -> None:
+    fleet = _Fleet(first_device, observables)
+    disposable = await dv.rx_all_observables.subscribe_async(fleet.on_emit)
+    tasks = len(asyncio.all_tasks())
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    t0 = t.perf_counter()
+    await fleet.add()
+    await fleet.settle()
+    setup = t.perf_counter() - t0
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    tasks = len(asyncio.all_tasks()) - tasks
+
+    cpu = t.process_time()
+    wall = t.perf_counter()
+    emits = await fleet.drive(rate, seconds)
+    wall = t.perf_counter() - wall
+    cpu = t.process_time() - cpu
+    await disposable.dispose_async()
+
+    latencies = sorted(fleet.latencies)
+    n = len(fleet.ids) * _per_device
+    print(f"{n:6} observables  {emits / wall:8.0f} emits/s in  {fleet.received / wall:8.0f} emits/s out  "
+          f"p50 {_percentile(latencies, .5) * 1e3:7.2f} ms  p99 {_percentile(latencies, .99) * 1e3:7.2f} ms  "
+          f"cpu {cpu / wall * 100:4.0f}%  {size / n / 1e3:6.1f} kB and {tasks / n:4.1f} tasks/observable  (setup {setup:.1f} s)")
+    await fleet.stop()
+
+
+async def bench(rate: float = 5000, seconds: float = 5, *sizes: int) -> None:
+    lastemits.file = os.path.join(tempfile.gettempdir(), "smoothieaq-bench-last-emits.json")
+    await dv.init()
+    first_device = 1
+    for observables in sizes or (10, 100, 1000, 10000):
+        await _run(first_device, observables, rate, seconds)
+        first_device += observables
+    await lastemits.stop()
+    print(f"max rss {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3:.0f} MB")
+
+
+if __name__ == '__main__':
+    import logging
+    import sys
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(bench(*map(float, sys.argv[1:3]), *map(int, sys.argv[3:])))
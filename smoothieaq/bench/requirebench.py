@@ -0,0 +1,54 @@
+import asyncio
+import gc
+import random
+import time as t
+
+from ..device import devices as dv
+from ..div.emit import RawEmit
+from ..model import thing as aqt
+
+# Cost of the require (warning/alarm limits) of Measures, subscriptions and tasks per observable and time per emit,
+# with values hovering around a limit:
+#   python -m smoothieaq.bench.requirebench [observables] [emits]
+
+
+def _m_device(id: str) -> aqt.Device:
+    return aqt.Device(id=id, name=f"Bench {id}", observables=[
+        aqt.Measure(id="A", name="temperature", driver=aqt.DriverRef(id="MemoryDriver"),
+                    require=aqt.ValueRequire(warningAbove=26., warningBelow=22., alarmAbove=28., alarmBelow=20.,
+                                             hysteresis=0.2))
+    ])
+
+
+async def bench(observables: int = 200, emits: int = 50000) -> None:
+    gc.collect()
+    tasks = len(asyncio.all_tasks())
+    for i in range(observables):
+        await dv._add_device(_m_device(str(i + 1)))
+    await asyncio.sleep(0.5)
+    tasks = len(asyncio.all_tasks()) - tasks
+    subscriptions = sum(len(o.rx_observable.subject._observers) for o in dv.observables.values()) / observables
+    statuses = 0
+
+    async def status(_) -> None:
+        nonlocal statuses
+        statuses += 1
+    for o in dv.observables.values():
+        await o.rx_status_observable.subscribe_async(status)
+
+    drivers = [o.driver._rx_observers['A'] for o in dv.observables.values()]
+    t0 = t.perf_counter()
+    for i in range(emits):
+        await drivers[i % observables].asend(RawEmit(value=26. + random.uniform(-0.1, 0.1)))
+        if i % 100 == 0:
+            await asyncio.sleep(0)
+    elapsed = t.perf_counter() - t0
+    await asyncio.sleep(0.5)
+    print(f"{observables} Measures with 4 limits: {subscriptions:.0f} subscriptions on rx_observable and "
+          f"{tasks / observables:.1f} tasks per observable, {elapsed / emits * 1e6:.1f} us per emit, "
+          f"{statuses / observables:.1f} status changes per observable")
+
+
+if __name__ == '__main__':
+    import sys
+    asyncio.run(bench(*map(int, sys.argv[1:])))
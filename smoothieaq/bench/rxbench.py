@@ -0,0 +1,83 @@
+import asyncio
+import gc
+import time as t
+import tracemalloc
+from typing import Callable
+
+import aioreactive as rx
+
+from ..util import rxutil
+
+# Emits/sec through an operator and memory per subscription, for the operators in util/rxutil and the aioreactive
+# operators they replace:
+#   python -m smoothieaq.bench.rxbench [emits] [subscriptions]
+
+_operators: list[tuple[str, Callable[[], Callable[[rx.AsyncObservable], rx.AsyncObservable]]]] = [
+    ("aioreactive distinct_until_changed", lambda: rx.distinct_until_changed),
+    ("rxutil distinct_until_changed", lambda: rxutil.distinct_until_changed()),
+    ("aioreactive debounce", lambda: rx.debounce(0.5)),
+    ("rxutil debounce", lambda: rxutil.debounce(0.5)),
+    ("rxutil throttle", lambda: rxutil.throttle(0.5)),
+    ("aioreactive interval with_latest_from", lambda: lambda source: rx.pipe(
+        rx.interval(0.5, 0.5), rx.with_latest_from(source), rx.map(lambda t: t[1]))),
+    ("rxutil sample", lambda: rxutil.sample(0.5)),
+    ("rxutil buffer_with_time", lambda: rxutil.buffer_with_time(0.5, 1000)),
+]
+
+
+async def _settle() -> None:
+    for _ in range(20):
+        await asyncio.sleep(0)
+
+
+async def _throughput(op: Callable[[rx.AsyncObservable], rx.AsyncObservable], emits: int) -> float:
+    source: rx.AsyncSubject[float] = rx.AsyncSubject()
+    received = 0
+
+    async def count(_) -> None:
+        nonlocal received
+        received += 1
+    disposable = await rx.pipe(source, op).subscribe_async(count)
+    t0 = t.perf_counter()
+    for i in range(emits):
+        await source.asend(float(i // 2))  # every value twice
+        if i % 100 == 0:
+            await asyncio.sleep(0)
+    await _settle()
+    elapsed = t.perf_counter() - t0
+    await disposable.dispose_async()
+    await asyncio.sleep(1)  # pending timers
+    return emits / elapsed
+
+
+async def _memory(op: Callable[[rx.AsyncObservable], rx.AsyncObservable], subscriptions: int) -> tuple[float, int]:
+    async def nothing(_) -> None:
+        pass
+    source: rx.AsyncSubject[float] = rx.AsyncSubject()
+    gc.collect()
+    tasks = len(asyncio.all_tasks())
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    disposables = [await rx.pipe(source, op).subscribe_async(nothing) for _ in range(subscriptions)]
+    await source.asend(1.)
+    await _settle()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    tasks = len(asyncio.all_tasks()) - tasks
+    for disposable in disposables:
+        await disposable.dispose_async()
+    await _settle()
+    return size / subscriptions, tasks // subscriptions
+
+
+async def bench(emits: int = 100000, subscriptions: int = 1000) -> None:
+    for name, op in _operators:
+        per_second = await _throughput(op(), emits)
+        size, tasks = await _memory(op(), subscriptions)
+        print(f"{name:36} {per_second:10.0f} emits/s   {size:8.0f} bytes and {tasks} tasks per subscription")
+
+
+if __name__ == '__main__':
+    import sys
+    asyncio.run(bench(*map(int, sys.argv[1:])))
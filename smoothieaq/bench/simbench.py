@@ -0,0 +1,67 @@
+import asyncio
+import datetime as dt
+import hashlib
+import random
+import time as t
+
+from ..device import devices as dv
+from ..div import time
+from ..div.emit import ObservableEmit
+from ..model import thing as aqt
+from ..model.step import Program, ProgramValue, Transition
+
+# A week of a light's daily schedule with s-shaped ramps, and a TimeDriver ticking every minute, simulated on virtual
+# time, twice, to show it runs in seconds and the same every time:
+#   python -m smoothieaq.bench.simbench [days]
+
+
+def _m_device() -> aqt.Device:
+    return aqt.Device(id="1", name="Light", observables=[
+        aqt.Amount(id="R2", name="red", driver=aqt.DriverRef(id="MemoryDriver")),
+        aqt.Amount(id="G2", name="green", driver=aqt.DriverRef(id="MemoryDriver")),
+        aqt.Measure(id="C", name="clock", driver=aqt.DriverRef(id="TimeDriver")),
+    ], schedules=[
+        aqt.Schedule(id="1", at=aqt.AtWeekday(at="8:30"), program=Program(
+            length="10:00:00", values=[ProgramValue(id="R2", value=80.), ProgramValue(id="G2", value=100.)],
+            transition=Transition(type="s", length="30:00", step=1)))
+    ])
+
+
+async def _simulate(days: int) -> list[ObservableEmit]:
+    random.seed(1)
+    await dv._add_device(_m_device())
+    device = dv.get_device("1")
+    emits: list[ObservableEmit] = []
+
+    async def on_emit(e: ObservableEmit) -> None:
+        emits.append(e)
+    disposable = await device.rx_all_observables.subscribe_async(on_emit)
+    await asyncio.sleep(days * 24 * 60 * 60)
+    await disposable.dispose_async()
+
+    await dv.devices.pop("1").stop()
+    del dv.rx_observables[device.status_id]
+    for observable in device.observables.values():
+        del dv.observables[observable.id]
+        del dv.rx_observables[observable.status_id]
+        dv.rx_observables.pop(observable.id, None)
+    return emits
+
+
+def bench(days: int = 7) -> None:
+    digests = []
+    for _ in range(2):
+        t0 = t.perf_counter()
+        emits = time.run_virtual(_simulate(days), dt.date(2024, 1, 1), dt.time(0, 0))
+        elapsed = t.perf_counter() - t0
+        digests.append(hashlib.sha256(repr([(e.observable_id, e.stamp, e.value, e.enumValue, e.note)
+                                            for e in emits]).encode()).hexdigest())
+        count = dict((id, sum(1 for e in emits if e.observable_id == id))
+                     for id in sorted(set(e.observable_id for e in emits)))
+        print(f"{days} days in {elapsed:.1f} s: {len(emits)} emits {count}")
+    print(f"identical runs: {digests[0] == digests[1]}")
+
+
+if __name__ == '__main__':
+    import sys
+    bench(*map(int, sys.argv[1:]))
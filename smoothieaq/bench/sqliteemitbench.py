@@ -0,0 +1,66 @@
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time as t
+
+from ..div.emit import ObservableEmit
+from ..emitdriver.sqliteemitdriver import SqliteEmitDriver
+from ..model import thing as aqt
+
+# Compares the old heap table with the indexed layout of SqliteEmitDriver:
+#   python -m smoothieaq.bench.sqliteemitbench [observables] [emits per observable]
+
+
+def _emits(observables: int, per_observable: int, start: float) -> list[ObservableEmit]:
+    return [
+        ObservableEmit(observable_id=f"{o}:A", stamp=start + i * 60, value=random.gauss(24, 1.5))
+        for i in range(per_observable) for o in range(observables)
+    ]
+
+
+async def _bench(layout: str, emits: list[ObservableEmit], observables: int, start: float, end: float) -> None:
+    db_file = os.path.join(tempfile.gettempdir(), f"smoothieaq-bench-{layout}.db")
+    for f in [db_file, db_file + "-wal", db_file + "-shm"]:
+        if os.path.exists(f):
+            os.remove(f)
+    driver = SqliteEmitDriver(aqt.EmitDriver(id=SqliteEmitDriver.id))
+    await driver.init(layout, {'db_file': db_file, 'layout': layout})
+    await driver.start()
+
+    batch = 1000
+    t0 = t.perf_counter()
+    for i in range(0, len(emits), batch):
+        await driver.emit(emits[i:i + batch])
+        await asyncio.sleep(0)
+    await driver.flush()
+    insert_time = t.perf_counter() - t0
+
+    latencies = []
+    rows = 0
+    for _ in range(50):
+        o = random.randrange(observables)
+        frm = random.uniform(start, end - 3600)
+        t1 = t.perf_counter()
+        async for _ in driver.history(f"{o}:A", frm, frm + 3600):
+            rows += 1
+        latencies.append(t.perf_counter() - t1)
+
+    await driver.stop()
+    print(f"{layout:8} {len(emits) / insert_time:10.0f} inserts/s   "
+          f"range query (1h, {rows / 50:.0f} rows) p50 {statistics.median(latencies) * 1000:8.2f} ms   "
+          f"max {max(latencies) * 1000:8.2f} ms   file {os.path.getsize(db_file) / 1e6:.1f} MB")
+
+
+async def bench(observables: int = 300, per_observable: int = 1000) -> None:
+    start = t.time() - per_observable * 60
+    emits = _emits(observables, per_observable, start)
+    print(f"{len(emits)} emits from {observables} observables")
+    for layout in ['heap', 'indexed']:
+        await _bench(layout, emits, observables, start, start + per_observable * 60)
+
+
+if __name__ == '__main__':
+    import sys
+    asyncio.run(bench(*map(int, sys.argv[1:])))
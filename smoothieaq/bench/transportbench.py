@@ -0,0 +1,64 @@
+import json
+import random
+import sys
+import time as t
+
+from ..div import binarytransport
+from ..div.emit import ObservableEmit, emit_to_transport
+
+# Bytes and server CPU of sending emits to a websocket client in batches of 20, as JSON lists, as send_json does, and
+# in the binary transport. Measures with 1 or 2 decimals, and a status change now and then:
+#   python -m smoothieaq.bench.transportbench [observables] [emits] [emits per second]
+
+
+def _emits(observables: int, emits: int, rate: float) -> list[ObservableEmit]:
+    random.seed(1)
+    ids = [f"{1 + o // 6}:{'ABCDEF'[o % 6]}" for o in range(observables)]
+    values = [random.uniform(5, 30) for _ in ids]
+    stamp = 1_700_000_000.
+    result = []
+    for _ in range(emits):
+        stamp += random.expovariate(rate)
+        o = random.randrange(observables)
+        if random.random() < 0.02:
+            result.append(ObservableEmit(observable_id=ids[o] + '?', stamp=stamp,
+                                         enumValue=random.choice(["running", "paused", "warning", "alarm"])))
+        else:
+            values[o] += random.gauss(0, 0.1)
+            result.append(ObservableEmit(observable_id=ids[o], stamp=stamp, value=round(values[o], 1 + o % 2)))
+    return result
+
+
+def _json(emits: list[ObservableEmit]) -> list[bytes]:
+    return [json.dumps([emit_to_transport(e) for e in emits[i:i + 20]], separators=(",", ":"),
+                       ensure_ascii=False).encode() for i in range(0, len(emits), 20)]
+
+
+def _binary(emits: list[ObservableEmit]) -> list[bytes]:
+    encoder = binarytransport.Encoder()
+    return [encoder.encode(emits[i:i + 20]) for i in range(0, len(emits), 20)]
+
+
+def bench(observables: int = 200, emits: int = 100000, rate: float = 50.) -> None:
+    for name, encode in [("json", _json), ("binary", _binary)]:
+        es = _emits(observables, emits, rate)  # new, as emit_to_transport keeps what it made
+        t0 = t.process_time()
+        frames = encode(es)
+        cpu = t.process_time() - t0
+        size = sum(len(f) for f in frames)
+        print(f"{name:6}: {size / emits:5.1f} bytes per emit, {size / emits * rate:7.0f} bytes/s at {rate:.0f} emits/s, "
+              f"{cpu / emits * 1e6:.2f} us CPU per emit")
+    decoded = binarytransport.Decoder()
+    back = [e for f in _binary(_emits(observables, emits, rate)) for e in decoded.decode(f)]
+    same = all((a.observable_id, stamp_rounded(a), a.value, a.enumValue) == (b.observable_id, stamp_rounded(b), b.value,
+                                                                            b.enumValue)
+               for a, b in zip(_emits(observables, emits, rate), back))
+    print(f"binary decodes to the same emits: {same and len(back) == emits}")
+
+
+def stamp_rounded(e: ObservableEmit) -> int:
+    return int(e.stamp * 10)
+
+
+if __name__ == '__main__':
+    bench(*map(int, sys.argv[1:2]), *map(int, sys.argv[2:3]), *map(float, sys.argv[3:4]))
@@ -1,4 +1,5 @@
 import logging
+import sys
 from typing import Optional
 
 import aioreactive as rx
@@ -7,7 +8,7 @@ from .observable import Observable, driver_init, Status, Measure, Amount, State,
 from ..div.emit import ObservableEmit, RawEmit, emit_enum_value, emit_raw_fun, emit_empty
 from ..driver.driver import Driver, Status as DriverStatus
 from ..model import thing as aqt
-from ..util.rxutil import AsyncBehaviorSubject, publish, throw_it
+from ..util.rxutil import AsyncBehaviorSubject, publish, distinct_until_changed, throw_it, combine_latest, merge_inner
 
 log = logging.getLogger(__name__)
 
@@ -47,7 +48,7 @@ class Device:
     def init(self, m_device: aqt.Device) -> 'Device':
         self.m_device = m_device
         self.id = m_device.id
-        self.status_id = self.id + '?'
+        self.status_id = sys.intern(self.id + '?')
 
         if self.m_device.enablement == 'enabled':
             s: rx.AsyncObservable[RawEmit]
@@ -57,8 +58,8 @@ class Device:
             else:
                 s = AsyncBehaviorSubject(RawEmit(enumValue=DriverStatus.RUNNING))
 
-            def status(t: tuple[tuple[bool, RawEmit], RawEmit]) -> RawEmit:
-                ((paused, scheduled), driver_status) = t
+            def status(t: list) -> RawEmit:
+                (paused, scheduled, driver_status) = t
                 log.debug(f"evaluating device.status({self.id}, {paused}, {scheduled}, {driver_status}")
                 # print("dev stat",self.id, paused,driver_status)
                 if paused:
@@ -72,11 +73,8 @@ class Device:
                     return RawEmit(enumValue=Status.INITIALIZING)
 
             self.rx_status_observable = rx.pipe(
-                self._rx_paused,
-                rx.combine_latest(self._rx_scheduled),
-                rx.combine_latest(s),
-                rx.map(status),
-                rx.distinct_until_changed,
+                combine_latest([self._rx_paused, self._rx_scheduled, s], status),
+                distinct_until_changed(),
                 rx.map(emit_raw_fun(self.status_id)),
                 publish()
             )
@@ -108,7 +106,7 @@ class Device:
             rx.from_iterable(([self.rx_status_observable] +
                               [o for ob in self.observables.values() for o in
                                [ob.rx_observable, ob.rx_status_observable]])),
-            rx.merge_inner()
+            merge_inner()
         )
 
         return self
@@ -8,10 +8,11 @@ from ..driver.discover import discover as ds, discovers as dss
 from ..model.globals import Globals
 from ..model.thing import DriverRef
 from ..modelobject import objectstore as os
+from . import lastemits, valuetable, recent, journal, expressiongraph
 from .device import Device, Observable
 from ..div.emit import ObservableEmit, emit_empty
 from ..model import thing as aqt
-from ..util.rxutil import ix
+from ..util.rxutil import ix, AsyncPublishSubject, merge_inner
 
 devices: dict[str, Device] = dict()
 device_paths: dict[str, str] = dict()
@@ -20,17 +21,22 @@ rx_observables: dict[str, rx.AsyncObservable[ObservableEmit]] = dict()
 discovers: dict[str, ds.Discover] = dict()
 
 _rx_all_subject: rx.AsyncSubject[rx.AsyncObservable[ObservableEmit]] = rx.AsyncSubject()
-rx_all_observables: AsyncMultiSubject[ObservableEmit] = AsyncMultiSubject()
+rx_all_observables: AsyncMultiSubject[ObservableEmit] = AsyncPublishSubject()
 
 _rx_device_updates: rx.AsyncSubject[aqt.Device] = rx.AsyncSubject()
 
 
 async def init() -> None:
-    _never_dispose = await rx.pipe(_rx_all_subject, rx.merge_inner()).subscribe_async(rx_all_observables)
+    lastemits.load()
+    _never_dispose_journal = await rx_all_observables.subscribe_async(journal.asend)
+    _never_dispose_table = await rx_all_observables.subscribe_async(valuetable.asend)
+    _never_dispose_recent = await rx_all_observables.subscribe_async(recent.asend)
+    _never_dispose = await rx.pipe(_rx_all_subject, merge_inner()).subscribe_async(rx_all_observables)
+    await lastemits.start(lambda: (o.current_value for o in observables.values()))
 
 
 def get_last_emit(observable_id: str) -> ObservableEmit:
-    return emit_empty(observable_id)  # TODO
+    return lastemits.get(observable_id) or emit_empty(observable_id)
 
 async def add_discovers() -> None:
     for driver in (await os.get(Globals, "globals")).discovers:
@@ -54,6 +60,7 @@ async def _add_device(m_device: aqt.Device, start: bool = True) -> None:
     for m_observable in m_device.observables:
         if not m_observable.enablement:
             m_observable.enablement = 'enabled'
+    expressiongraph.invalidate([m_device.id + ':' + m_observable.id for m_observable in m_device.observables])
     device = Device()
     device.init(m_device)
     devices[m_device.id] = device
@@ -88,6 +95,7 @@ async def update_device(m_device: aqt.Device) -> None:
 
 
 async def stop() -> None:
+    await lastemits.stop()
     for discover in discovers.values():
         await discover.stop()
     for device in devices.values():
@@ -1,47 +1,62 @@
+import logging
 from copy import deepcopy
-from typing import Callable, cast
+from typing import Callable, Optional, cast
 
 import aioreactive as rx
 from expression.collections import Block, Map
 
 from ..div.emit import RawEmit
 from . import devices as dv
-from ..div.enums import convert
+from ..div.enums import converter
 from ..model import expression as aqe
-from ..util.rxutil import distinct_until_changed, sample, AsyncBehaviorSubject, ix, trace
+from ..util.rxutil import distinct_until_changed, debounce, throttle, sample, AsyncBehaviorSubject, trace
 
-_unaries: dict[aqe.UnaryOp, Callable[[RawEmit], RawEmit]] = {
-    aqe.UnaryOp.NOT: lambda e: RawEmit(value=0.0 if e.value else 1.0),
-    aqe.UnaryOp.NEGATE: lambda e: RawEmit(value=-e.value)
+log = logging.getLogger(__name__)
+
+# Expressions are compiled once into closures over a slot list with the latest RawEmit of each observable the
+# expression uses. Inner nodes work on plain values, a float or an enum value string (or None), and only the root
+# makes a RawEmit.
+
+_Slots = list[RawEmit]
+_Value = Optional[float | str]
+
+
+def _is_number(v: _Value) -> bool:
+    return v is not None and v.__class__ is not str
+
+
+def _truth(v: _Value) -> bool:
+    return v.__class__ is not str and bool(v)
+
+
+def _compare(f: Callable[[_Value, _Value], bool]) -> Callable[[_Value, _Value], float]:
+    # numbers with numbers and enum values with enum values, anything else is false
+    return lambda v1, v2: float(f(v1, v2) if v1 is not None and v2 is not None and
+                                (v1.__class__ is str) == (v2.__class__ is str) else False)
+
+
+def _arithmetic(f: Callable[[float, float], float]) -> Callable[[_Value, _Value], _Value]:
+    return lambda v1, v2: f(v1, v2) if _is_number(v1) and _is_number(v2) else None
+
+
+_unaries: dict[aqe.UnaryOp, Callable[[_Value], _Value]] = {
+    aqe.UnaryOp.NOT: lambda v: 0.0 if _truth(v) else 1.0,
+    aqe.UnaryOp.NEGATE: lambda v: -v
 }
-_binaries: dict[aqe.BinaryOp, Callable[[RawEmit, RawEmit], RawEmit]] = {
-    aqe.BinaryOp.AND: lambda e1, e2: RawEmit(value=float(e1.value and e2.value)),
-    aqe.BinaryOp.OR: lambda e1, e2: RawEmit(value=float(e1.value or e2.value)),
-    # aqe.BinaryOp.XOR: lambda e1, e2: RawEmit(value=e1.value xor e2.value),
-    aqe.BinaryOp.EQ: lambda e1, e2: RawEmit(
-        value=float(e1.value == e2.value if e1.value or e2.value else e1.enumValue == e2.enumValu)),
-    aqe.BinaryOp.NE: lambda e1, e2: RawEmit(
-        value=float(e1.value != e2.value if e1.value or e2.value else e1.enumValue != e2.enumValu)),
-    aqe.BinaryOp.GT: lambda e1, e2: RawEmit(
-        value=float(e1.value > e2.value if e1.value and e2.value
-                    else e1.enumValue is not None and e2.enumValue is not None and e1.enumValue > e2.enumValu)),
-    aqe.BinaryOp.GE: lambda e1, e2: RawEmit(
-        value=float(e1.value >= e2.value if e1.value and e2.value
-                    else e1.enumValue is not None and e2.enumValue is not None and e1.enumValue >= e2.enumValu)),
-    aqe.BinaryOp.LT: lambda e1, e2: RawEmit(
-        value=float(e1.value < e2.value if e1.value and e2.value
-                    else e1.enumValue is not None and e2.enumValue is not None and e1.enumValue < e2.enumValu)),
-    aqe.BinaryOp.LE: lambda e1, e2: RawEmit(
-        value=float(e1.value <= e2.value if e1.value and e2.value
-                    else e1.enumValue is not None and e2.enumValue is not None and e1.enumValue == e2.enumValu)),
-    aqe.BinaryOp.ADD: lambda e1, e2: RawEmit(value=e1.value + e2.value) if (
-        e1.value is not None and e2.value is not None) else RawEmit(),
-    aqe.BinaryOp.SUBTRACT: lambda e1, e2: RawEmit(value=e1.value - e2.value) if (
-        e1.value is not None and e2.value is not None) else RawEmit(),
-    aqe.BinaryOp.MULTIPLY: lambda e1, e2: RawEmit(value=e1.value * e2.value) if (
-        e1.value is not None and e2.value is not None) else RawEmit(),
-    aqe.BinaryOp.DIVIDE: lambda e1, e2: RawEmit(value=e1.value / e2.value) if (
-        e1.value is not None and e2.value is not None) else RawEmit(),
+_binaries: dict[aqe.BinaryOp, Callable[[_Value, _Value], _Value]] = {
+    aqe.BinaryOp.AND: lambda v1, v2: float(_truth(v1) and _truth(v2)),
+    aqe.BinaryOp.OR: lambda v1, v2: float(_truth(v1) or _truth(v2)),
+    aqe.BinaryOp.XOR: lambda v1, v2: float(_truth(v1) != _truth(v2)),
+    aqe.BinaryOp.EQ: lambda v1, v2: float(v1 == v2),
+    aqe.BinaryOp.NE: lambda v1, v2: float(v1 != v2),
+    aqe.BinaryOp.GT: _compare(lambda v1, v2: v1 > v2),
+    aqe.BinaryOp.GE: _compare(lambda v1, v2: v1 >= v2),
+    aqe.BinaryOp.LT: _compare(lambda v1, v2: v1 < v2),
+    aqe.BinaryOp.LE: _compare(lambda v1, v2: v1 <= v2),
+    aqe.BinaryOp.ADD: _arithmetic(lambda v1, v2: v1 + v2),
+    aqe.BinaryOp.SUBTRACT: _arithmetic(lambda v1, v2: v1 - v2),
+    aqe.BinaryOp.MULTIPLY: _arithmetic(lambda v1, v2: v1 * v2),
+    aqe.BinaryOp.DIVIDE: _arithmetic(lambda v1, v2: v1 / v2),
 }
 _rxOps0: dict[aqe.RxOp0, Callable[[], Callable[[rx.AsyncObservable[RawEmit]], rx.AsyncObservable[RawEmit]]]] = {
     aqe.RxOp0.DISTINCT: lambda: distinct_until_changed(comparer=lambda e1, e2: (
@@ -51,8 +66,8 @@ _rxOps0: dict[aqe.RxOp0, Callable[[], Callable[[rx.AsyncObservable[RawEmit]], rx
     ))
 }
 _rxOps1: dict[aqe.RxOp1, Callable[[float], Callable[[rx.AsyncObservable[RawEmit]], rx.AsyncObservable[RawEmit]]]] = {
-    aqe.RxOp1.DEBOUNCE: lambda a: rx.debounce(a),
-    #aqe.RxOp1.THROTTLE: lambda a: op.throttle_with_timeout(a)
+    aqe.RxOp1.DEBOUNCE: lambda a: debounce(a),
+    aqe.RxOp1.THROTTLE: lambda a: throttle(a),
 }
 
 
@@ -105,14 +120,12 @@ def find_rx_observables(expr: aqe.Expr, device_id: str) -> dict[str, rx.AsyncObs
                         from .observable import Chore
                         do = cast(Chore, dv.get_observable(elms[0]))
                         if not do or not do.inputs or not do.inputs[elms[1]]:
-                            from .observable import log
                             note = f"Could not find step {elms[1]} in chore {elms[0]} used in expression on device {device_id}"
                             log.error(note)
                             return AsyncBehaviorSubject(RawEmit(note=note))
                         return do.inputs[elms[1]]
                     o = dv.get_rx_observable(id)
                     if not o:
-                        from .observable import log
                         note = f"Could not find observable {id} used in expression on device {device_id}"
                         log.error(note)
                         return AsyncBehaviorSubject(RawEmit(note=note))
@@ -124,44 +137,104 @@ def find_rx_observables(expr: aqe.Expr, device_id: str) -> dict[str, rx.AsyncObs
     return rx_observables
 
 
-def evaluate(expr: aqe.Expr, vals: Map[str, RawEmit]) -> RawEmit:
-    def eval(expr: aqe.Expr) -> RawEmit:
+def _slot_label(expr: aqe.Expr) -> Optional[str]:
+    # the key of the expressions that are inputs, as found by find_rx_observables
+    if isinstance(expr, (aqe.RxOp0Expr, aqe.RxOp1Expr, aqe.OnExpr)):
+        return expr._label
+    if isinstance(expr, aqe.ObservableExpr):
+        return expr.observableRef
+    return None
+
+
+def _constant(expr: aqe.Expr) -> tuple[bool, _Value]:
+    if isinstance(expr, aqe.ValueExpr):
+        return True, expr.value
+    if isinstance(expr, aqe.EnumValueExpr):
+        return True, expr.enumValue
+    if isinstance(expr, aqe.NoneExpr) or expr is None:
+        return True, None
+    return False, None
+
+
+def _compile_value(expr: aqe.Expr, slots: dict[str, int]) -> Callable[[_Slots], _Value]:
+    if (label := _slot_label(expr)) is not None:
+        i = slots[label]
+
+        def slot(s: _Slots) -> _Value:
+            e = s[i]
+            return e.value if e.value is not None else e.enumValue
+        return slot
+    (is_constant, constant) = _constant(expr)
+    if is_constant:
+        return lambda s: constant
+    if isinstance(expr, aqe.UnaryOpExpr):
+        (op, f) = (_unaries[expr.op], _compile_value(expr.expr, slots))
+        return lambda s: op(f(s))
+    if isinstance(expr, aqe.ConvertExpr):
+        (c, f) = (converter(expr.quantity, expr.fromUnit, expr.toUnit), _compile_value(expr.expr, slots))
+        return lambda s: c(f(s))
+    if isinstance(expr, aqe.BinaryOpExpr):
+        op = _binaries[expr.op]
+        (is_constant1, constant1) = _constant(expr.expr1)
+        (is_constant2, constant2) = _constant(expr.expr2)
+        if is_constant2:
+            f1 = _compile_value(expr.expr1, slots)
+            return lambda s: op(f1(s), constant2)
+        f2 = _compile_value(expr.expr2, slots)
+        if is_constant1:
+            return lambda s: op(constant1, f2(s))
+        f1 = _compile_value(expr.expr1, slots)
+        return lambda s: op(f1(s), f2(s))
+    if isinstance(expr, aqe.IfExpr):
+        (fi, ft, fe) = (_compile_value(expr.ifExpr, slots), _compile_value(expr.thenExpr, slots),
+                        _compile_value(expr.elseExpr, slots))
+        return lambda s: ft(s) if _truth(fi(s)) else fe(s)
+    if isinstance(expr, aqe.WhenExpr):
+        whens = [(_compile_value(w.ifExpr, slots), _compile_value(w.thenExpr, slots)) for w in expr.whens]
+        fe = _compile_value(expr.elseExpr, slots)
+
+        def when(s: _Slots) -> _Value:
+            for (fi, ft) in whens:
+                if _truth(fi(s)):
+                    return ft(s)
+            return fe(s)
+        return when
+    raise Exception(f"Can't handle expression {expr}")
+
+
+def _as_emit(v: _Value) -> RawEmit:
+    return RawEmit(enumValue=v) if v.__class__ is str else RawEmit(value=v)
+
+
+def _compile_emit(expr: aqe.Expr, slots: dict[str, int]) -> Callable[[_Slots], RawEmit]:
+    # as _compile_value, but the emit of an observable passes through with its note
+    if (label := _slot_label(expr)) is not None:
+        i = slots[label]
+        return lambda s: s[i]
+    if isinstance(expr, aqe.IfExpr):
+        (fi, ft, fe) = (_compile_value(expr.ifExpr, slots), _compile_emit(expr.thenExpr, slots),
+                        _compile_emit(expr.elseExpr, slots))
+        return lambda s: ft(s) if _truth(fi(s)) else fe(s)
+    f = _compile_value(expr, slots)
+    return lambda s: _as_emit(f(s))
+
+
+def compile_expr(expr: aqe.Expr, slots: dict[str, int]) -> Callable[[_Slots], RawEmit]:
+    # slots is the index in the slot list of each key from find_rx_observables
+    f = _compile_emit(expr, slots)
+
+    def evaluate(s: _Slots) -> RawEmit:
         try:
-            if isinstance(expr, aqe.UnaryOpExpr):
-                return _unaries[expr.op](eval(expr.expr))
-            if isinstance(expr, aqe.ConvertExpr):
-                return RawEmit(value=convert(eval(expr.expr).value, expr.quantity, expr.fromUnit, expr.toUnit))
-            if isinstance(expr, aqe.BinaryOpExpr):
-                # print(expr.op.name, eval(expr.expr1), eval(expr.expr2), _binaries[expr.op](eval(expr.expr1), eval(expr.expr2)), expr)
-                return _binaries[expr.op](eval(expr.expr1), eval(expr.expr2))
-            if isinstance(expr, aqe.IfExpr):
-                return eval(expr.thenExpr) if eval(expr.ifExpr).value else eval(expr.elseExpr)
-            if isinstance(expr, aqe.WhenExpr):
-                for when in expr.whens:
-                    if eval(when.ifExpr).value:
-                        return eval(when.thenExpr)
-                return eval(expr.elseExpr)
-            if isinstance(expr, aqe.RxOp0Expr):
-                return vals[expr._label]
-            if isinstance(expr, aqe.RxOp1Expr):
-                return vals[expr._label]
-            if isinstance(expr, aqe.OnExpr):
-                return vals[expr._label]
-            if isinstance(expr, aqe.ObservableExpr):
-                return vals[expr.observableRef]
-            if isinstance(expr, aqe.EnumValueExpr):
-                return RawEmit(enumValue=expr.enumValue)
-            if isinstance(expr, aqe.ValueExpr):
-                return RawEmit(value=expr.value)
-            from .observable import log
-            log.error(f"Can't handle expression {expr}")
-            return RawEmit()
+            return f(s)
         except Exception as e:
-            from .observable import log
             log.error(f"Error evaluating {expr}", exc_info=e)
             return RawEmit(note=f"Error evaluating {expr}")
+    return evaluate
 
-    return eval(expr)
+
+def evaluate(expr: aqe.Expr, vals: Map[str, RawEmit]) -> RawEmit:
+    ids = list(vals.keys())
+    return compile_expr(expr, dict((id, i) for i, id in enumerate(ids)))([vals[id] for id in ids])
 
 
 def as_observable(expr: aqe.Expr, device_id: str) -> rx.AsyncObservable[RawEmit]:
@@ -177,20 +250,9 @@ def as_observable(expr: aqe.Expr, device_id: str) -> rx.AsyncObservable[RawEmit]
         if isinstance(expr, aqe.ObservableExpr):
             return rx_observables[expr.observableRef]
         if len(observable_ids) == 0:
-            return AsyncBehaviorSubject(evaluate(expr, Map.empty()))
-
-        def oa(a, ids: Block[str]) -> Map[str, RawEmit]:
-            match a:
-                case (a1, a2):
-                    return oa(a1, ids.take(len(ids) - 1)).add(ids[-1], a2)
-                case _:
-                    return Map.empty().add(ids[0], a)
-        return rx.pipe(
-            rx_observables[observable_ids[0]],
-            *ix(observable_ids[1:]).map(lambda id: rx.combine_latest(rx_observables[id])),
-            rx.map(lambda a: evaluate(expr, oa(a, observable_ids)))
-        )
+            return AsyncBehaviorSubject(compile_expr(expr, {})([]))
+        from .expressiongraph import observe
+        return observe(expr, device_id)
     except Exception as ex:
-        from .observable import log
         log.error(f"Expression {expr} on {device_id}", exc_info=ex)
         return AsyncBehaviorSubject(RawEmit())
@@ -0,0 +1,266 @@
+import asyncio
+import heapq
+import logging
+from typing import Callable, Optional
+
+import aioreactive as rx
+from aioreactive import AsyncAnonymousObservable, AsyncObserver
+from aioreactive.observers import AsyncAnonymousObserver
+from expression.system import AsyncDisposable
+
+from ..div.emit import RawEmit
+from ..model import expression as aqe
+
+log = logging.getLogger(__name__)
+
+# All expressions being observed form one graph. A node is an expression, and its inputs are sources: the
+# observables and the rx operator (debounce, on, ...) parts of expressions. Expressions are shared by everything
+# observing them, and a source is subscribed once for the whole graph. An observable defined by an expression is a
+# source as well, so expressions referring to it see it paused and rounded as everything else does. It has the rank of
+# the node of its expression, so expressions referring to it are evaluated after it has emitted.
+#
+# Emits from sources only update slots and mark nodes dirty. Once per tick, the dirty nodes are evaluated in
+# topological order, each node once, so a change reaching a node by several paths (A2 -> R1, G1 -> R3, G3 -> A3 on a
+# Chihiros light) never emits a mix of old and new values.
+
+evaluations: int = 0
+flushes: int = 0
+
+_nodes: dict[str, '_Node'] = {}
+_sources: dict[str, '_Source'] = {}
+_observable_sources: dict[str, set[str]] = {}  # keys of the sources of an observable, by "@" + observable id
+_dirty: list[tuple[int, int, '_Node']] = []
+_order: int = 0
+_flush_task: Optional[asyncio.Task] = None
+
+
+class _Source:
+
+    def __init__(self, key: str, observable: rx.AsyncObservable[RawEmit], rank: int = 0) -> None:
+        self.key = key
+        self.rank = rank
+        self._observable = observable
+        self._disposable: Optional[AsyncDisposable] = None
+        self.dependents: list[tuple['_Node', int]] = []
+
+    async def attach(self, node: '_Node', slot: int) -> None:
+        self.dependents.append((node, slot))
+        if len(self.dependents) == 1:
+            _sources.setdefault(self.key, self)
+            self._disposable = await self._observable.subscribe_async(AsyncAnonymousObserver(self._send, self._throw))
+
+    async def detach(self, node: '_Node', slot: int) -> None:
+        self.dependents.remove((node, slot))
+        if not self.dependents:
+            if _sources.get(self.key) is self:
+                del _sources[self.key]
+            if self._disposable:
+                disposable, self._disposable = self._disposable, None
+                await disposable.dispose_async()
+
+    async def _send(self, e: RawEmit) -> None:
+        for (node, slot) in self.dependents:
+            node.update(slot, e)
+
+    async def _throw(self, ex: Exception) -> None:
+        log.error(f"Source {self.key} of expressions", exc_info=ex)
+
+
+class _Node:
+
+    def __init__(self, key: str, evaluate: Callable[[list[RawEmit]], RawEmit], inputs: list[_Source]) -> None:
+        self.key = key
+        self._evaluate = evaluate
+        self._inputs = inputs
+        self.rank = 1 + max((i.rank for i in inputs), default=0)
+        self._slots: list[Optional[RawEmit]] = [None] * len(inputs)
+        self._missing = len(inputs)
+        self._dirty = False
+        self.value: Optional[RawEmit] = None
+        self._observers: list[AsyncObserver[RawEmit]] = []
+
+    def update(self, slot: int, e: RawEmit) -> None:
+        if self._slots[slot] is None:
+            self._missing -= 1
+        self._slots[slot] = e
+        if not self._dirty and not self._missing:
+            self._dirty = True
+            _mark(self)
+
+    async def evaluate(self) -> None:
+        global evaluations
+        self._dirty = False
+        evaluations += 1
+        e = self.value = self._evaluate(self._slots)
+        for observer in list(self._observers):
+            try:
+                await observer.asend(e)
+            except Exception as ex:
+                log.error(f"Observer of expression {self.key}", exc_info=ex)
+
+    async def _activate(self) -> None:
+        _nodes.setdefault(self.key, self)
+        for slot, i in enumerate(self._inputs):
+            await i.attach(self, slot)
+
+    async def _deactivate(self) -> None:
+        if _nodes.get(self.key) is self:
+            del _nodes[self.key]
+        self._slots = [None] * len(self._inputs)
+        self._missing = len(self._inputs)
+        self.value = None
+        for slot, i in enumerate(self._inputs):
+            await i.detach(self, slot)
+
+    async def subscribe(self, observer: AsyncObserver[RawEmit]) -> AsyncDisposable:
+        self._observers.append(observer)
+        if len(self._observers) == 1:
+            await self._activate()
+        elif self.value is not None:
+            await observer.asend(self.value)
+
+        async def dispose() -> None:
+            if observer in self._observers:
+                self._observers.remove(observer)
+                if not self._observers:
+                    await self._deactivate()
+        return AsyncDisposable.create(dispose)
+
+
+def _mark(node: _Node) -> None:
+    global _order, _flush_task
+    _order += 1
+    heapq.heappush(_dirty, (node.rank, _order, node))
+    if not _flush_task:
+        _flush_task = asyncio.create_task(_flush())
+
+
+async def _flush() -> None:
+    global flushes, _flush_task
+    flushes += 1
+    try:
+        while _dirty:
+            (_, _, node) = heapq.heappop(_dirty)
+            await node.evaluate()
+    except Exception as ex:
+        log.error("Evaluating expressions", exc_info=ex)
+        _dirty.clear()
+    finally:
+        _flush_task = None
+
+
+def _key(expr: Optional[aqe.Expr], device_id: str) -> str:
+    # the same for the same expression on any device, with observable references made absolute
+    if expr is None:
+        return "None"
+    if isinstance(expr, aqe.ObservableExpr):
+        ref = expr.observableRef
+        return "@" + (ref if ref.find(":") > 0 or ref[0] == '>' else device_id + ":" + ref)
+    if isinstance(expr, aqe.ValueExpr):
+        return repr(expr.value)
+    if isinstance(expr, aqe.EnumValueExpr):
+        return "'" + expr.enumValue + "'"
+    if isinstance(expr, aqe.UnaryOpExpr):
+        return f"{expr.op}({_key(expr.expr, device_id)})"
+    if isinstance(expr, aqe.BinaryOpExpr):
+        return f"{expr.op}({_key(expr.expr1, device_id)},{_key(expr.expr2, device_id)})"
+    if isinstance(expr, aqe.ConvertExpr):
+        return f"convert({_key(expr.expr, device_id)},{expr.quantity},{expr.fromUnit},{expr.toUnit})"
+    if isinstance(expr, aqe.IfExpr):
+        return (f"if({_key(expr.ifExpr, device_id)},{_key(expr.thenExpr, device_id)},"
+                f"{_key(expr.elseExpr, device_id)})")
+    if isinstance(expr, aqe.WhenExpr):
+        whens = ",".join(f"{_key(w.ifExpr, device_id)},{_key(w.thenExpr, device_id)}" for w in expr.whens)
+        return f"when({whens},{_key(expr.elseExpr, device_id)})"
+    if isinstance(expr, aqe.RxOp0Expr):
+        return f"{expr.op}({_key(expr.expr, device_id)})"
+    if isinstance(expr, aqe.RxOp1Expr):
+        return f"{expr.op}({expr.arg},{_key(expr.expr, device_id)})"
+    if isinstance(expr, aqe.OnExpr):
+        return f"on({_key(expr.onExpr, device_id)},{_key(expr.thenExpr, device_id)})"
+    return type(expr).__name__
+
+
+def is_node(expr: Optional[aqe.Expr]) -> bool:
+    # expressions combining inputs, the others are constants, references or rx operators
+    return not (expr is None or isinstance(expr, (aqe.ObservableExpr, aqe.RxOp0Expr, aqe.RxOp1Expr, aqe.OnExpr,
+                                                  aqe.ValueExpr, aqe.EnumValueExpr, aqe.NoneExpr)))
+
+
+def _labels(expr: Optional[aqe.Expr], labels: dict[str, aqe.Expr]) -> None:
+    # the input expressions by the labels the expression is compiled with, as find_rx_observables
+    if isinstance(expr, (aqe.RxOp0Expr, aqe.RxOp1Expr, aqe.OnExpr)):
+        labels[expr._label] = expr
+    elif isinstance(expr, aqe.ObservableExpr):
+        labels[expr.observableRef] = expr
+    elif isinstance(expr, (aqe.UnaryOpExpr, aqe.ConvertExpr)):
+        _labels(expr.expr, labels)
+    elif isinstance(expr, aqe.BinaryOpExpr):
+        _labels(expr.expr1, labels)
+        _labels(expr.expr2, labels)
+    elif isinstance(expr, aqe.IfExpr):
+        _labels(expr.ifExpr, labels)
+        _labels(expr.thenExpr, labels)
+        _labels(expr.elseExpr, labels)
+    elif isinstance(expr, aqe.WhenExpr):
+        for w in expr.whens:
+            _labels(w.ifExpr, labels)
+            _labels(w.thenExpr, labels)
+        _labels(expr.elseExpr, labels)
+
+
+def _node(expr: aqe.Expr, device_id: str, resolving: set[str]) -> _Node:
+    from .expression import find_rx_observables, compile_expr
+    key = _key(expr, device_id)
+    if key in _nodes:
+        return _nodes[key]
+    resolving = resolving | {key}
+    rx_observables = find_rx_observables(expr, device_id)
+    labels: dict[str, aqe.Expr] = {}
+    _labels(expr, labels)
+    inputs: list[_Source] = []
+    for label in rx_observables.keys():
+        input_expr = labels[label]
+        input_key = _key(input_expr, device_id)
+        input = _sources.get(input_key)
+        if not input:
+            rank = 0
+            if isinstance(input_expr, aqe.ObservableExpr):
+                rank = _observable_rank(input_key[1:], resolving)
+                _observable_sources.setdefault(input_key.split("--")[0], set()).add(input_key)  # and chore inputs
+            input = _sources[input_key] = _Source(input_key, rx_observables[label], rank)
+        inputs.append(input)
+    evaluate = compile_expr(expr, dict((label, i) for i, label in enumerate(rx_observables.keys())))
+    node = _nodes[key] = _Node(key, evaluate, inputs)
+    return node
+
+
+def _observable_rank(id: str, resolving: set[str]) -> int:
+    # the rank of the node of the expression of an enabled observable defined by an expression, else 0
+    from . import devices as dv
+    observable = dv.observables.get(id)
+    if not observable or not observable.enabled() or not is_node(observable.m_observable.expr):
+        return 0
+    if _key(observable.m_observable.expr, observable.device.id) in resolving:
+        log.error(f"Expression on {id} depends on itself")
+        return 0
+    return _node(observable.m_observable.expr, observable.device.id, resolving).rank
+
+
+def invalidate(observable_ids: list[str]) -> None:
+    # forgets the sources of observables being replaced, and the nodes made with them, so expressions observed from
+    # now on refer to the new observables
+    stale = set(_sources.pop(key) for id in observable_ids for key in _observable_sources.pop("@" + id, ())
+                if key in _sources)
+    if not stale:
+        return
+    for node in [node for node in _nodes.values() if any(i in stale for i in node._inputs)]:
+        del _nodes[node.key]
+
+
+def observe(expr: aqe.Expr, device_id: str) -> rx.AsyncObservable[RawEmit]:
+    # the node is found or made when subscribing, as the observables it refers to may not exist before
+    async def subscribe_async(observer: AsyncObserver[RawEmit]) -> AsyncDisposable:
+        return await _node(expr, device_id, set()).subscribe(observer)
+
+    return AsyncAnonymousObservable(subscribe_async)
@@ -0,0 +1,36 @@
+import os
+import time as t
+from collections import deque
+from itertools import islice
+from typing import Optional
+
+from ..div.emit import ObservableEmit
+from ..util.rxutil import AsyncPublishSubject
+
+# The latest emits of all observables, numbered by a sequence, so a client losing its connection can resume from the
+# last sequence number it got. Each emit is sent on with its sequence number by rx_journal. The sequence starts from
+# the clock in ms, so a sequence number from before a restart is older than the journal, and the client knows to reload.
+
+size: int = int(os.environ.get("smoothieaq_journal_size", "10000"))
+
+_journal: deque[tuple[int, ObservableEmit]] = deque(maxlen=size)
+_seq: int = int(t.time() * 1000)
+
+rx_journal: AsyncPublishSubject[tuple[int, ObservableEmit]] = AsyncPublishSubject()
+
+
+async def asend(e: ObservableEmit) -> None:
+    global _seq
+    _seq += 1
+    se = (_seq, e)
+    _journal.append(se)
+    await rx_journal.asend(se)
+
+
+def since(seq: int) -> tuple[int, Optional[list[tuple[int, ObservableEmit]]]]:
+    # the sequence number of the latest emit, and the emits after seq, or None if some of them are no longer in the
+    # journal
+    first = _journal[0][0] if _journal else _seq + 1
+    if seq < first - 1 or seq > _seq:
+        return _seq, None
+    return _seq, list(islice(_journal, seq - first + 1, None))
@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+from typing import Callable, Iterable, Optional
+
+import aioreactive as rx
+import orjson
+
+from ..div.emit import ObservableEmit
+
+log = logging.getLogger(__name__)
+
+# Last emit of every observable, checkpointed to a file so observables can be seeded with their last value on
+# startup, instead of with an empty emit or by querying an emit store.
+
+file: str = os.environ.get("smoothieaq_last_emits", os.path.join(tempfile.gettempdir(), "smoothieaq-last-emits.json"))
+checkpoint_every: float = 60
+
+_last_emits: dict[str, ObservableEmit] = {}
+_current_emits: Optional[Callable[[], Iterable[ObservableEmit]]] = None
+_disposable: Optional[rx.AsyncDisposable] = None
+
+
+def load() -> None:
+    try:
+        with open(file, "rb") as f:
+            for (id, stamp, value, enumValue, note) in orjson.loads(f.read()):
+                id = sys.intern(id)
+                _last_emits[id] = ObservableEmit(observable_id=id, stamp=stamp, value=value, enumValue=enumValue,
+                                                 note=note)
+        log.info(f"Loaded {len(_last_emits)} last emits from {file}")
+    except FileNotFoundError:
+        log.info(f"No last emits in {file}")
+    except Exception as e:
+        log.error(f"Trying to load last emits from {file}", exc_info=e)
+
+
+def get(observable_id: str) -> Optional[ObservableEmit]:
+    return _last_emits.get(observable_id)
+
+
+def _is_empty(e: ObservableEmit) -> bool:
+    return e.value is None and e.enumValue is None and e.note == "Empty default"
+
+
+def _write(data: bytes) -> None:
+    tmp = file + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, file)
+
+
+async def checkpoint() -> None:
+    if not _current_emits:
+        return
+    for e in _current_emits():
+        if e and e.observable_id and not _is_empty(e):
+            _last_emits[e.observable_id] = e
+    data = orjson.dumps([[e.observable_id, e.stamp, e.value, e.enumValue, e.note] for e in _last_emits.values()])
+    try:
+        await asyncio.to_thread(_write, data)
+        log.debug(f"Checkpointed {len(_last_emits)} last emits to {file}")
+    except Exception as e:
+        log.error(f"Trying to checkpoint last emits to {file}", exc_info=e)
+
+
+async def start(current_emits: Callable[[], Iterable[ObservableEmit]]) -> None:
+    global _current_emits, _disposable
+    _current_emits = current_emits
+
+    async def _checkpoint(n):
+        await checkpoint()
+    _disposable = await rx.interval(checkpoint_every, checkpoint_every).subscribe_async(_checkpoint)
+
+
+async def stop() -> None:
+    global _disposable
+    if _disposable:
+        await _disposable.dispose_async()
+        _disposable = None
+    await checkpoint()
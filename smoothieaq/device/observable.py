@@ -1,5 +1,6 @@
 import asyncio
 import logging
+import sys
 from enum import StrEnum, auto
 from typing import Optional, Callable, cast
 
@@ -9,10 +10,12 @@ from expression.collections import Map, Block
 from expression.system import CancellationToken, CancellationTokenSource
 
 from .expression import as_observable
+from ..div import metrics
 from ..div.emit import RawEmit, ObservableEmit, emit_enum_value, emit_raw_fun, emit_empty, emit_raw
 from ..driver.driver import Status as DriverStatus, Driver
 from ..model import thing as aqt
-from ..util.rxutil import AsyncBehaviorSubject, publish, distinct_until_changed, take_first_async, throw_it, trace
+from ..util.rxutil import AsyncBehaviorSubject, publish, distinct_until_changed, debounce, take_first_async, throw_it, \
+    trace, combine_latest
 from ..div.time import time
 
 log = logging.getLogger(__name__)
@@ -46,29 +49,66 @@ def driver_init(driver_ref: aqt.DriverRef, id: str) -> Optional[Driver]:
     return driver.init(path, hal, globalHal, params)
 
 
-def _rx_require(
-        rx1: Optional[rx.AsyncObservable[RawEmit]], rx2: Optional[rx.AsyncObservable[RawEmit]]
-) -> Optional[rx.AsyncObservable[RawEmit]]:
-    def alarm(e1: RawEmit, e2: RawEmit) -> RawEmit:
-        if e1.enumValue == Status.ALARM:
-            return e1
-        if e2.enumValue == Status.ALARM:
-            return e2
-        if e1.enumValue == Status.WARNING:
-            return e1
-        return e2
-
-    if not rx1:
-        return rx2
-    if not rx2:
-        return rx1
+def _worst(statuses: list[RawEmit]) -> RawEmit:
+    for e in statuses:
+        if e.enumValue == Status.ALARM:
+            return e
+    for e in statuses:
+        if e.enumValue == Status.WARNING:
+            return e
+    return statuses[-1]
+
+
+def _same_status(e1: RawEmit, e2: RawEmit) -> bool:
+    return e1.enumValue == e2.enumValue and e1.note == e2.note
+
+
+def _rx_require(statuses: list[rx.AsyncObservable[RawEmit]]) -> rx.AsyncObservable[RawEmit]:
+    if len(statuses) == 1:
+        return statuses[0]
     return rx.pipe(
-        rx1,
-        rx.combine_latest(rx2),
-        rx.starmap(alarm)
+        combine_latest(statuses, _worst),
+        distinct_until_changed(_same_status)
     )
 
 
+class _Thresholds:
+    # Status of a value against all limits of a require in one pass. A passed limit is only cleared when the value is
+    # back inside it by hysteresis, so a value hovering at a limit does not flap.
+
+    def __init__(self, require: aqt.ValueRequire) -> None:
+        self._limits: list[tuple[float, bool, RawEmit]] = [
+            (limit, above, RawEmit(enumValue=status, note=f"Value {'above' if above else 'below'} {limit}"))
+            for (limit, above, status) in [
+                (require.alarmAbove, True, Status.ALARM),
+                (require.alarmBelow, False, Status.ALARM),
+                (require.warningAbove, True, Status.WARNING),
+                (require.warningBelow, False, Status.WARNING),
+            ] if limit is not None
+        ]
+        self._hysteresis = require.hysteresis or 0.
+        self._passed = [False] * len(self._limits)
+        self._running = RawEmit(enumValue=Status.RUNNING)
+
+    def __bool__(self) -> bool:
+        return len(self._limits) > 0
+
+    def __call__(self, e: ObservableEmit) -> RawEmit:
+        v = e.value
+        status: Optional[RawEmit] = None
+        for i, (limit, above, limit_status) in enumerate(self._limits):
+            if v is None:
+                passed = False
+            elif above:
+                passed = v > (limit - self._hysteresis if self._passed[i] else limit)
+            else:
+                passed = v < (limit + self._hysteresis if self._passed[i] else limit)
+            self._passed[i] = passed
+            if passed and status is None:
+                status = limit_status
+        return status or self._running
+
+
 class Observable[MO: aqt.AbstractObservable]:
 
     def __init__(self) -> None:
@@ -83,6 +123,7 @@ class Observable[MO: aqt.AbstractObservable]:
         self.rx_status_observable: Optional[rx.AsyncObservable[ObservableEmit]] = None
         self.rx_observable: Optional[rx.AsyncObservable[ObservableEmit]] = None
         self.paused: bool = False
+        self._m_emits_in: Optional[metrics.Value] = None
         self._rx_paused = AsyncBehaviorSubject(self.paused)
         self._rx_require: rx.AsyncObservable[RawEmit] = AsyncBehaviorSubject(RawEmit(enumValue=Status.RUNNING))
         self._disposables: list[rx.AsyncDisposable] = []
@@ -106,11 +147,11 @@ class Observable[MO: aqt.AbstractObservable]:
         return self.m_observable.enablement == 'enabled' and self.device.m_device.enablement == 'enabled'
 
     def init(self, m_observable: aqt.Observable, device: 'Device') -> 'Observable':
-        self.id = device.id + ':' + m_observable.id
+        self.id = sys.intern(device.id + ':' + m_observable.id)
         log.info(f"doing observable.init({self.id},{m_observable.name})")
         self.m_observable = m_observable
         self.device = device
-        self.status_id = self.id + '?'
+        self.status_id = sys.intern(self.id + '?')
 
         if self.enabled():
             self.init_enabled()
@@ -127,46 +168,67 @@ class Observable[MO: aqt.AbstractObservable]:
 
         o: rx.AsyncObservable[RawEmit]
         s: rx.AsyncObservable[RawEmit]
+        driver_id = "none"
         if self.m_observable.expr:
             log.debug(f"observing expression on observable({self.id})")
             o = as_observable(self.m_observable.expr, self.device.id)
             s = AsyncBehaviorSubject(RawEmit(enumValue=Status.RUNNING))
+            driver_id = "expression"
         elif self.m_observable.driver and self.m_observable.driver.id:
             self.driver = driver_init(self.m_observable.driver, self.id)
             log.debug(f"observing own driver({self.driver.id}) on observable({self.id})")
             o = self.driver.rx_observables['A']
             s = self.driver.rx_status_observable
+            driver_id = self.driver.id
         elif self.device.driver and self.device.driver.rx_observables.__contains__(self.m_observable.id):
             log.debug(f"observing device driver({self.device.driver.id}) on observable({self.id})")
             o = self.device.driver.rx_observables[self.m_observable.id]
             s = self.device.driver.rx_status_observable
+            driver_id = self.device.driver.id
         elif isinstance(self, Action) or isinstance(self, Chore):
             self._rx_subject = AsyncBehaviorSubject(RawEmit())
             o = self._rx_subject
             self._rx_status_subject = AsyncBehaviorSubject(RawEmit(enumValue=Status.IDLE))
             s = self._rx_status_subject
+            driver_id = "steps"
         else:
             log.error(f"nothing to observe on observable({self.id})")
             o = AsyncBehaviorSubject(RawEmit())
             s = AsyncBehaviorSubject(RawEmit(enumValue=Status.ERROR, note=f"Nothing to observe on {self.id}"))
 
+        # emits in are counted when passing the pause filter, or when dropped as the same value by _rx_prefilter
+        m_in = self._m_emits_in = metrics.observable_emits_in.labels(self.id, driver_id)
+        m_paused = metrics.observable_emits_filtered.labels(self.id, "pause")
+        m_out = metrics.observable_emits.labels(self.id)
+        emit_raw = emit_raw_fun(self.id)
+
+        def not_paused(e: RawEmit) -> bool:
+            m_in.inc()
+            if self.paused:
+                m_paused.inc()
+            return not self.paused
+
+        def emit(e: RawEmit) -> ObservableEmit:
+            m_out.inc()
+            return emit_raw(e)
+
         self.rx_observable = rx.pipe(
             self._rx_prefilter(o),
-            rx.filter(lambda e: not self.paused),
-            rx.map(emit_raw_fun(self.id)),
+            rx.filter(not_paused),
+            rx.map(emit),
             publish(get_last_emit(self.id))
         )
 
         self._set_require()
         self._rx_require = rx.pipe(
             self._rx_require,
-            rx.debounce(0.1),
-            rx.distinct_until_changed,
+            debounce(0.1),
+            distinct_until_changed(),
             publish()
         )
 
-        def status(t: tuple[tuple[tuple[ObservableEmit, bool], RawEmit], ObservableEmit]) -> RawEmit:
-            (((device_status, paused), driver_status), require_status) = t
+        def status(t: list) -> RawEmit:
+            (device_status, paused, driver_status, require_status) = t
             log.debug(f"evaluating observable.status({self.id}, {device_status}, {paused}, {driver_status}, "
                       f"{require_status})")
             if not device_status.enumValue == Status.RUNNING:
@@ -186,12 +248,8 @@ class Observable[MO: aqt.AbstractObservable]:
             return RawEmit(enumValue=Status.INITIALIZING)
 
         self.rx_status_observable = rx.pipe(
-            self.device.rx_status_observable,
-            rx.combine_latest(self._rx_paused),
-            rx.combine_latest(s),
-            rx.combine_latest(self._rx_require),
-            rx.map(status),
-            rx.distinct_until_changed,
+            combine_latest([self.device.rx_status_observable, self._rx_paused, s, self._rx_require], status),
+            distinct_until_changed(),
             rx.map(emit_raw_fun(self.status_id)),
             publish()
         )
@@ -285,55 +343,14 @@ class Observable[MO: aqt.AbstractObservable]:
     def _driver(self) -> Driver:
         return self.driver or self.device.driver
 
-    def _rx_compare(self, compare_with: Optional[float], f: Callable[[float, float], bool], enumValue: str,
-                    note: str) -> Optional[rx.AsyncObservable[RawEmit]]:
-        def ff(v: float) -> bool:
-            try:
-                return f(v, compare_with)
-            except Exception:
-                return False
-        if not compare_with:
-            return None
-        return rx.pipe(
-            self.rx_observable,
-            rx.map(
-                lambda e: RawEmit(enumValue=Status.RUNNING) if not ff(e.value) else RawEmit(
-                    enumValue=enumValue, note=note)
-            ),
-            rx.distinct_until_changed
-        )
-
-    def _rx_compare_enum(self, compare_with: Optional[list[str]], f: Callable[[str, list[str]], bool],
-                         note: str) -> Optional[rx.AsyncObservable[RawEmit]]:
-        def ff(e: ObservableEmit) -> bool:
-            try:
-                return f(e.enumValue, compare_with)
-            except Exception:
-                return False
-        if not compare_with:
-            return None
-        return rx.pipe(
-            self.rx_observable,
-            rx.map(
-                lambda e: RawEmit(enumValue=Status.RUNNING) if not ff(e.enumValue) else RawEmit(
-                    enumValue=Status.ALARM, note=note)
-            ),
-            rx.distinct_until_changed
-        )
-
-    def _rx_condition(self, condition: Optional[list[aqt.Condition]], enumValue: Status):
-        if condition:
-            for c in condition:
-                if c.condition:
-                    self._rx_require = _rx_require(
-                        rx.pipe(
-                            as_observable(c.condition, self.device.id),
-                            rx.map(
-                                lambda e: RawEmit(enumValue=enumValue, note=c.description) if e.value or e.enumValue
-                                else RawEmit(enumValue=Status.RUNNING))
-                        ),
-                        self._rx_require
-                    )
+    def _rx_conditions(self, conditions: Optional[list[aqt.Condition]],
+                       enumValue: Status) -> list[rx.AsyncObservable[RawEmit]]:
+        def status(c: aqt.Condition) -> Callable[[RawEmit], RawEmit]:
+            passed = RawEmit(enumValue=enumValue, note=c.description)
+            running = RawEmit(enumValue=Status.RUNNING)
+            return lambda e: passed if e.value or e.enumValue else running
+        return [rx.pipe(as_observable(c.condition, self.device.id), rx.map(status(c)))
+                for c in conditions or [] if c.condition]
 
 
 class _ValueObservable[MO: aqt.ValueObservable](Observable[MO]):
@@ -341,25 +358,13 @@ class _ValueObservable[MO: aqt.ValueObservable](Observable[MO]):
     def _set_require(self):
         require = self.m_observable.require
         if require:
-            self._rx_require = _rx_require(
-                self._rx_compare(require.warningAbove, lambda v1, v2: v1 > v2, Status.WARNING,
-                                 f"Value above {require.warningAbove}"),
-                _rx_require(
-                    self._rx_compare(require.warningBelow, lambda v1, v2: v1 < v2, Status.WARNING,
-                                     f"Value below {require.warningBelow}"),
-                    _rx_require(
-                        self._rx_compare(require.alarmAbove, lambda v1, v2: v1 > v2, Status.ALARM,
-                                         f"Value above {require.alarmAbove}"),
-                        _rx_require(
-                            self._rx_compare(require.alarmBelow, lambda v1, v2: v1 < v2, Status.ALARM,
-                                             f"Value below {require.alarmBelow}"),
-                            self._rx_require
-                        )
-                    )
-                )
-            )
-            self._rx_condition(require.warningConditions, Status.WARNING)
-            self._rx_condition(require.alarmConditions, Status.ALARM)
+            statuses = self._rx_conditions(require.alarmConditions, Status.ALARM) + \
+                       self._rx_conditions(require.warningConditions, Status.WARNING)
+            thresholds = _Thresholds(require)
+            if thresholds:
+                statuses.append(rx.pipe(self.rx_observable, rx.map(thresholds), distinct_until_changed(_same_status)))
+            if statuses:
+                self._rx_require = _rx_require(statuses)
 
 
 class Measure(_ValueObservable[aqt.Measure]):
@@ -377,25 +382,37 @@ class Measure(_ValueObservable[aqt.Measure]):
                 ctl.supressSameLimit = precision
         if ctl:
             if ctl.decimals is not None:
-                def f(e):
-                    v = round(e.value, int(ctl.decimals))
-                    return RawEmit(value=round(e.value, int(ctl.decimals)))
+                decimals = int(ctl.decimals)
+
+                def rounded(e: RawEmit) -> RawEmit:
+                    # a new emit only if rounding changes the value, keeping enum value and note
+                    if e.value is None:
+                        return e
+                    v = round(e.value, decimals)
+                    return e if v == e.value else RawEmit(value=v, enumValue=e.enumValue, note=e.note)
                 o = rx.pipe(
                     o,
-                    rx.map(lambda e: RawEmit(value=round(e.value, int(ctl.decimals))))
+                    rx.map(rounded)
                 )
             if ctl.atMostEverySecond:
                 o = rx.pipe(
                     o,
-                    rx.debounce(ctl.atMostEverySecond)
+                    debounce(ctl.atMostEverySecond)
                 )
             if not ctl.supressSameLimit:
                 ctl.supressSameLimit = 0.000000001
 
+            m_in = self._m_emits_in
+            m_same = metrics.observable_emits_filtered.labels(self.id, "same")
+
             def supress_fun(e1: RawEmit, e2: RawEmit) -> bool:
                 if e1.value is None or e2.value is None:
                     return False
-                return abs(e1.value - e2.value) <= ctl.supressSameLimit
+                if abs(e1.value - e2.value) <= ctl.supressSameLimit:
+                    m_in.inc()
+                    m_same.inc()
+                    return True
+                return False
             o = rx.pipe(
                 o,
                 distinct_until_changed(comparer=supress_fun)
@@ -477,17 +494,22 @@ class State(SetObservable[aqt.State]):
     def _set_require(self):
         require = self.m_observable.require
         if require:
-            self._rx_require = _rx_require(
-                self._rx_compare_enum(require.alarmIfIn, lambda e, li: e in li,
-                                      f"Value in {require.alarmIfIn}"),  # TODO map to names
-                _rx_require(
-                    self._rx_compare_enum(require.alarmIfIn, lambda e, li: e in li,
-                                          f"Value not in {require.alarmIfIn}"),  # TODO map to names
-                    AsyncBehaviorSubject(RawEmit(enumValue=Status.RUNNING))
-                )
-            )
-            self._rx_condition(require.warningConditions, Status.WARNING)
-            self._rx_condition(require.alarmConditions, Status.ALARM)
+            statuses = self._rx_conditions(require.alarmConditions, Status.ALARM) + \
+                       self._rx_conditions(require.warningConditions, Status.WARNING)
+            if require.alarmIfIn or require.alarmIfNotIn:
+                running = RawEmit(enumValue=Status.RUNNING)
+                alarm_in = RawEmit(enumValue=Status.ALARM, note=f"Value in {require.alarmIfIn}")  # TODO map to names
+                alarm_not_in = RawEmit(enumValue=Status.ALARM, note=f"Value not in {require.alarmIfNotIn}")
+
+                def status(e: ObservableEmit) -> RawEmit:
+                    if require.alarmIfIn and e.enumValue in require.alarmIfIn:
+                        return alarm_in
+                    if require.alarmIfNotIn and e.enumValue not in require.alarmIfNotIn:
+                        return alarm_not_in
+                    return running
+                statuses.append(rx.pipe(self.rx_observable, rx.map(status), distinct_until_changed(_same_status)))
+            if statuses:
+                self._rx_require = _rx_require(statuses)
 
 
 class Event(Observable[aqt.Event]):
@@ -499,7 +521,7 @@ class Event(Observable[aqt.Event]):
 
     def _rx_prefilter(self, o: rx.AsyncObservable[RawEmit]) -> rx.AsyncObservable[RawEmit]:
         if self.m_observable.emitControl and self.m_observable.emitControl.debounceValue:
-            o = rx.pipe(o, rx.debounce(self.m_observable.emitControl.debounceValue))
+            o = rx.pipe(o, debounce(self.m_observable.emitControl.debounceValue))
         return o
 
 class ActionOrChore[MO: aqt.AbstractObservable](Observable[MO]):
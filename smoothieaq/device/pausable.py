@@ -4,7 +4,7 @@ import aioreactive as rx
 
 from .expression import as_observable
 from ..model.expression import Expr
-from ..util.rxutil import AsyncBehaviorSubject
+from ..util.rxutil import AsyncBehaviorSubject, distinct_until_changed
 
 
 class Pausable:
@@ -25,7 +25,7 @@ class Pausable:
                                      rx.map(lambda bb: bb[0] or bb[1]))
 
     async def start(self):
-        self._rx_disposable = await rx.pipe(self.rx_paused, rx.distinct_until_changed).subscribe_async(self.do_pause)
+        self._rx_disposable = await rx.pipe(self.rx_paused, distinct_until_changed()).subscribe_async(self.do_pause)
 
     async def stop(self):
         for d in self._rx_disposable:
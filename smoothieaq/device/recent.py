@@ -0,0 +1,92 @@
+import os
+from array import array
+from typing import Any, Iterator, Optional
+
+from ..div import metrics
+from ..div.emit import ObservableEmit, stamp_to_transport
+
+# The latest emits of every observable, in a ring buffer per observable, for sparklines and the like without reading
+# an emit device, or when there is none. A ring has arrays of stamps, values and enum values for depth emits, so memory
+# is bounded by depth times the number of observables. Enum values are numbered, as the few enum values of an
+# observable come again and again. Notes are not kept.
+
+depth: int = int(os.environ.get("smoothieaq_recent_depth", "720"))
+
+_enum_values: list[Optional[str]] = [None]
+_enum_codes: dict[Optional[str], int] = {None: 0}
+
+
+class Ring:
+    __slots__ = ('stamps', 'values', 'enums', 'next', 'count')
+
+    def __init__(self, depth: int) -> None:
+        self.stamps = array('d', bytes(8 * depth))
+        self.values = array('d', bytes(8 * depth))
+        self.enums = array('H', bytes(2 * depth))
+        self.next = 0
+        self.count = 0
+
+    def put(self, e: ObservableEmit) -> None:
+        code = _enum_codes.get(e.enumValue)
+        if code is None:
+            code = _enum_codes[e.enumValue] = len(_enum_values)
+            _enum_values.append(e.enumValue)
+        i = self.next
+        self.stamps[i] = e.stamp
+        self.values[i] = float('nan') if e.value is None else e.value
+        self.enums[i] = code
+        self.next = (i + 1) % len(self.stamps)
+        self.count = min(self.count + 1, len(self.stamps))
+
+    def latest(self, points: Optional[int] = None, frm: Optional[float] = None) -> Iterator[int]:
+        # indexes of at most points emits, stamped at frm or later, newest first
+        size = len(self.stamps)
+        for n in range(min(self.count, points or size)):
+            i = (self.next - 1 - n) % size
+            if frm is not None and self.stamps[i] < frm:
+                return
+            yield i
+
+    def nbytes(self) -> int:
+        return sum(a.itemsize * len(a) for a in (self.stamps, self.values, self.enums))
+
+
+_rings: dict[str, Ring] = {}
+
+
+async def asend(e: ObservableEmit) -> None:
+    if e.observable_id.endswith('?') or (e.value is None and e.enumValue is None) or e.stamp is None:
+        return
+    ring = _rings.get(e.observable_id)
+    if ring is None:
+        ring = _rings[e.observable_id] = Ring(depth)
+    ring.put(e)
+
+
+def get(observable_id: str, points: Optional[int] = None, frm: Optional[float] = None) -> list[tuple[Any, ...]]:
+    # oldest first, in the format of emit_to_transport
+    ring = _rings.get(observable_id)
+    if ring is None:
+        return []
+    emits = []
+    for i in ring.latest(points, frm):
+        value = ring.values[i]
+        value = None if value != value else value
+        enum = _enum_values[ring.enums[i]]
+        stamp = stamp_to_transport(ring.stamps[i])
+        emits.append((observable_id, stamp, value, enum) if enum else (observable_id, stamp, value))
+    emits.reverse()
+    return emits
+
+
+def nbytes() -> int:
+    return sum(ring.nbytes() for ring in _rings.values())
+
+
+def status() -> dict[str, int]:
+    return {"depth": depth, "observables": len(_rings), "bytes": nbytes()}
+
+
+metrics.Gauge("smoothieaq_recent_bytes", "Memory of the ring buffers of recent emits", (), lambda: [((), nbytes())])
+metrics.Gauge("smoothieaq_recent_observables", "Observables with a ring buffer of recent emits", (),
+              lambda: [((), len(_rings))])
@@ -0,0 +1,124 @@
+import asyncio
+import copy
+import datetime as dt
+import heapq
+import logging
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional
+
+import aioreactive as rx
+
+from ..div import time
+from ..div.emit import ObservableEmit, RawEmit
+from ..driver.driver import Driver
+
+log = logging.getLogger(__name__)
+
+# Replays stored emits of a time range into the drivers' subjects on the simulated clock, so expressions,
+# require/alarm conditions and schedules evaluate as they did live. While replaying, live emits from the drivers
+# are dropped and the emit devices store nothing.
+
+
+@dataclass
+class ReplayStatus:
+    running: bool
+    start: Optional[float] = None
+    end: Optional[float] = None
+    speed: Optional[float] = None
+    stamp: Optional[float] = None  # of the last replayed emit
+    emits: int = 0
+    observables: int = 0
+
+
+status = ReplayStatus(running=False)
+_task: Optional[asyncio.Task] = None
+
+
+def is_replaying() -> bool:
+    return status.running
+
+
+def _sources() -> dict[str, tuple[Driver, str]]:
+    # driver and rx key of each enabled observable that gets its emits from a driver
+    from .devices import observables
+    sources: dict[str, tuple[Driver, str]] = {}
+    for id, observable in observables.items():
+        if not observable.enabled() or observable.m_observable.expr:
+            continue
+        if observable.driver:
+            sources[id] = (observable.driver, 'A')
+        elif observable.device.driver and observable.device.driver.rx_observables.__contains__(observable.m_observable.id):
+            sources[id] = (observable.device.driver, observable.m_observable.id)
+    return sources
+
+
+async def _merge(iterators: list[AsyncIterator[ObservableEmit]]) -> AsyncIterator[ObservableEmit]:
+    # emits of all iterators ordered by stamp, holding one emit per iterator
+    heap: list[tuple[float, int, ObservableEmit]] = []
+    for i, iterator in enumerate(iterators):
+        if (e := await anext(iterator, None)) is not None:
+            heap.append((e.stamp, i, e))
+    heapq.heapify(heap)
+    while heap:
+        (_, i, e) = heap[0]
+        yield e
+        if (e := await anext(iterators[i], None)) is not None:
+            heapq.heapreplace(heap, (e.stamp, i, e))
+        else:
+            heapq.heappop(heap)
+
+
+async def _replay(start: float, end: float, speed: float, observable_ids: Optional[list[str]]) -> None:
+    from ..emitdevice.emitdevices import get_history_emit_device
+    emit_device = get_history_emit_device()
+    assert emit_device, "No emit device to replay from"
+    sources = _sources()
+    if observable_ids is not None:
+        sources = dict((id, sources[id]) for id in observable_ids if id in sources)
+
+    simulating = copy.copy(time.simulating)
+    start_dt = dt.datetime.fromtimestamp(start)
+    time.simulate(start_dt.date(), start_dt.time(), speed, simulating.minDuration)
+    time.hold(start)
+    replayed: dict[Driver, dict[str, rx.AsyncObserver[RawEmit]]] = {}
+    observables: set[str] = set()
+    try:
+        async for e in _merge([emit_device.history(id, start, end) for id in sources.keys()]):
+            (driver, key) = sources[e.observable_id]
+            if driver not in replayed:
+                replayed[driver] = driver.start_replay()
+            if e.observable_id not in observables:
+                observables.add(e.observable_id)
+                status.observables = len(observables)
+            # always sleeping lets the pipeline process an emit while the clock is at its stamp
+            await asyncio.sleep(time.hold(e.stamp))
+            await replayed[driver][key].asend(RawEmit(value=e.value, enumValue=e.enumValue, note=e.note))
+            status.stamp = e.stamp
+            status.emits += 1
+        log.info(f"Replayed {status.emits} emits of {status.observables} observables")
+    except asyncio.CancelledError:
+        log.info(f"Replay stopped after {status.emits} emits")
+    except Exception as e:
+        log.error("Trying to replay emits", exc_info=e)
+    finally:
+        for driver, observers in replayed.items():
+            driver.stop_replay(observers)
+        vars(time.simulating).update(vars(simulating))
+        status.running = False
+
+
+async def start(start: float, end: float, speed: float = 60 * 60 * 24 * 7 / 10,
+                observable_ids: Optional[list[str]] = None) -> ReplayStatus:
+    # by default a week in 10 seconds
+    global status, _task
+    assert not status.running, "Already replaying"
+    log.info(f"Replaying emits from {start} to {end} at {speed}x")
+    status = ReplayStatus(running=True, start=start, end=end, speed=speed)
+    _task = asyncio.create_task(_replay(start, end, speed, observable_ids))
+    return status
+
+
+async def stop() -> None:
+    if _task and not _task.done():
+        _task.cancel()
+        await asyncio.wait([_task])
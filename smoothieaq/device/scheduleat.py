@@ -23,7 +23,7 @@ def next_schedule_at(at: ScheduleAt, length: timedelta) -> datetime:
             return next_at_weekday(at, length)
         case _:
             log.error(f"Unknown ScheduleAt type {at}")
-            return datetime.now()
+            return datetime.fromtimestamp(divtime())
 
 
 def next_at_weekday(at: AtWeekday, length: timedelta) -> datetime:
@@ -37,6 +37,6 @@ def next_at_weekday(at: AtWeekday, length: timedelta) -> datetime:
                  .map(lambda dd: (dd, now + timedelta(days=dd) + delta_time))
                  .filter(lambda d: d[1] > now).to_list()[0][0])
     # print(">2>",now,delta_days,at_day,delta_time,delta_day,datetime.combine((now - timedelta(days=delta_day)).date(), at_day))
-    return datetime.combine((now - timedelta(days=delta_day)).date(), at_day)
+    return datetime.combine((now + timedelta(days=delta_day)).date(), at_day)
 
 
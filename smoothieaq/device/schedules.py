@@ -30,7 +30,7 @@ async def schedules(schedules: list[Schedule], device: Device, rx_scheduled: rx.
 
     def next_schedule() -> tuple[Schedule, datetime]:
         return (Block.of_seq(device.m_device.schedules)
-                .map(lambda s: (s, next_schedule_at(s.atTime, time_length(s.program.length))))
+                .map(lambda s: (s, next_schedule_at(s.at, time_length(s.program.length))))
                 .sort_with(lambda s: s[1])
                 )[0]
 
@@ -0,0 +1,63 @@
+import math
+from array import array
+from typing import Any, Callable, Iterator, Optional
+
+from ..div.emit import ObservableEmit, stamp_to_transport
+
+# The current value and status of every observable, and the status of every device, by emit id, fed from all emits.
+# Rows are kept in columns, and every change of a row stamps it with the next version, so what changed since a version
+# a client has seen is found by a scan of one array.
+
+_index: dict[str, int] = {}
+_ids: list[str] = []
+_stamps = array('d')
+_values = array('d')  # nan for no value
+_enum_values: list[Optional[str]] = []
+_notes: list[Optional[str]] = []
+_versions = array('q')
+_version = 0
+
+
+def version() -> int:
+    return _version
+
+
+def put(e: ObservableEmit) -> None:
+    global _version
+    _version += 1
+    stamp = math.nan if e.stamp is None else e.stamp
+    value = math.nan if e.value is None else e.value
+    i = _index.get(e.observable_id)
+    if i is None:
+        _index[e.observable_id] = len(_ids)
+        _ids.append(e.observable_id)
+        _stamps.append(stamp)
+        _values.append(value)
+        _enum_values.append(e.enumValue)
+        _notes.append(e.note)
+        _versions.append(_version)
+    else:
+        _stamps[i] = stamp
+        _values[i] = value
+        _enum_values[i] = e.enumValue
+        _notes[i] = e.note
+        _versions[i] = _version
+
+
+async def asend(e: ObservableEmit) -> None:
+    put(e)
+
+
+def rows(since: int = 0, match: Optional[Callable[[str], bool]] = None) -> Iterator[tuple[Any, ...]]:
+    # changed after since, in the format of emit_to_transport
+    for i, v in enumerate(_versions):
+        if v > since and (match is None or match(_ids[i])):
+            stamp, value, note = _stamps[i], _values[i], _notes[i]
+            stamp = None if math.isnan(stamp) else stamp_to_transport(stamp)
+            value = None if math.isnan(value) else value
+            if note:
+                yield _ids[i], stamp, value, _enum_values[i], note
+            elif _enum_values[i]:
+                yield _ids[i], stamp, value, _enum_values[i]
+            else:
+                yield _ids[i], stamp, value
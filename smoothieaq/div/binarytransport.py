@@ -0,0 +1,174 @@
+import struct
+from functools import lru_cache
+from typing import Optional
+
+from .emit import ObservableEmit, stamp_to_transport, stamp_from_transport
+
+# A compact binary transport of emits on websockets, as an alternative to the JSON lists of emit_to_transport. A frame
+# is a sequence of records. Strings, observable ids and enum values, are sent once per connection, and then referred
+# to by their number; stamps are sent as the difference to the stamp of the previous emit of the connection.
+#
+# Records start with a tag byte:
+#   0x00 string: varint length, utf-8 bytes. Strings are numbered from 0 in the order they are sent.
+#   0x01 sequence: varint sequence number of the last emit of the frame, for resuming, see device/journal.py
+#   0x02 gap: varint sequence number; emits before it could not be resumed
+#   0x80 | flags emit: varint observable id string, zigzag varint stamp delta in 1/10 s, then by flags
+#     0x01 value as float32, restored by rounding to 7 significant digits
+#     0x02 value as float64
+#     0x04 varint enum value string
+#     0x08 note: varint length, utf-8 bytes
+# All numbers are little endian. A value is sent as float32 if it has at most 7 significant digits.
+
+SUBPROTOCOL = "smoothieaq.binary.v1"
+
+_STRING = 0x00
+_SEQ = 0x01
+_GAP = 0x02
+_EMIT = 0x80
+_FLOAT32 = 0x01
+_FLOAT64 = 0x02
+_ENUM = 0x04
+_NOTE = 0x08
+
+_f32 = struct.Struct('<f')
+_f64 = struct.Struct('<d')
+
+
+def _varint(out: bytearray, n: int) -> None:
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+@lru_cache(maxsize=4096)
+def _value(value: float) -> tuple[int, bytes]:
+    # measures are rounded to a few decimals, so the same values come again and again
+    if -3.4e38 < value < 3.4e38:
+        b = _f32.pack(value)
+        if float('%.7g' % _f32.unpack(b)[0]) == value:
+            return _FLOAT32, b
+    return _FLOAT64, _f64.pack(value)
+
+
+class Encoder:
+    # one per connection
+
+    def __init__(self) -> None:
+        self._strings: dict[str, int] = {}
+        self._stamp = 0
+
+    def _string(self, out: bytearray, s: str) -> int:
+        n = self._strings.get(s)
+        if n is None:
+            n = self._strings[s] = len(self._strings)
+            b = s.encode()
+            out.append(_STRING)
+            _varint(out, len(b))
+            out += b
+        return n
+
+    def encode(self, emits: list[ObservableEmit], seq: Optional[int] = None) -> bytes:
+        out = bytearray()
+        strings = self._strings
+        last = self._stamp
+        for e in emits:
+            id = strings.get(e.observable_id)
+            if id is None:
+                id = self._string(out, e.observable_id)
+            flags = _EMIT
+            value = None
+            if e.value is not None:
+                (flag, value) = _value(e.value)
+                flags |= flag
+            enum = None
+            if e.enumValue:
+                enum = strings.get(e.enumValue)
+                if enum is None:
+                    enum = self._string(out, e.enumValue)
+                flags |= _ENUM
+            if e.note:
+                flags |= _NOTE
+
+            out.append(flags)
+            _varint(out, id)
+            stamp = stamp_to_transport(e.stamp)
+            delta = stamp - last
+            last = stamp
+            _varint(out, (delta << 1) ^ (delta >> 63))
+            if value:
+                out += value
+            if enum is not None:
+                _varint(out, enum)
+            if e.note:
+                b = e.note.encode()
+                _varint(out, len(b))
+                out += b
+        self._stamp = last
+        if seq is not None:
+            out.append(_SEQ)
+            _varint(out, seq)
+        return bytes(out)
+
+    def gap(self, seq: int) -> bytes:
+        out = bytearray([_GAP])
+        _varint(out, seq)
+        return bytes(out)
+
+
+class Decoder:
+    # the reverse of Encoder, for clients and tests
+
+    def __init__(self) -> None:
+        self._strings: list[str] = []
+        self._stamp = 0
+        self.seq: Optional[int] = None
+        self.gap = False
+
+    def decode(self, frame: bytes) -> list[ObservableEmit]:
+        emits = []
+        i = 0
+
+        def varint() -> int:
+            nonlocal i
+            n = shift = 0
+            while True:
+                b = frame[i]
+                i += 1
+                n |= (b & 0x7f) << shift
+                if b < 0x80:
+                    return n
+                shift += 7
+
+        def string() -> str:
+            nonlocal i
+            length = varint()
+            i += length
+            return frame[i - length:i].decode()
+
+        while i < len(frame):
+            flags = frame[i]
+            i += 1
+            if flags == _STRING:
+                self._strings.append(string())
+                continue
+            if flags == _SEQ or flags == _GAP:
+                self.seq = varint()
+                self.gap = self.gap or flags == _GAP
+                continue
+            e = ObservableEmit(observable_id=self._strings[varint()])
+            delta = varint()
+            self._stamp += (delta >> 1) ^ -(delta & 1)
+            e.stamp = stamp_from_transport(self._stamp)
+            if flags & _FLOAT32:
+                e.value = float('%.7g' % _f32.unpack_from(frame, i)[0])
+                i += 4
+            elif flags & _FLOAT64:
+                e.value = _f64.unpack_from(frame, i)[0]
+                i += 8
+            if flags & _ENUM:
+                e.enumValue = self._strings[varint()]
+            if flags & _NOTE:
+                e.note = string()
+            emits.append(e)
+        return emits
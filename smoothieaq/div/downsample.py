@@ -0,0 +1,138 @@
+from typing import AsyncIterator, Optional
+
+from .emit import ObservableEmit
+
+# Streaming downsamplers: both only hold a couple of time buckets of emits in memory, so they can be used on
+# arbitrary long ranges read from an emit store. Emits must arrive ordered by stamp.
+
+
+def _bucket_no(stamp: float, start: float, width: float, buckets: int) -> int:
+    return min(buckets - 1, max(0, int((stamp - start) / width)))
+
+
+def _avg(bucket: list[ObservableEmit]) -> tuple[float, float]:
+    return (sum(e.stamp for e in bucket) / len(bucket),
+            sum(e.value for e in bucket) / len(bucket))
+
+
+def _first_gap(bucket: list[ObservableEmit]) -> Optional[ObservableEmit]:
+    return next((e for e in bucket if e.value is None), None)
+
+
+def _area(a: ObservableEmit, b: ObservableEmit, c: tuple[float, float]) -> float:
+    return abs((a.stamp - c[0]) * (b.value - a.value) - (a.stamp - b.stamp) * (c[1] - a.value))
+
+
+async def lttb(emits: AsyncIterator[ObservableEmit], start: float, end: float,
+               points: int) -> AsyncIterator[ObservableEmit]:
+    # Largest-Triangle-Three-Buckets over equal time buckets, keeping the first and last emit. Emits without a value
+    # mark gaps (e.g. "Empty default" emits), so a bucket with one is represented by its first gap instead of a value.
+    # At most points emits are returned, in the order of their stamps.
+    buckets = max(1, points - 2)
+    width = max(end - start, 0.001) / buckets
+    a: Optional[ObservableEmit] = None  # last selected value
+    first = True
+    current: list[ObservableEmit] = []
+    current_no = -1
+    next: list[ObservableEmit] = []
+    next_no = -1
+
+    def average(bucket: list[ObservableEmit]) -> Optional[tuple[float, float]]:
+        values = [e for e in bucket if e.value is not None]
+        return _avg(values) if values else None
+
+    def select(bucket: list[ObservableEmit], c: Optional[tuple[float, float]]) -> ObservableEmit:
+        nonlocal a
+        gap = _first_gap(bucket)
+        values = [e for e in bucket if e.value is not None]
+        if gap is not None:
+            after = [e for e in values if e.stamp >= gap.stamp]
+            a = after[-1] if after else a
+            return gap
+        if c is None:  # the next bucket has only gaps
+            c = (values[-1].stamp, values[-1].value)
+        b = a if a is not None else values[0]
+        a = max(values, key=lambda e: _area(b, e, c))
+        return a
+
+    async for e in emits:
+        if first:
+            first = False
+            if e.value is not None:
+                a = e
+            yield e
+            continue
+        no = _bucket_no(e.stamp, start, width, buckets)
+        if not current or no == current_no:
+            current.append(e)
+            current_no = no
+        elif not next or no == next_no:
+            next.append(e)
+            next_no = no
+        else:
+            yield select(current, average(next))
+            current, current_no = next, next_no
+            next, next_no = [e], no
+
+    if not current:
+        return
+    last = (next if next else current).pop()
+    if current and next:
+        yield select(current, average(next))
+        current = next
+    if current:
+        yield select(current, None if last.value is None else (last.stamp, last.value))
+    yield last
+
+
+def _in_order(a: Optional[ObservableEmit], b: Optional[ObservableEmit]) -> list[ObservableEmit]:
+    if a is None:
+        return []
+    if a is b:
+        return [a]
+    return [a, b] if a.stamp <= b.stamp else [b, a]
+
+
+async def minmax(emits: AsyncIterator[ObservableEmit], start: float, end: float,
+                 points: int) -> AsyncIterator[ObservableEmit]:
+    # Keeps the min and max emit of each time bucket for value series, or the first and last emit of each time
+    # bucket for enum and status series. At most points emits are returned.
+    buckets = max(1, points // 2)
+    width = max(end - start, 0.001) / buckets
+    a: Optional[ObservableEmit] = None
+    b: Optional[ObservableEmit] = None
+    bucket_no = -1
+
+    async for e in emits:
+        no = _bucket_no(e.stamp, start, width, buckets)
+        if no != bucket_no:
+            for f in _in_order(a, b):
+                yield f
+            a, b, bucket_no = e, e, no
+        elif e.value is None or a.value is None:
+            b = e
+        else:
+            if e.value < a.value:
+                a = e
+            if e.value > b.value:
+                b = e
+    for f in _in_order(a, b):
+        yield f
+
+
+async def _lttb_test():
+    import random
+
+    async def series(n: int) -> AsyncIterator[ObservableEmit]:
+        random.seed(n)
+        for i in range(n):
+            value = None if random.random() < 0.05 else random.uniform(0, 100)
+            yield ObservableEmit(observable_id="1:A", stamp=float(i), value=value)
+
+    for n in [1, 2, 3, 10, 100, 1000]:
+        for points in [3, 4, 20, 200]:
+            result = [e async for e in lttb(series(n), 0, n, points)]
+            stamps = [e.stamp for e in result]
+            assert len(result) <= max(points, 1), (n, points, len(result))
+            assert stamps == sorted(stamps) and len(set(stamps)) == len(stamps), (n, points, stamps)
+            assert stamps[0] == 0 and stamps[-1] == n - 1, (n, points, stamps)
@@ -1,23 +1,27 @@
 from ..div import time
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Optional, Callable, Any
 
 
 class Emit:
-    pass
+    __slots__ = ()
 
 
-@dataclass
+# Emits are slotted records, made once and not changed after being stamped, shared by every subscriber. Observable
+# ids are interned, so the ids of all emits of an observable are the same string.
+
+@dataclass(slots=True)
 class RawEmit(Emit):
     value: Optional[float] = None
     enumValue: Optional[str] = None
     note: Optional[str] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class ObservableEmit(RawEmit):
     observable_id: str = ""
     stamp: Optional[float] = None
+    _transport: Optional[tuple] = field(default=None, init=False, repr=False, compare=False)
 
 
 def emit_raw(id: str, raw_emit: RawEmit) -> ObservableEmit:
@@ -68,15 +72,24 @@ def stamp_to_transport(stamp: float) -> int:
     return int(stamp * 10)
 
 
-def emit_to_transport(emit: ObservableEmit) -> list[Any]:
-    stamp = stamp_to_transport(emit.stamp)
-    value = emit.value
-    if emit.note:
-        return [emit.observable_id, stamp, value, emit.enumValue, emit.note]
-    elif emit.enumValue:
-        return [emit.observable_id, stamp, value, emit.enumValue]
-    else:
-        return [emit.observable_id, stamp, value]
+def stamp_from_transport(stamp: int) -> float:
+    return stamp / 10
+
+
+def emit_to_transport(emit: ObservableEmit) -> tuple[Any, ...]:
+    # made once per emit, whatever the number of clients
+    transport = emit._transport
+    if transport is None:
+        stamp = stamp_to_transport(emit.stamp)
+        value = emit.value
+        if emit.note:
+            transport = (emit.observable_id, stamp, value, emit.enumValue, emit.note)
+        elif emit.enumValue:
+            transport = (emit.observable_id, stamp, value, emit.enumValue)
+        else:
+            transport = (emit.observable_id, stamp, value)
+        emit._transport = transport
+    return transport
 
 
 def emit_to_raw(emit: RawEmit) -> RawEmit:
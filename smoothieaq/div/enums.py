@@ -1,3 +1,5 @@
+from typing import Callable, Optional
+
 from smoothieaq.modelobject import objectstore
 from smoothieaq.model.enum import Enum, EnumSimple, QuantityType, Unit
 from smoothieaq.util.rxutil import ix
@@ -37,3 +39,24 @@ def convert(value: float, quantity_id: str, from_unit_id: str, to_unit_id: str):
 
     return to_unit(to_base(value, from_unit_id), to_unit_id)
 
+
+
+def converter(quantity_id: str, from_unit_id: str, to_unit_id: str) -> Callable[[Optional[float]], Optional[float]]:
+    # convert() as one multiply and add, as units are relative to each other by a factor and an offset
+    if from_unit_id == to_unit_id:
+        return lambda value: value
+    units: dict[str, Unit] = dict(ix(quantities[quantity_id].values).map(lambda u: (u.id, u)))
+
+    def to_base(unit_id: str) -> tuple[float, float]:
+        # (times, add) so value in base unit is value * times + add
+        unit = units[unit_id]
+        if not unit.relUnit:
+            return 1., 0.
+        (times, add) = to_base(unit.relUnit)
+        return times / (unit.relTimes or 1), add - (unit.relAdd or 0) / (unit.relTimes or 1) * times
+
+    (from_times, from_add) = to_base(from_unit_id)
+    (to_times, to_add) = to_base(to_unit_id)
+    times = from_times / to_times
+    add = (from_add - to_add) / to_times
+    return lambda value: None if value is None else value * times + add
@@ -0,0 +1,160 @@
+from bisect import bisect_left
+from typing import Callable, Iterable
+
+# Counters and histograms of the emit path, exposed on /metrics in the Prometheus text format. A metric is a family
+# of values by label values; code on the emit path gets its values once, when set up, so counting an emit is adding
+# to an int. Nothing is formatted until scraped. Gauges are read from their owners when scraped.
+
+
+class Value:
+    __slots__ = ('value',)
+
+    def __init__(self) -> None:
+        self.value = 0
+
+    def inc(self, n: int = 1) -> None:
+        self.value += n
+
+
+class Buckets:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds: list[float]) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, v: float) -> None:
+        self.counts[bisect_left(self.bounds, v)] += 1
+        self.sum += v
+        self.count += 1
+
+
+class _Metric:
+    type: str
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...]) -> None:
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._values: dict[tuple[str, ...], Value | Buckets] = {}
+        _metrics.append(self)
+
+    def _new(self) -> Value | Buckets:
+        return Value()
+
+    def labels(self, *values: str) -> Value | Buckets:
+        v = self._values.get(values)
+        if v is None:
+            v = self._values[values] = self._new()
+        return v
+
+    def remove(self, *values: str) -> None:
+        self._values.pop(values, None)
+
+    def _labels(self, values: tuple[str, ...], extra: str = "") -> str:
+        labels = [f'{n}="{_escape(v)}"' for n, v in zip(self.label_names, values)]
+        if extra:
+            labels.append(extra)
+        return "{" + ",".join(labels) + "}" if labels else ""
+
+    def _samples(self) -> Iterable[str]:
+        for values, v in self._values.items():
+            yield f"{self.name}{self._labels(values)} {v.value}"
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type}"
+        yield from self._samples()
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def labels(self, *values: str) -> Value:
+        return super().labels(*values)
+
+    def total(self) -> int:
+        return sum(v.value for v in self._values.values())
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...], buckets: list[float]) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = sorted(buckets)
+
+    def _new(self) -> Buckets:
+        return Buckets(self.buckets)
+
+    def labels(self, *values: str) -> Buckets:
+        return super().labels(*values)
+
+    def _samples(self) -> Iterable[str]:
+        for values, b in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + [float('inf')], b.counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound}"'
+                yield f"{self.name}_bucket{self._labels(values, le)} {cumulative}"
+            yield f"{self.name}_sum{self._labels(values)} {b.sum}"
+            yield f"{self.name}_count{self._labels(values)} {b.count}"
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...],
+                 read: Callable[[], Iterable[tuple[tuple[str, ...], float]]]) -> None:
+        super().__init__(name, help, labels)
+        self._read = read
+
+    def _samples(self) -> Iterable[str]:
+        for values, v in self._read():
+            yield f"{self.name}{self._labels(values)} {v}"
+
+
+class ReadCounter(Gauge):
+    # a counter kept by its owner
+    type = "counter"
+
+
+def _escape(v: str) -> str:
+    return v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+_metrics: list[_Metric] = []
+
+
+def render() -> str:
+    return "\n".join(line for m in _metrics for line in m.render()) + "\n"
+
+
+_seconds = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.]
+
+observable_emits_in = Counter(
+    "smoothieaq_observable_emits_in_total",
+    "Emits from the driver or expression of an observable, after debouncing by its emit control",
+    ("observable", "driver"))
+observable_emits_filtered = Counter(
+    "smoothieaq_observable_emits_filtered_total", "Emits of an observable dropped while paused or as the same value",
+    ("observable", "reason"))
+observable_emits = Counter(
+    "smoothieaq_observable_emits_total", "Emits sent by an observable", ("observable",))
+emit_device_emits_dropped = Counter(
+    "smoothieaq_emit_device_emits_dropped_total", "Emits an emit device did not store, while replaying",
+    ("emit_device",))
+emit_device_emits_sent = Counter(
+    "smoothieaq_emit_device_emits_sent_total", "Emits an emit device sent to its emit driver", ("emit_device",))
+emit_driver_emit_seconds = Histogram(
+    "smoothieaq_emit_driver_emit_seconds", "Duration of EmitDriver.emit", ("emit_device", "driver"), _seconds)
+emit_driver_batch_size = Histogram(
+    "smoothieaq_emit_driver_batch_size", "Emits per EmitDriver.emit", ("emit_device",),
+    [1, 10, 50, 100, 500, 1000, 5000])
+websocket_send_seconds = Histogram(
+    "smoothieaq_websocket_send_seconds", "Duration of sending a message on a websocket", ("stream",), _seconds)
+websocket_emits_dropped = Counter(
+    "smoothieaq_websocket_emits_dropped_total", "Emits not sent to a slow websocket client, as conflated or on overflow",
+    ("stream", "reason"))
@@ -0,0 +1,128 @@
+import asyncio
+import collections
+import logging
+import sys
+import threading
+import time as t
+from dataclasses import dataclass
+from types import FrameType
+from typing import Optional
+
+log = logging.getLogger(__name__)
+
+# A statistical profiler of the event loop, to find what is hot in the running process without restarting it under a
+# profiler. A thread takes the stack of the loop's thread every interval, and counts the stacks. A stack is the
+# frames run by the loop, rooted in the observable, device, driver or emit device whose code is innermost in it, if
+# any, or else in the name of the current task. The loop waiting for I/O is counted as idle.
+
+_owners = {('smoothieaq.device.observable', 'Observable'): 'observable',
+           ('smoothieaq.device.device', 'Device'): 'device',
+           ('smoothieaq.driver.driver', 'Driver'): 'driver',
+           ('smoothieaq.emitdevice.emitdevice', 'EmitDevice'): 'emitDevice',
+           ('smoothieaq.emitdriver.emitdriver', 'EmitDriver'): 'emitDriver'}
+
+
+@dataclass
+class Profile:
+    seconds: float
+    samples: int
+    stacks: dict[str, int]  # by collapsed stack, root;outer;...;inner
+
+    def collapsed(self) -> str:
+        # the input of flamegraph.pl, speedscope and the like
+        return "".join(f"{stack} {n}\n" for stack, n in sorted(self.stacks.items(), key=lambda i: -i[1]))
+
+    def top(self, limit: int = 50) -> str:
+        # samples by owner and function, in the function itself and in total, like pstats sorted by cumulative
+        own: collections.Counter[str] = collections.Counter()
+        total: collections.Counter[str] = collections.Counter()
+        for stack, n in self.stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += n
+            for frame in set(frames):
+                total[frame] += n
+        lines = [f"{self.samples} samples in {self.seconds:.1f} s", "",
+                 f"{'total':>7} {'total%':>7} {'self':>7} {'self%':>7}  function"]
+        for frame, n in total.most_common(limit):
+            lines.append(f"{n:7d} {n / self.samples:7.1%} {own[frame]:7d} {own[frame] / self.samples:7.1%}  {frame}")
+        return "\n".join(lines) + "\n"
+
+
+_running = False
+
+
+def is_running() -> bool:
+    return _running
+
+
+async def profile(seconds: float, interval: float = 0.01) -> Profile:
+    global _running
+    assert not _running, "Already profiling"
+    _running = True
+    try:
+        log.info(f"Profiling for {seconds} s every {interval * 1000:.0f} ms")
+        loop = asyncio.get_running_loop()
+        sampler = _Sampler(loop, threading.get_ident())
+        return await asyncio.to_thread(sampler.run, seconds, interval)
+    finally:
+        _running = False
+
+
+class _Sampler:
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, loop_thread: int) -> None:
+        self.loop = loop
+        self.loop_thread = loop_thread
+        self.stacks: collections.Counter[str] = collections.Counter()
+
+    def run(self, seconds: float, interval: float) -> Profile:
+        samples = 0
+        start = t.monotonic()
+        end = start + seconds
+        while (now := t.monotonic()) < end:
+            frame = sys._current_frames().get(self.loop_thread)
+            if frame is None:
+                break
+            self.stacks[self._stack(frame)] += 1
+            samples += 1
+            del frame
+            t.sleep(max(0., min(interval, end - now)))
+        return Profile(seconds=t.monotonic() - start, samples=samples, stacks=dict(self.stacks))
+
+    def _stack(self, frame: Optional[FrameType]) -> str:
+        names: list[str] = []
+        owner = None
+        while frame:
+            module = frame.f_globals.get('__name__', '')
+            if module == 'asyncio.base_events' and frame.f_code.co_name == '_run_once':
+                break
+            if module == 'selectors':
+                return "idle"
+            if not module.startswith('asyncio.'):
+                names.append(f"{module}:{frame.f_code.co_qualname}")
+                if owner is None:
+                    owner = _owner(frame)
+            frame = frame.f_back
+        if not names:
+            return "idle"
+        names.append(owner or self._task_name())
+        return ";".join(reversed(names))
+
+    def _task_name(self) -> str:
+        task = asyncio.current_task(self.loop)
+        if task and not task.get_name().startswith("Task-"):
+            return f"task {task.get_name()}"
+        return "loop"
+
+
+def _owner(frame: FrameType) -> Optional[str]:
+    code = frame.f_code
+    if 'self' not in code.co_varnames and 'self' not in code.co_freevars:
+        return None
+    obj = frame.f_locals.get('self')
+    for cls in type(obj).__mro__:
+        kind = _owners.get((cls.__module__, cls.__name__))
+        if kind:
+            path = getattr(obj, 'path', None)
+            return f"{kind} {obj.id}/{path}" if kind in ('driver', 'emitDriver') and path else f"{kind} {obj.id}"
+    return None
@@ -0,0 +1,53 @@
+from dataclasses import dataclass
+
+from .emit import ObservableEmit
+
+resolutions: dict[str, int] = {'minute': 60, 'hour': 60 * 60, 'day': 24 * 60 * 60}
+
+
+@dataclass
+class Rollup:
+    observable_id: str
+    resolution: int  # seconds
+    bucket: float  # start of bucket
+    min: float
+    max: float
+    sum: float
+    count: int
+    last: float
+    last_stamp: float
+
+    @property
+    def avg(self) -> float:
+        return self.sum / self.count
+
+    def add(self, value: float, stamp: float) -> None:
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.sum += value
+        self.count += 1
+        if stamp >= self.last_stamp:
+            self.last = value
+            self.last_stamp = stamp
+
+
+def bucket_of(stamp: float, resolution: int) -> float:
+    return float(int(stamp // resolution) * resolution)
+
+
+def rollups(emits: list[ObservableEmit], resolution_names: list[str]) -> list[Rollup]:
+    # Partial aggregates for one batch of emits, to be merged into the stored buckets by the emit driver. Day buckets
+    # are UTC days.
+    rs: dict[tuple[str, int, float], Rollup] = {}
+    for e in emits:
+        if e.value is None:
+            continue
+        for name in resolution_names:
+            resolution = resolutions[name]
+            key = (e.observable_id, resolution, bucket_of(e.stamp, resolution))
+            r = rs.get(key)
+            if r is None:
+                rs[key] = Rollup(e.observable_id, resolution, key[2], e.value, e.value, e.value, 1, e.value, e.stamp)
+            else:
+                r.add(e.value, e.stamp)
+    return list(rs.values())
@@ -1,6 +1,9 @@
+import asyncio
+import selectors
 import time as t
 from dataclasses import dataclass
 import datetime as dt
+from typing import Optional, Coroutine, Any
 
 
 @dataclass
@@ -10,6 +13,8 @@ class _Simulate:
     starting_time: float = t.time()
     speed: float = 1
     minDuration: float = 2
+    hold: Optional[float] = None  # the clock stops here, e.g. at the next emit while replaying
+    loop: Optional['VirtualTimeLoop'] = None  # the clock is the time of this loop, when running on virtual time
 
 
 simulating = _Simulate()
@@ -32,14 +37,100 @@ def is_simulating() -> bool:
     return simulating.simulating
 
 
+def _time() -> float:
+    return simulating.start_time + (t.time() - simulating.starting_time) * simulating.speed
+
+
 def time() -> float:
     if not simulating.simulating:
         return t.time()
-    return simulating.start_time + (t.time() - simulating.starting_time) * simulating.speed
+    if simulating.loop:
+        return simulating.start_time + simulating.loop.time()
+    now = _time()
+    return now if simulating.hold is None or now < simulating.hold else simulating.hold
+
+
+def hold(stamp: Optional[float]) -> float:
+    # Stops the simulated clock at stamp, and returns the real seconds until it gets there. If that is less than a
+    # millisecond, or the clock was held before stamp for longer than that, it restarts from stamp, so it never goes
+    # backwards.
+    simulating.hold = stamp
+    if stamp is None:
+        return 0.
+    now = _time()
+    if (stamp - now) / simulating.speed < 0.001:
+        simulating.start_time = stamp
+        simulating.starting_time = t.time()
+        return 0.
+    return (stamp - now) / simulating.speed
 
 
 def duration(d: float) -> float:
-    if not simulating.simulating:
+    if not simulating.simulating or simulating.loop:
         return d
     du = d / simulating.speed
     return du if du > simulating.minDuration or d < simulating.minDuration else simulating.minDuration
+
+
+# Virtual time: an event loop with a clock of its own, that instead of waiting for the next timer, jumps to it. All
+# sleeps, timers, intervals and debounces run on that clock, so a week of schedules and programs takes seconds, and
+# runs the same every time. Sockets and threads are polled but not waited for while a timer is due, so they do not
+# hold the clock.
+
+class _VirtualSelector(selectors.BaseSelector):
+
+    def __init__(self, loop: 'VirtualTimeLoop') -> None:
+        self._loop = loop
+        self._selector = selectors.DefaultSelector()
+
+    def register(self, fileobj, events, data=None) -> selectors.SelectorKey:
+        return self._selector.register(fileobj, events, data)
+
+    def unregister(self, fileobj) -> selectors.SelectorKey:
+        return self._selector.unregister(fileobj)
+
+    def modify(self, fileobj, events, data=None) -> selectors.SelectorKey:
+        return self._selector.modify(fileobj, events, data)
+
+    def get_map(self):
+        return self._selector.get_map()
+
+    def close(self) -> None:
+        self._selector.close()
+
+    def select(self, timeout: Optional[float] = None) -> list[tuple[selectors.SelectorKey, int]]:
+        if timeout is None:  # nothing scheduled, wait for real
+            return self._selector.select()
+        events = self._selector.select(0)
+        if not events and timeout > 0:
+            self._loop._now += timeout
+        return events
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+
+    def __init__(self) -> None:
+        self._now = 0.
+        super().__init__(_VirtualSelector(self))
+
+    def time(self) -> float:
+        return self._now
+
+
+def run_virtual(
+        main: Coroutine[Any, Any, Any],
+        start_date: Optional[dt.date] = None,
+        start_time: Optional[dt.time] = None,
+) -> Any:
+    # runs main on virtual time, simulating from start_date and start_time, by default now
+    now = dt.datetime.now()
+    loop = VirtualTimeLoop()
+    simulating.simulating = True
+    simulating.start_time = dt.datetime.combine(start_date or now.date(), start_time or now.time()).timestamp()
+    simulating.loop = loop
+    try:
+        with asyncio.Runner(loop_factory=lambda: loop) as runner:
+            return runner.run(main)
+    finally:
+        simulating.simulating = False
+        simulating.loop = None
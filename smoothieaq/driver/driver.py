@@ -93,6 +93,15 @@ class Driver[H: Hal]:
         if self.hal:
             await self.hal.stop()
 
+    def start_replay(self) -> dict[str, rx.AsyncObserver[RawEmit]]:
+        # live emits are dropped while stored emits are replayed into the returned observers
+        observers = self._rx_observers
+        self._rx_observers = dict((key, rx.AsyncAnonymousObserver()) for key in observers.keys())
+        return observers
+
+    def stop_replay(self, observers: dict[str, rx.AsyncObserver[RawEmit]]) -> None:
+        self._rx_observers = observers
+
     async def close(self) -> None:
         log.debug(f"doing driver.close({self.id}/{self.path})")
         for o in self._rx_observers.values():
@@ -10,7 +10,7 @@ from .driver import Status
 from .driver import Driver
 from ..hal.globals import globalhals
 from ..hal.globals.mqtthal import MqttHal
-from ..util.rxutil import AsyncBehaviorSubject, do_later, trace, publish
+from ..util.rxutil import AsyncBehaviorSubject, do_later, trace, publish, distinct_until_changed
 
 log = logging.getLogger(__name__)
 
@@ -70,7 +70,7 @@ class HomeAssistantMqttDriver(Driver[MqttHal]):
                     rx.filter(lambda re: not re is None)
             )
             if not type == 'E':
-                obs = rx.pipe(obs, rx.distinct_until_changed)
+                obs = rx.pipe(obs, distinct_until_changed())
             self.rx_observables[obs_id] = obs
 
             def status(t: tuple[tuple[RawEmit, dict], dict]) -> RawEmit:
@@ -88,7 +88,7 @@ class HomeAssistantMqttDriver(Driver[MqttHal]):
                              rx.combine_latest(rx_bridge_availability),
                              rx.combine_latest(self.rx_availability),
                              rx.map(status),
-                             rx.distinct_until_changed,
+                             distinct_until_changed(),
                              )
         return self
 
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import sys
+import threading
+import time as t
+from typing import Optional
+
+import aioreactive as rx
+import psutil
+
+from smoothieaq.div.emit import RawEmit
+from .driver import Status
+from .pollingdriver import PollingDriver
+from ..div import metrics
+from ..hal.hal import NoHal
+
+log = logging.getLogger(__name__)
+
+
+class MonitorDriver(PollingDriver[NoHal]):
+    # SmoothieAq watching itself. A thread asks the event loop to run a callback every slowCallbackMs, and measures
+    # how long it takes to get run, the loop lag. If it takes longer than slowCallbackMs, the loop is blocked by a slow
+    # callback, and the thread names it from the stack of the loop's thread.
+    id = "MonitorDriver"
+    slow_key: str = 'slowCallbackMs'
+    rx_key_lag: str = 'A'
+    rx_key_slow: str = 'B'
+    rx_key_tasks: str = 'C'
+    rx_key_rss: str = 'D'
+    rx_key_fds: str = 'E'
+    rx_key_emits: str = 'F'
+
+    def __init__(self):
+        super().__init__()
+        self.slowCallbackMs: Optional[float] = None
+        self._process = psutil.Process()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._max_lag: float = 0.
+        self._slow: list[tuple[float, str]] = []
+        self._emits: int = 0
+        self._emits_time: float = 0.
+
+    async def discover_device_paths(self) -> list[str]:
+        return ["smoothieaq"]
+
+    def _set_subjects(self) -> dict[str, rx.AsyncSubject]:
+        return dict((key, rx.AsyncSubject[RawEmit]()) for key in [
+            self.rx_key_lag, self.rx_key_slow, self.rx_key_tasks, self.rx_key_rss, self.rx_key_fds, self.rx_key_emits])
+
+    def _init(self):
+        super()._init()
+        self.slowCallbackMs = float(self.params.try_find(self.slow_key).default_value("100"))
+
+    async def start(self) -> None:
+        await super().start()
+        self._emits = metrics.observable_emits.total()
+        self._emits_time = t.monotonic()
+        # a new event for each thread, so a thread not yet stopped by stop() can't be restarted by start()
+        self._stopping = threading.Event()
+        args = (asyncio.get_running_loop(), threading.get_ident(), self._stopping)
+        self._thread = threading.Thread(target=self._watch, args=args, name="smoothieaq-monitor", daemon=True)
+        self._thread.start()
+        await self.set_status(Status.RUNNING)
+
+    async def stop(self) -> None:
+        await super().stop()
+        self._stopping.set()
+
+    def _watch(self, loop: asyncio.AbstractEventLoop, loop_thread: int, stopping: threading.Event) -> None:
+        slow = self.slowCallbackMs / 1000
+        while not stopping.is_set():
+            ran = threading.Event()
+            sent = t.monotonic()
+            try:
+                loop.call_soon_threadsafe(ran.set)
+            except RuntimeError:  # the loop is closed
+                return
+            if not ran.wait(slow):
+                name = _blocking(sys._current_frames().get(loop_thread))
+                while not ran.wait(slow):
+                    if stopping.is_set():
+                        return
+                self._slow.append((t.monotonic() - sent, name))
+            self._max_lag = max(self._max_lag, t.monotonic() - sent)
+            stopping.wait(slow)
+
+    async def poll(self) -> None:
+        lag, self._max_lag = self._max_lag, 0.
+        slow, self._slow = self._slow, []
+        emits, now = metrics.observable_emits.total(), t.monotonic()
+        emits_per_second = (emits - self._emits) / (now - self._emits_time)
+        self._emits, self._emits_time = emits, now
+        fds = self._process.num_fds() if hasattr(self._process, "num_fds") else self._process.num_handles()
+
+        note = None
+        if slow:
+            (duration, name) = max(slow)
+            note = f"Slowest {name} {duration * 1000:.0f} ms"
+        for key, emit in [
+            (self.rx_key_lag, RawEmit(value=lag * 1000)),
+            (self.rx_key_slow, RawEmit(value=len(slow), note=note)),
+            (self.rx_key_tasks, RawEmit(value=len(asyncio.all_tasks()))),
+            (self.rx_key_rss, RawEmit(value=self._process.memory_info().rss / 1e6)),
+            (self.rx_key_fds, RawEmit(value=fds)),
+            (self.rx_key_emits, RawEmit(value=emits_per_second)),
+        ]:
+            log.debug(f"doing monitor.emit({self.id}/{self.path}, {key}, {emit})")
+            await self._rx_observers[key].asend(emit)
+
+
+def _blocking(frame) -> str:
+    # the innermost frame of SmoothieAq code, or else the outermost frame run by the loop
+    outermost = None
+    while frame:
+        module = frame.f_globals.get('__name__', '')
+        if module.startswith('smoothieaq.'):
+            return f"{module}:{frame.f_code.co_qualname}"
+        if module.startswith('asyncio.'):
+            break
+        outermost = f"{module}:{frame.f_code.co_qualname}"
+        frame = frame.f_back
+    return outermost or "unknown"
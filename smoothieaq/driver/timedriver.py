@@ -1,4 +1,3 @@
-import time as t
 from typing import Optional
 
 import aioreactive as rx
@@ -23,19 +22,16 @@ class TimeDriver(Driver[NoHal]):
 
     async def start(self) -> None:
         await super().start()
-        duration = time.duration(60.)
-        first = int(t.time() / duration) * duration + duration
-
-        def tick(at):
-            async def _tick(n):
-                await self._rx_observers[self.rx_key].asend(RawEmit(value=time.time(), enumValue="tick"))
-                next = at + duration
-                await self.polling_disposable.dispose_async()
-                self.polling_disposable = await rx.timer(next - t.time()).subscribe_async(tick(next))
+        # ticks on every minute of the clock, simulated or not
+        async def tick(n):
+            await self._rx_observers[self.rx_key].asend(RawEmit(value=time.time(), enumValue="tick"))
+            await self.polling_disposable.dispose_async()
+            await schedule((round(time.time() / 60.) + 1) * 60.)
 
-            return _tick
+        async def schedule(at: float) -> None:
+            self.polling_disposable = await rx.timer(time.duration(at - time.time())).subscribe_async(tick)
 
-        self.polling_disposable = await rx.timer(first - t.time()).subscribe_async(tick(first))
+        await schedule((int(time.time() / 60.) + 1) * 60.)
         await self.set_status(Status.RUNNING)
 
     async def stop(self) -> None:
@@ -1,13 +1,19 @@
 import asyncio
 import logging
-from typing import Optional
+import time as t
+from typing import Optional, AsyncIterator
 
 import aioreactive as rx
 
+from ..device import replay
 from ..device.devices import get_rx_device_updates, rx_all_observables
 from ..emitdriver.emitdriver import EmitDriver
 from ..emitdriver.emitdrivers import find_emit_driver
+from ..div import metrics, time
+from ..div.emit import ObservableEmit
+from ..div.rollup import rollups, resolutions
 from ..model import thing as aqt
+from .outbox import Outbox
 from ..util.rxutil import buffer_with_time, trace
 
 log = logging.getLogger(__name__)
@@ -21,6 +27,9 @@ class EmitDevice:
         self.driver: Optional[EmitDriver] = None
         self.paused: bool = True
         self.filter: dict[str, bool] = {}
+        self.rollups: list[str] = []
+        self.outbox: Optional[Outbox] = None
+        self._emitted: Optional[list[ObservableEmit]] = None
         self._disposables: list[rx.AsyncDisposable] = []
 
     async def pause(self, paused: bool = True) -> None:
@@ -76,10 +85,14 @@ class EmitDevice:
 
         if self.m_emit_device.enablement == 'enabled':
             self.driver = await self.driver_init(m_emit_device.driver, self.id)
+            if self.driver.can_rollup:
+                self.rollups = m_emit_device.rollups if m_emit_device.rollups is not None else list(resolutions.keys())
+            self.outbox = Outbox(self.id, self.send, m_emit_device.outboxNo or 10000)
 
     async def start(self):
         log.info(f"doing emitdevice.start({self.id})")
         await self.driver.start()
+        await self.outbox.start()
         self._disposables.append(await rx.pipe(
             get_rx_device_updates(),
             rx.filter(lambda md: md.enablement == 'enabled')
@@ -89,10 +102,53 @@ class EmitDevice:
             rx.filter(lambda e: self.filter.get(e.observable_id, True)),
             buffer_with_time(self.m_emit_device.bufferTime or 0.5, self.m_emit_device.bufferNo or 1000)
         )
-        self._disposables.append(await o.subscribe_async(self.driver.emit))
+        self._disposables.append(await o.subscribe_async(self.emit))
+        if self.m_emit_device.retentionDays is not None or self.m_emit_device.rollupRetentionDays:
+            if not self.driver.can_expire:
+                log.error(f"Emit device {self.id} has retention, but its driver can't expire emits")
+            else:
+                async def _expire(n):
+                    await self.expire()
+                self._disposables.append(await rx.interval(60, 3600).subscribe_async(_expire))
+
+    async def emit(self, emits: list[ObservableEmit]) -> None:
+        if replay.is_replaying():
+            metrics.emit_device_emits_dropped.labels(self.id).inc(len(emits))
+            return
+        self.outbox.put(emits)
+
+    async def send(self, emits: list[ObservableEmit]) -> None:
+        # the outbox sends a batch again until both the emits and the rollups are stored, so if only the rollups
+        # failed, the emits are not stored again
+        if emits is not self._emitted:
+            t0 = t.perf_counter()
+            await self.driver.emit(emits)
+            metrics.emit_driver_emit_seconds.labels(self.id, self.driver.id).observe(t.perf_counter() - t0)
+            metrics.emit_driver_batch_size.labels(self.id).observe(len(emits))
+            metrics.emit_device_emits_sent.labels(self.id).inc(len(emits))
+            self._emitted = emits
+        if self.rollups:
+            await self.driver.emit_rollups(rollups(emits, self.rollups))
+        self._emitted = None
+
+    async def expire(self) -> None:
+        now = time.time()
+        try:
+            if self.m_emit_device.retentionDays is not None:
+                await self.driver.expire(now - self.m_emit_device.retentionDays * resolutions['day'])
+            for resolution, days in (self.m_emit_device.rollupRetentionDays or {}).items():
+                await self.driver.expire_rollups(resolutions[resolution], now - days * resolutions['day'])
+        except Exception as e:
+            log.error(f"Trying to expire emits of {self.id}", exc_info=e)
+
+    def history(self, observable_id: str, start: float, end: float) -> AsyncIterator[ObservableEmit]:
+        assert self.driver.can_read
+        return self.driver.history(observable_id, start, end)
 
     async def stop(self):
         log.info(f"doing emitdevice.stop({self.id})")
-        await self.driver.stop()
         for disposable in self._disposables:
             await disposable.dispose_async()
+        self._disposables = []
+        await self.outbox.stop()
+        await self.driver.stop()
@@ -1,10 +1,29 @@
+from typing import Optional, Callable
+
 from .emitdevice import EmitDevice
+from .outbox import OutboxStatus
+from ..div import metrics
 from ..model import thing as aqt
 from ..modelobject import objectstore as os
 
 emit_devices: dict[str, EmitDevice] = dict()
 
 
+def _outbox_gauge(name: str, help: str, read: Callable[[OutboxStatus], float], type=metrics.Gauge) -> metrics.Gauge:
+    return type(name, help, ("emit_device",), lambda: (
+        ((id, ), read(emit_device.outbox.status())) for (id, emit_device) in emit_devices.items()
+        if emit_device.outbox))
+
+
+_outbox_gauge("smoothieaq_outbox_depth", "Emits not yet sent by an emit device", lambda s: s.depth)
+_outbox_gauge("smoothieaq_outbox_spilled", "Emits in the spill file of an emit device", lambda s: s.spilled)
+_outbox_gauge("smoothieaq_outbox_lag_seconds", "Age of the oldest emit not yet sent by an emit device",
+              lambda s: s.lag)
+_outbox_gauge("smoothieaq_outbox_failures_total", "Failed sends of an emit device", lambda s: s.failures,
+              metrics.ReadCounter)
+_outbox_gauge("smoothieaq_outbox_sink_up", "1 if the emit driver of an emit device is working", lambda s: int(s.sinkUp))
+
+
 async def _add_emit_device(m_emit_device: aqt.EmitDevice) -> None:
     if not m_emit_device.enablement:
         m_emit_device.enablement = 'enabled'
@@ -30,3 +49,11 @@ async def create_new_emit_device(m_emit_device: aqt.EmitDevice) -> str:
     assert not emit_devices.__contains__(m_emit_device.id)
     await _add_emit_device(m_emit_device)
     return m_emit_device.id
+
+
+def get_history_emit_device() -> Optional[EmitDevice]:
+    # the first enabled emit device that can be read from
+    for emit_device in emit_devices.values():
+        if emit_device.m_emit_device.enablement == 'enabled' and emit_device.driver.can_read:
+            return emit_device
+    return None
@@ -0,0 +1,239 @@
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Awaitable, Optional
+
+import orjson
+
+from ..div import time
+from ..div.emit import ObservableEmit
+
+log = logging.getLogger(__name__)
+
+outbox_dir: str = os.environ.get("smoothieaq_outbox_dir", tempfile.gettempdir())
+
+
+@dataclass
+class OutboxStatus:
+    depth: int  # emits not yet sent, in memory and spilled
+    spilled: int  # emits waiting in the spill file
+    lag: float  # seconds since the oldest emit not yet sent
+    sent: int
+    failures: int
+    sinkUp: bool
+
+
+def _to_line(emits: list[ObservableEmit]) -> bytes:
+    return orjson.dumps([[e.observable_id, e.stamp, e.value, e.enumValue, e.note] for e in emits]) + b'\n'
+
+
+def _from_line(line: bytes) -> list[ObservableEmit]:
+    return [ObservableEmit(observable_id=sys.intern(id), stamp=stamp, value=value, enumValue=enumValue, note=note)
+            for (id, stamp, value, enumValue, note) in orjson.loads(line)]
+
+
+class Outbox:
+    # Decouples an EmitDevice from its emit driver: put() never waits for the driver. Batches are kept in a bounded
+    # in-memory queue, and go to an append-only spill file when the queue is full or the driver is failing. Once
+    # anything is spilled, new batches are appended to the spill file as well until it has been replayed, so the
+    # driver always gets the emits in order.
+    #
+    # The spill file is only touched from a thread of its own, so the event loop doesn't wait for the disk, and the
+    # file operations run in the order they are asked for. Spilled batches are fsynced, but a batch put() is spilling
+    # can still be lost if the process dies before the thread has written it.
+
+    def __init__(self, id: str, sink: Callable[[list[ObservableEmit]], Awaitable[None]], max_emits: int = 10000,
+                 max_send: int = 5000) -> None:
+        self.id = id
+        self.sink = sink
+        self.max_emits = max_emits
+        self.max_send = max_send
+        self.spill_file = os.path.join(outbox_dir, f"smoothieaq-outbox-{id}.jsonl")
+        self.sent: int = 0
+        self.failures: int = 0
+        self.sink_up: bool = True
+        self._memory: deque[list[ObservableEmit]] = deque()
+        self._memory_count: int = 0
+        self._in_flight: Optional[list[ObservableEmit]] = None
+        self._in_flight_spilled: bool = False
+        self._spilled: int = 0
+        self._spill_pos: int = 0
+        self._spilled_stamp: Optional[float] = None  # of the oldest spilled emit not yet sent
+        self._event = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"smoothieaq-outbox-{id}")
+
+    async def _in_io(self, fn: Callable[..., Any], *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._io, fn, *args)
+
+    def status(self) -> OutboxStatus:
+        stamps = [emits[0].stamp for emits in (self._in_flight, self._memory[0] if self._memory else None) if emits]
+        if self._spilled and self._spilled_stamp is not None:
+            stamps.append(self._spilled_stamp)
+        return OutboxStatus(
+            depth=len(self._in_flight or []) + self._memory_count + self._spilled,
+            spilled=self._spilled,
+            lag=time.time() - min(stamps) if stamps else 0.,
+            sent=self.sent,
+            failures=self.failures,
+            sinkUp=self.sink_up
+        )
+
+    def put(self, emits: list[ObservableEmit]) -> None:
+        if not emits:
+            return
+        if self._spilled or not self.sink_up or self._memory_count + len(emits) > self.max_emits:
+            if not self._spilled:
+                self._spilled_stamp = emits[0].stamp
+            self._spilled += len(emits)
+            self._io.submit(self._spill, [emits]).add_done_callback(self._spill_done)
+        else:
+            self._memory.append(emits)
+            self._memory_count += len(emits)
+        self._event.set()
+
+    def _spill_done(self, future: Future) -> None:
+        if future.exception():
+            log.error(f"Outbox {self.id} failed spilling emits to {self.spill_file}", exc_info=future.exception())
+
+    def _spill(self, batches: list[list[ObservableEmit]], rest: bytes = b'') -> None:
+        with open(self.spill_file, "ab") as f:
+            for emits in batches:
+                f.write(_to_line(emits))
+            f.write(rest)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _read_spill(self) -> tuple[list[ObservableEmit], int]:
+        emits: list[ObservableEmit] = []
+        with open(self.spill_file, "rb") as f:
+            f.seek(self._spill_pos)
+            while len(emits) < self.max_send:
+                line = f.readline()
+                if not line.endswith(b'\n'):
+                    break
+                emits += _from_line(line)
+            return emits, f.tell() if emits else self._spill_pos
+
+    def _oldest_spilled(self) -> Optional[float]:
+        with open(self.spill_file, "rb") as f:
+            f.seek(self._spill_pos)
+            line = f.readline()
+            return orjson.loads(line)[0][1] if line.endswith(b'\n') else None
+
+    def _write_pos(self) -> None:
+        with open(self.spill_file + ".pos", "w") as f:
+            f.write(str(self._spill_pos))
+
+    def _remove_spill(self) -> None:
+        for file in [self.spill_file, self.spill_file + ".pos"]:
+            if os.path.exists(file):
+                os.remove(file)
+
+    def _respill(self, unsent: list[list[ObservableEmit]], spill_pos: int) -> None:
+        # unsent emits in memory are older than the spilled ones
+        rest = b''
+        if os.path.exists(self.spill_file):
+            with open(self.spill_file, "rb") as f:
+                f.seek(spill_pos)
+                rest = f.read()
+        self._remove_spill()
+        self._spill(unsent, rest)
+
+    def _recover(self) -> tuple[int, int]:
+        # spilled emits left by a previous run
+        if not os.path.exists(self.spill_file):
+            return 0, 0
+        try:
+            with open(self.spill_file + ".pos") as f:
+                spill_pos = int(f.read())
+        except FileNotFoundError:
+            spill_pos = 0
+        with open(self.spill_file, "rb") as f:
+            f.seek(spill_pos)
+            spilled = sum(len(orjson.loads(line)) for line in f if line.endswith(b'\n'))
+        if not spilled:
+            self._remove_spill()
+        return spilled, spill_pos
+
+    async def _next(self) -> tuple[list[ObservableEmit], int]:
+        emits: list[ObservableEmit] = []
+        while self._memory and (not emits or len(emits) + len(self._memory[0]) <= self.max_send):
+            batch = self._memory.popleft()
+            self._memory_count -= len(batch)
+            emits += batch
+        if emits:
+            return emits, -1
+        if self._spilled:
+            return await self._in_io(self._read_spill)
+        return emits, -1
+
+    async def _send(self, emits: list[ObservableEmit]) -> None:
+        backoff = 1.
+        while True:
+            try:
+                await self.sink(emits)
+                self.sink_up = True
+                self.sent += len(emits)
+                return
+            except Exception as e:
+                self.failures += 1
+                if self.sink_up:
+                    log.error(f"Outbox {self.id} failed sending {len(emits)} emits, spilling until it recovers",
+                              exc_info=e)
+                self.sink_up = False
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60.)
+
+    async def _run(self) -> None:
+        while True:
+            emits, spill_pos = await self._next()
+            if not emits:
+                self._event.clear()
+                await self._event.wait()
+                continue
+            self._in_flight = emits
+            self._in_flight_spilled = spill_pos >= 0
+            await self._send(emits)
+            self._in_flight = None
+            if spill_pos >= 0:
+                self._spilled -= len(emits)
+                self._spill_pos = spill_pos
+                if self._spilled:
+                    await self._in_io(self._write_pos)
+                    self._spilled_stamp = await self._in_io(self._oldest_spilled)
+                else:
+                    self._spill_pos = 0
+                    await self._in_io(self._remove_spill)
+
+    async def start(self) -> None:
+        self._spilled, self._spill_pos = await self._in_io(self._recover)
+        if self._spilled:
+            self._spilled_stamp = await self._in_io(self._oldest_spilled)
+            log.info(f"Outbox {self.id} recovered {self._spilled} spilled emits")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 5) -> None:
+        # tries to send what is left, and keeps the rest in the spill file for the next start
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self.status().depth and self.sink_up and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+        self._task.cancel()
+        unsent = ([self._in_flight] if self._in_flight and not self._in_flight_spilled else []) + list(self._memory)
+        self._in_flight = None
+        self._memory.clear()
+        self._memory_count = 0
+        if not unsent:
+            await self._in_io(lambda: None)  # waits for the spilling of put()
+            return
+        await self._in_io(self._respill, unsent, self._spill_pos)
+        self._spilled += sum(len(emits) for emits in unsent)
+        self._spill_pos = 0
+        self._spilled_stamp = unsent[0][0].stamp
+        log.info(f"Outbox {self.id} spilled {self.status().depth} unsent emits")
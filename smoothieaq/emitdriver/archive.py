@@ -0,0 +1,355 @@
+import logging
+import mmap
+import os
+import struct
+import urllib.parse
+from dataclasses import dataclass
+from typing import Optional
+
+import orjson
+
+from ..div.emit import ObservableEmit
+from ..util.bitstream import BitWriter, BitReader
+
+log = logging.getLogger(__name__)
+
+# Compressed columnar archive of closed time blocks of emits, one append-only file per observable. Every block holds
+# the emits of one observable in [start, end), ordered by stamp, as separate columns:
+#   stamps: milliseconds, delta-of-delta encoded
+#   values: Gorilla encoded, i.e. each float XOR'ed with the previous one and only the meaningful bits stored, or
+#           as delta encoded integers if all values of the block have few decimals
+#   enums:  dictionary encoded, a single bit when unchanged
+#   notes:  sparse, as a json list of [row, note]
+# Files are read through mmap, and only the headers are read to find the blocks of a range. Emits arriving after their
+# block was archived go into an extra block with the same start.
+
+_magic = b'AQA1'
+# magic, start, end, count, bytes of stamps, values, dictionary, enums and notes, decimals of values (-1 for XOR)
+_header = struct.Struct('<4sqqIIIIIIb')
+_mask64 = (1 << 64) - 1
+
+
+def _float_bits(value: float) -> int:
+    return struct.unpack('<Q', struct.pack('<d', value))[0]
+
+
+def _bits_float(bits: int) -> float:
+    return struct.unpack('<d', struct.pack('<Q', bits))[0]
+
+
+def _write_small(w: BitWriter, n: int) -> None:
+    # variable length code for integers that are mostly 0 or small
+    if n == 0:
+        w.write(0, 1)
+    elif -63 <= n <= 64:
+        w.write(0b10, 2)
+        w.write(n + 63, 7)
+    elif -2047 <= n <= 2048:
+        w.write(0b110, 3)
+        w.write(n + 2047, 12)
+    elif -524287 <= n <= 524288:
+        w.write(0b1110, 4)
+        w.write(n + 524287, 20)
+    else:
+        w.write(0b1111, 4)
+        w.write(n & _mask64, 64)
+
+
+def _read_small(r: BitReader) -> int:
+    if not r.read(1):
+        return 0
+    if not r.read(1):
+        return r.read(7) - 63
+    if not r.read(1):
+        return r.read(12) - 2047
+    if not r.read(1):
+        return r.read(20) - 524287
+    n = r.read(64)
+    return n - (1 << 64) if n >= 1 << 63 else n
+
+
+def _encode_stamps(stamps: list[int]) -> bytes:
+    w = BitWriter()
+    w.write(stamps[0], 64)
+    prev, prev_delta = stamps[0], 0
+    for stamp in stamps[1:]:
+        delta = stamp - prev
+        _write_small(w, delta - prev_delta)
+        prev, prev_delta = stamp, delta
+    return w.getvalue()
+
+
+def _decode_stamps(buf, count: int) -> list[int]:
+    r = BitReader(buf)
+    stamp = r.read(64)
+    stamps = [stamp]
+    delta = 0
+    for _ in range(count - 1):
+        delta += _read_small(r)
+        stamp += delta
+        stamps.append(stamp)
+    return stamps
+
+
+def _decimals(values: list[Optional[float]]) -> int:
+    # Values are mostly rounded to a number of decimals by the observables. If all values of a block are, they are
+    # stored as delta encoded integers, which compresses much better than XOR'ing their floats. -1 if not.
+    present = [v for v in values if v is not None]
+    for d in range(7):
+        scale = 10 ** d
+        if all(abs(v) * scale < 1 << 53 and round(v * scale) / scale == v for v in present):
+            return d
+    return -1
+
+
+def _encode_decimal_values(values: list[Optional[float]], d: int) -> bytes:
+    # per row: '0' no value, or '1' followed by the delta from the previous value, times 10^d
+    w = BitWriter()
+    scale = 10 ** d
+    prev = 0
+    for value in values:
+        if value is None:
+            w.write(0, 1)
+            continue
+        n = round(value * scale)
+        w.write(1, 1)
+        _write_small(w, n - prev)
+        prev = n
+    return w.getvalue()
+
+
+def _decode_decimal_values(buf, count: int, d: int) -> list[Optional[float]]:
+    r = BitReader(buf)
+    scale = 10 ** d
+    values: list[Optional[float]] = []
+    n = 0
+    for _ in range(count):
+        if not r.read(1):
+            values.append(None)
+            continue
+        n += _read_small(r)
+        values.append(n / scale)
+    return values
+
+
+def _encode_values(values: list[Optional[float]]) -> bytes:
+    # per row: '0' no value, or '1' followed by
+    #   '0'                                   same value as the previous one
+    #   '10' meaningful bits                  XOR fits in the leading/trailing zeros window of the previous XOR
+    #   '11' 6 bits leading, 6 bits length-1, meaningful bits
+    w = BitWriter()
+    prev = 0
+    leading, trailing = -1, 0
+    for value in values:
+        if value is None:
+            w.write(0, 1)
+            continue
+        bits = _float_bits(value)
+        xor = bits ^ prev
+        prev = bits
+        if xor == 0:
+            w.write(0b10, 2)
+            continue
+        lead = 64 - xor.bit_length()
+        trail = (xor & -xor).bit_length() - 1
+        if leading >= 0 and lead >= leading and trail >= trailing:
+            w.write(0b110, 3)
+            w.write(xor >> trailing, 64 - leading - trailing)
+        else:
+            leading, trailing = min(lead, 63), trail
+            length = 64 - leading - trailing
+            w.write(0b111, 3)
+            w.write(leading, 6)
+            w.write(length - 1, 6)
+            w.write(xor >> trailing, length)
+    return w.getvalue()
+
+
+def _decode_values(buf, count: int) -> list[Optional[float]]:
+    r = BitReader(buf)
+    values: list[Optional[float]] = []
+    prev = 0
+    value = 0.
+    leading, trailing = 0, 0
+    for _ in range(count):
+        if not r.read(1):
+            values.append(None)
+            continue
+        if r.read(1):
+            if r.read(1):
+                leading = r.read(6)
+                trailing = 64 - leading - r.read(6) - 1
+            prev ^= r.read(64 - leading - trailing) << trailing
+            value = _bits_float(prev)
+        values.append(value)
+    return values
+
+
+def _encode_enums(enums: list[Optional[str]]) -> tuple[bytes, bytes]:
+    dictionary: list[Optional[str]] = [None]
+    index = {None: 0}
+    for e in enums:
+        if e not in index:
+            index[e] = len(dictionary)
+            dictionary.append(e)
+    if len(dictionary) == 1:
+        return b'', b''
+    w = BitWriter()
+    bits = (len(dictionary) - 1).bit_length()
+    prev = 0
+    for e in enums:
+        i = index[e]
+        if i == prev:
+            w.write(0, 1)
+        else:
+            w.write(1, 1)
+            w.write(i, bits)
+            prev = i
+    return orjson.dumps(dictionary[1:]), w.getvalue()
+
+
+def _decode_enums(dictionary_buf, buf, count: int) -> list[Optional[str]]:
+    if not dictionary_buf:
+        return [None] * count
+    dictionary = [None] + orjson.loads(dictionary_buf)
+    bits = (len(dictionary) - 1).bit_length()
+    r = BitReader(buf)
+    enums: list[Optional[str]] = []
+    e = None
+    for _ in range(count):
+        if r.read(1):
+            e = dictionary[r.read(bits)]
+        enums.append(e)
+    return enums
+
+
+def encode_block(start: int, end: int, emits: list[ObservableEmit]) -> bytes:
+    # start and end in milliseconds, emits ordered by stamp
+    stamps = _encode_stamps([int(round(e.stamp * 1000)) for e in emits])
+    d = _decimals([e.value for e in emits])
+    values = _encode_decimal_values([e.value for e in emits], d) if d >= 0 else _encode_values([e.value for e in emits])
+    dictionary, enums = _encode_enums([e.enumValue for e in emits])
+    notes = orjson.dumps([[i, e.note] for i, e in enumerate(emits) if e.note]) if any(e.note for e in emits) else b''
+    return _header.pack(_magic, start, end, len(emits), len(stamps), len(values), len(dictionary), len(enums),
+                        len(notes), d) + stamps + values + dictionary + enums + notes
+
+
+@dataclass
+class Block:
+    start: int  # milliseconds, inclusive
+    end: int  # milliseconds, exclusive
+    count: int
+    offset: int  # of the header in the file
+    size: int  # including the header
+
+
+def decode_block(observable_id: str, buf, block: Block, start: int, end: int) -> list[ObservableEmit]:
+    # emits of the block with start <= stamp <= end (milliseconds)
+    (_, _, _, count, n_stamps, n_values, n_dictionary, n_enums, n_notes, d) = _header.unpack_from(buf, block.offset)
+    pos = block.offset + _header.size
+    stamps = _decode_stamps(buf[pos:pos + n_stamps], count)
+    pos += n_stamps
+    values_buf = buf[pos:pos + n_values]
+    values = _decode_decimal_values(values_buf, count, d) if d >= 0 else _decode_values(values_buf, count)
+    pos += n_values
+    enums = _decode_enums(buf[pos:pos + n_dictionary], buf[pos + n_dictionary:pos + n_dictionary + n_enums], count)
+    pos += n_dictionary + n_enums
+    notes = dict(orjson.loads(buf[pos:pos + n_notes])) if n_notes else {}
+    return [ObservableEmit(observable_id=observable_id, stamp=stamps[i] / 1000, value=values[i], enumValue=enums[i],
+                           note=notes.get(i))
+            for i in range(count) if start <= stamps[i] <= end]
+
+
+class Archive:
+    # Blocking file io, so use it through asyncio.to_thread.
+
+    def __init__(self, dir: str) -> None:
+        self.dir = dir
+        self._blocks: dict[str, list[Block]] = {}
+        os.makedirs(dir, exist_ok=True)
+
+    def file(self, observable_id: str) -> str:
+        return os.path.join(self.dir, urllib.parse.quote(observable_id, safe='') + ".aqa")
+
+    def blocks(self, observable_id: str) -> list[Block]:
+        if observable_id not in self._blocks:
+            self._blocks[observable_id] = self._read_blocks(observable_id)
+        return self._blocks[observable_id]
+
+    def _read_blocks(self, observable_id: str) -> list[Block]:
+        blocks: list[Block] = []
+        try:
+            with open(self.file(observable_id), "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                offset = 0
+                while offset + _header.size <= size:
+                    f.seek(offset)
+                    (magic, start, end, count, *lengths, _) = _header.unpack(f.read(_header.size))
+                    block_size = _header.size + sum(lengths)
+                    if magic != _magic or offset + block_size > size:
+                        log.error(f"Ignoring broken archive block at {offset} in {self.file(observable_id)}")
+                        break
+                    blocks.append(Block(start, end, count, offset, block_size))
+                    offset += block_size
+        except FileNotFoundError:
+            pass
+        return blocks
+
+    def append(self, observable_id: str, start: int, end: int, emits: list[ObservableEmit]) -> None:
+        blocks = self.blocks(observable_id)
+        if any(b.start == start for b in blocks):
+            # don't archive emits twice, e.g. after a crash between archiving and deleting them from the emit store
+            archived = {int(round(e.stamp * 1000)) for e in self.read(observable_id, start, start, end)}
+            emits = [e for e in emits if int(round(e.stamp * 1000)) not in archived]
+        if not emits:
+            return
+        data = encode_block(start, end, emits)
+        with open(self.file(observable_id), "ab") as f:
+            offset = f.tell()
+            if blocks and offset != blocks[-1].offset + blocks[-1].size:
+                # a broken block at the end, e.g. after a crash while appending
+                f.truncate(blocks[-1].offset + blocks[-1].size)
+                offset = f.seek(0, os.SEEK_END)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        blocks.append(Block(start, end, len(emits), offset, len(data)))
+
+    def expire(self, before: int) -> None:
+        # removes the blocks that ended before before (milliseconds), by rewriting the files that have any
+        for entry in os.scandir(self.dir):
+            if not entry.name.endswith(".aqa"):
+                continue
+            observable_id = urllib.parse.unquote(entry.name[:-4])
+            blocks = self.blocks(observable_id)
+            keep = [b for b in blocks if b.end > before]
+            if len(keep) == len(blocks):
+                continue
+            if keep:
+                with open(entry.path, "rb") as f, open(entry.path + ".tmp", "wb") as tmp:
+                    for b in keep:
+                        f.seek(b.offset)
+                        tmp.write(f.read(b.size))
+                    tmp.flush()
+                    os.fsync(tmp.fileno())
+                os.replace(entry.path + ".tmp", entry.path)
+            else:
+                os.remove(entry.path)
+            self._blocks.pop(observable_id, None)
+            log.info(f"Expired {len(blocks) - len(keep)} archive blocks of {observable_id}")
+
+    def starts(self, observable_id: str, start: int, end: int) -> list[int]:
+        # starts of the blocks with emits in [start, end], in order
+        return sorted({b.start for b in self.blocks(observable_id) if b.start <= end and b.end > start})
+
+    def read(self, observable_id: str, block_start: int, start: int, end: int) -> list[ObservableEmit]:
+        # emits with start <= stamp <= end from the blocks starting at block_start, ordered by stamp
+        blocks = [b for b in self.blocks(observable_id) if b.start == block_start]
+        if not blocks:
+            return []
+        with open(self.file(observable_id), "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                emits = [e for b in blocks for e in decode_block(observable_id, buf, b, start, end)]
+        if len(blocks) > 1:
+            emits.sort(key=lambda e: e.stamp)
+        return emits
@@ -1,7 +1,8 @@
 import logging
-from typing import Optional
+from typing import Optional, AsyncIterator
 
 from ..div.emit import ObservableEmit
+from ..div.rollup import Rollup
 from ..model import thing as aqt
 
 
@@ -10,6 +11,9 @@ log = logging.getLogger(__name__)
 
 class EmitDriver:
     id: str
+    can_rollup: bool = False
+    can_read: bool = False
+    can_expire: bool = False
 
     def __init__(self, m_driver: aqt.EmitDriver) -> None:
         self.m_driver = m_driver
@@ -35,6 +39,27 @@ class EmitDriver:
     async def stop(self) -> None:
         pass
 
+    async def flush(self) -> None:
+        pass
+
     async def emit(self, emits: list[ObservableEmit]) -> None:
         log.error("emit() not implemented")
         raise Exception("emit() not implemented")
+
+    async def emit_rollups(self, rollups: list[Rollup]) -> None:
+        log.error("emit_rollups() not implemented")
+        raise Exception("emit_rollups() not implemented")
+
+    def history(self, observable_id: str, start: float, end: float) -> AsyncIterator[ObservableEmit]:
+        # emits of observable_id with start <= stamp <= end, ordered by stamp
+        log.error("history() not implemented")
+        raise Exception("history() not implemented")
+
+    async def expire(self, before: float) -> None:
+        # removes emits with stamp < before, or at least the emits of the partitions that ended before before
+        log.error("expire() not implemented")
+        raise Exception("expire() not implemented")
+
+    async def expire_rollups(self, resolution: int, before: float) -> None:
+        log.error("expire_rollups() not implemented")
+        raise Exception("expire_rollups() not implemented")
@@ -1,22 +1,34 @@
+import asyncio
 import logging
 import os
 import tempfile
 import time as t
-from typing import Optional
+from typing import Optional, AsyncIterator, Callable, Awaitable
 
+import pymysql
 from pymysql import TimestampFromTicks
 
 from .emitdriver import EmitDriver
 from ..div.emit import ObservableEmit
+from ..div.rollup import Rollup
 from ..model import thing as aqt
 
 import aiomysql
 
 log = logging.getLogger(__name__)
 
+_transient_errors = (pymysql.err.OperationalError, pymysql.err.InterfaceError, ConnectionError, asyncio.TimeoutError)
+
+
+def _multi_row_insert(insert: str, columns: int, rows: int, on_duplicate: str = "") -> str:
+    row = "(" + ", ".join(["%s"] * columns) + ")"
+    return insert + " VALUES " + ", ".join([row] * rows) + on_duplicate
+
 
 class MariadbEmitDriver(EmitDriver):
     id = "MariadbEmitDriver"
+    can_rollup = True
+    can_read = True
 
     def __init__(self, m_driver: aqt.EmitDriver) -> None:
         super().__init__(m_driver)
@@ -25,7 +37,10 @@ class MariadbEmitDriver(EmitDriver):
         self.user: Optional[str] = 'root'
         self.password: Optional[str] = None
         self.db: Optional[str] = 'smoothieaq'
-        self.connection: Optional[aiomysql.Connection] = None
+        self.pool_size: int = 4
+        self.chunk_size: int = 500  # rows per INSERT statement
+        self.retries: int = 5
+        self.pool: Optional[aiomysql.Pool] = None
 
     def _init(self):
         super()._init()
@@ -34,18 +49,71 @@ class MariadbEmitDriver(EmitDriver):
         self.user = self.params.get('user', self.user)
         self.db = self.params.get('db', self.db)
         self.password = self.params.get('password')
+        self.pool_size = int(self.params.get('pool_size', self.pool_size))
+        self.chunk_size = int(self.params.get('chunk_size', self.chunk_size))
+        self.retries = int(self.params.get('retries', self.retries))
+
+    async def _with_retry[T](self, what: str, do: Callable[[aiomysql.Connection], Awaitable[T]]) -> T:
+        # transient errors (lost connection, server restarting, ...) are retried on a fresh pooled connection
+        backoff = 0.5
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.pool.acquire() as connection:
+                    return await do(connection)
+            except _transient_errors as e:
+                if attempt == self.retries:
+                    raise
+                log.warning(f"{what} failed ({e}), retrying in {backoff} seconds")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30.)
+
+    async def _execute(self, what: str, sql: str, args: Optional[list] = None) -> None:
+        async def do(connection: aiomysql.Connection) -> None:
+            async with connection.cursor() as cur:
+                await cur.execute(sql, args)
+            await connection.commit()
+        await self._with_retry(what, do)
+
+    async def _insert(self, what: str, insert: str, columns: int, rows: list[tuple], on_duplicate: str = "") -> None:
+        # multi-row INSERTs of chunk_size rows, all in one transaction, so a batch that is retried (here or by the
+        # outbox) was not partly stored. Batches of several emit devices run concurrently on the pooled connections.
+        chunks = [rows[i:i + self.chunk_size] for i in range(0, len(rows), self.chunk_size)]
+
+        async def do(connection: aiomysql.Connection) -> None:
+            try:
+                async with connection.cursor() as cur:
+                    for chunk in chunks:
+                        await cur.execute(_multi_row_insert(insert, columns, len(chunk), on_duplicate),
+                                          [v for row in chunk for v in row])
+                await connection.commit()
+            except Exception:
+                try:
+                    await connection.rollback()
+                except Exception:
+                    pass
+                raise
+        await self._with_retry(what, do)
+
+    async def _table_exists(self, table: str) -> bool:
+        async def do(connection: aiomysql.Connection) -> bool:
+            async with connection.cursor() as cur:
+                await cur.execute("SELECT count(*) FROM information_schema.tables WHERE table_name = %s", (table,))
+                rows = await cur.fetchall()
+                return rows[0][0] >= 1
+        return await self._with_retry("Checking table", do)
 
     async def create_if_needed(self):
-        cur = None
+        await self.create_emits_if_needed()
+        await self.create_rollups_if_needed()
+
+    async def create_emits_if_needed(self):
         try:
-            cur = await self.connection.cursor()
-            await cur.execute("SELECT count(*) FROM information_schema.tables WHERE table_name = 'smoothieaq_emits'")
-            rows = await cur.fetchall()
-            if rows[0][0] >= 1:
+            if await self._table_exists('smoothieaq_emits'):
                 log.info("Found existing smoothieaq_emits table")
                 return
             log.info("Creating new smoothieaq_emits table")
-            await cur.execute(
+            await self._execute(
+                "Creating table",
                 "CREATE TABLE smoothieaq_emits ("
                 "  observable_id varchar(10),"
                 "  stamp timestamp,"
@@ -53,28 +121,77 @@ class MariadbEmitDriver(EmitDriver):
                 "  enumValue varchar(254),"
                 "  note varchar(2000)"
                 ")")
-            await self.connection.commit()
         except Exception as e:
             log.error("Trying to create table", exc_info=e)
-        if cur: await cur.close()
+
+    async def create_rollups_if_needed(self):
+        try:
+            if await self._table_exists('smoothieaq_rollups'):
+                log.info("Found existing smoothieaq_rollups table")
+                return
+            log.info("Creating new smoothieaq_rollups table")
+            await self._execute(
+                "Creating table",
+                "CREATE TABLE smoothieaq_rollups ("
+                "  observable_id varchar(10),"
+                "  resolution INT,"
+                "  bucket timestamp,"
+                "  min FLOAT,"
+                "  max FLOAT,"
+                "  sum DOUBLE,"
+                "  count INT,"
+                "  last FLOAT,"
+                "  last_stamp timestamp(3),"
+                "  PRIMARY KEY (observable_id, resolution, bucket)"
+                ")")
+        except Exception as e:
+            log.error("Trying to create table", exc_info=e)
 
     async def start(self):
         await super().start()
-        log.info(f"Sqlite database {self.host}  {self.port}")
-        self.connection = await aiomysql.connect(host=self.host, port=int(self.port), user=self.user, password=self.password, db=self.db)
+        log.info(f"Mariadb database {self.host}  {self.port}")
+        self.pool = await aiomysql.create_pool(host=self.host, port=int(self.port), user=self.user,
+                                               password=self.password, db=self.db, minsize=1, maxsize=self.pool_size,
+                                               pool_recycle=3600)
         await self.create_if_needed()
 
     async def stop(self) -> None:
-        await self.connection.close()
+        self.pool.close()
+        await self.pool.wait_closed()
         await super().stop()
 
     async def emit(self, emits: list[ObservableEmit]) -> None:
-        cur = None
-        try:
-            cur = await self.connection.cursor()
-            emit_values = [(e.observable_id, TimestampFromTicks(e.stamp), e.value, e.enumValue, e.note) for e in emits]
-            await cur.executemany("INSERT INTO smoothieaq_emits (observable_id, stamp, value, enumValue, note) VALUES (%s, %s, %s, %s, %s)", emit_values)
-            await self.connection.commit()
-        except Exception as e:
-            log.error("Trying to insert", exc_info=e)
-        if cur: await cur.close()
+        await self._insert(
+            "Inserting emits",
+            "INSERT INTO smoothieaq_emits (observable_id, stamp, value, enumValue, note)", 5,
+            [(e.observable_id, TimestampFromTicks(e.stamp), e.value, e.enumValue, e.note) for e in emits]
+        )
+
+    async def emit_rollups(self, rollups: list[Rollup]) -> None:
+        # assignments are evaluated left to right, so last must be set before last_stamp
+        await self._insert(
+            "Inserting rollups",
+            "INSERT INTO smoothieaq_rollups (observable_id, resolution, bucket, min, max, sum, count, last, last_stamp)",
+            9,
+            [(r.observable_id, r.resolution, TimestampFromTicks(r.bucket), r.min, r.max, r.sum, r.count, r.last,
+              TimestampFromTicks(r.last_stamp)) for r in rollups],
+            "  ON DUPLICATE KEY UPDATE"
+            "    min = LEAST(min, VALUES(min)),"
+            "    max = GREATEST(max, VALUES(max)),"
+            "    sum = sum + VALUES(sum),"
+            "    count = count + VALUES(count),"
+            "    last = IF(VALUES(last_stamp) >= last_stamp, VALUES(last), last),"
+            "    last_stamp = GREATEST(last_stamp, VALUES(last_stamp))"
+        )
+
+    async def history(self, observable_id: str, start: float, end: float) -> AsyncIterator[ObservableEmit]:
+        async with self.pool.acquire() as connection:
+            async with connection.cursor(aiomysql.SSCursor) as cur:
+                await cur.execute(
+                    "SELECT UNIX_TIMESTAMP(stamp), value, enumValue, note FROM smoothieaq_emits"
+                    "  WHERE observable_id = %s AND stamp BETWEEN %s AND %s ORDER BY stamp",
+                    (observable_id, TimestampFromTicks(start), TimestampFromTicks(end)))
+                while rows := await cur.fetchmany(500):
+                    for row in rows:
+                        yield ObservableEmit(observable_id=observable_id, stamp=float(row[0]), value=row[1],
+                                             enumValue=row[2], note=row[3])
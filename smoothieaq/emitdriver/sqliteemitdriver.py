@@ -1,39 +1,268 @@
+import asyncio
+import datetime as dt
 import logging
 import os
+import re
+import sys
 import tempfile
-import time as t
-from typing import Optional
+from typing import Optional, AsyncIterator
 
+from .archive import Archive
 from .emitdriver import EmitDriver
+from ..div import time
 from ..div.emit import ObservableEmit
+from ..div.rollup import Rollup, bucket_of, resolutions
 from ..model import thing as aqt
 
+import aioreactive as rx
 import aiosqlite
 
 log = logging.getLogger(__name__)
 
+_heap_table = "smoothieaq_emits"
+_ts_table = "smoothieaq_emits_ts"  # partitions are named smoothieaq_emits_ts_<first day yyyymmdd>_<days>d
+_rollup_table = "smoothieaq_rollups"
+_day = resolutions['day'] * 1000
+_monday = 4 * _day  # the first monday after the epoch, so week partitions start on mondays
+_partition_name = re.compile(_ts_table + r"_(\d{8})_(\d+)d")
+
+
+def stamp_to_db(stamp: float) -> int:
+    return int(stamp * 1000)
+
+
+def stamp_from_db(stamp: int) -> float:
+    return stamp / 1000
+
+
+def _partition_table(start: int, days: int) -> str:
+    return f"{_ts_table}_{dt.datetime.fromtimestamp(start / 1000, dt.UTC):%Y%m%d}_{days}d"
+
+
+class _SqliteWriter:
+    # One long-lived writer per db file, shared by all SqliteEmitDrivers (i.e. all EmitDevices) on that file. Batches
+    # are queued and everything queued is written in one transaction.
+    #
+    # The partitions, the rollups and the archive are shared by the drivers on the file as well, so they are expired
+    # and archived here, once for the file: emits and rollups are kept for the longest retention of the drivers, and
+    # nothing is expired while a driver has no retention.
+
+    def __init__(self, db_file: str) -> None:
+        self.db_file = db_file
+        self.drivers: list['SqliteEmitDriver'] = []
+        self.connection: Optional[aiosqlite.Connection] = None
+        self.partitions: dict[int, tuple[int, str]] = {}  # start -> end and table, in milliseconds
+        self.migrated: bool = False
+        self.archive: Optional[Archive] = None
+        self.archive_after: int = 0  # days
+        self._archiving: Optional[rx.AsyncDisposable] = None
+        self._maintaining = asyncio.Lock()  # archiving and expiring
+        self._queue: asyncio.Queue[tuple[str, list[tuple], asyncio.Future[None]]] = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    async def open(self, driver: 'SqliteEmitDriver') -> None:
+        self.drivers.append(driver)
+        if self.connection:
+            return
+        log.info(f"Opening Sqlite emit writer on {self.db_file}")
+        self.connection = await aiosqlite.connect(self.db_file)
+        await self.connection.execute("PRAGMA journal_mode=WAL")
+        await self.connection.execute("PRAGMA synchronous=NORMAL")
+        async with self.connection.execute(
+                f"SELECT name FROM sqlite_schema WHERE type = 'table' AND name LIKE '{_ts_table}_%'") as cursor:
+            async for (name,) in cursor:
+                if match := _partition_name.fullmatch(name):
+                    start = stamp_to_db(dt.datetime.strptime(match[1], '%Y%m%d').replace(tzinfo=dt.UTC).timestamp())
+                    self.partitions[start] = (start + int(match[2]) * _day, name)
+        self._task = asyncio.create_task(self._write_loop())
+
+    async def close(self, driver: 'SqliteEmitDriver') -> None:
+        self.drivers.remove(driver)
+        if self.drivers:
+            return
+        if self._archiving:
+            await self._archiving.dispose_async()
+            self._archiving = None
+        async with self._maintaining:
+            self.archive = None
+        await self.flush()
+        self._task.cancel()
+        await self.connection.close()
+        self.connection = None
+        _writers.pop(self.db_file, None)
+
+    def put(self, sql: str, rows: list[tuple]) -> asyncio.Future[None]:
+        done = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((sql, rows, done))
+        return done
+
+    async def flush(self) -> None:
+        await self._queue.join()
+
+    def partitions_between(self, start: int, end: int) -> list[tuple[int, int, str]]:
+        # start, end and table of the partitions with stamps in [start, end], in order
+        return sorted((s, e, table) for s, (e, table) in self.partitions.items() if s <= end and e > start)
+
+    async def drop_partition(self, start: int) -> None:
+        partition = self.partitions.pop(start, None)
+        if not partition:
+            return
+        log.info(f"Dropping {partition[1]} table")
+        await self.put(f"DROP TABLE IF EXISTS {partition[1]}", [()])
+
+    async def start_archiving(self, archive_dir: str, archive_after: int) -> None:
+        self.archive_after = max(self.archive_after, archive_after)
+        if self.archive:
+            if archive_dir != self.archive.dir:
+                log.warning(f"Archiving {self.db_file} to {self.archive.dir}, not to {archive_dir}")
+            return
+        log.info(f"Archiving partitions of {self.db_file} older than {self.archive_after} days to {archive_dir}")
+        self.archive = Archive(archive_dir)
+
+        async def _archive(n):
+            await self.archive_closed()
+        self._archiving = await rx.interval(60, 3600).subscribe_async(_archive)
+
+    async def archive_closed(self) -> None:
+        # moves the partitions that ended more than archive_after days ago to the archive, and drops them
+        async with self._maintaining:
+            if not self.archive:
+                return
+            until = stamp_to_db(bucket_of(time.time(), resolutions['day'])) - self.archive_after * _day
+            try:
+                archived = 0
+                async with aiosqlite.connect(self.db_file) as reader:
+                    for start, end, table in self.partitions_between(0, until):
+                        if end > until:
+                            break
+                        emits: dict[str, list[ObservableEmit]] = {}
+                        async with reader.execute(
+                            f"SELECT observable_id, stamp, value, enumValue, note FROM {table}"
+                            "  ORDER BY observable_id, stamp"
+                        ) as cursor:
+                            async for row in cursor:
+                                emits.setdefault(row[0], []).append(ObservableEmit(
+                                    observable_id=sys.intern(row[0]), stamp=stamp_from_db(row[1]), value=row[2],
+                                    enumValue=row[3], note=row[4]))
+                        for id, id_emits in emits.items():
+                            await asyncio.to_thread(self.archive.append, id, start, end, id_emits)
+                            archived += len(id_emits)
+                        await self.drop_partition(start)
+                if archived:
+                    log.info(f"Archived {archived} emits to {self.archive.dir}")
+            except Exception as e:
+                log.error(f"Trying to archive emits to {self.archive.dir}", exc_info=e)
+
+    async def expire(self) -> None:
+        # drops the partitions, and the archived emits, older than the longest retention of the drivers
+        befores = [d.expire_before for d in self.drivers if d.layout != 'heap']
+        if not befores or None in befores:
+            return
+        until = min(befores)
+        async with self._maintaining:
+            for start, end, _ in self.partitions_between(0, until):
+                if end <= until:
+                    await self.drop_partition(start)
+            if self.archive:
+                await asyncio.to_thread(self.archive.expire, until)
+
+    async def expire_rollups(self, resolution: int) -> None:
+        befores = [d.rollups_expire_before.get(resolution) for d in self.drivers]
+        if not befores or None in befores:
+            return
+        await self.put(f"DELETE FROM {_rollup_table} WHERE resolution = ? AND bucket < ?", [(resolution, min(befores))])
+
+    async def _write_loop(self) -> None:
+        while True:
+            batches = [await self._queue.get()]
+            while not self._queue.empty():
+                batches.append(self._queue.get_nowait())
+            try:
+                for sql, rows, _ in batches:
+                    await self.connection.executemany(sql, rows)
+                await self.connection.commit()
+                for _, _, done in batches:
+                    if not done.done():  # e.g. cancelled by Outbox.stop()
+                        done.set_result(None)
+            except Exception as e:
+                log.error(f"Trying to insert {sum(len(b[1]) for b in batches)} rows into {self.db_file}", exc_info=e)
+                try:
+                    await self.connection.rollback()
+                except Exception:
+                    pass
+                for _, _, done in batches:
+                    if not done.done():
+                        done.set_exception(e)
+            for _ in batches:
+                self._queue.task_done()
+
+
+_writers: dict[str, _SqliteWriter] = {}
+
+
+def _get_writer(db_file: str) -> _SqliteWriter:
+    if not _writers.__contains__(db_file):
+        _writers[db_file] = _SqliteWriter(db_file)
+    return _writers[db_file]
+
 
 class SqliteEmitDriver(EmitDriver):
     id = "SqliteEmitDriver"
+    can_rollup = True
+    can_read = True
+    can_expire = True
 
     def __init__(self, m_driver: aqt.EmitDriver) -> None:
         super().__init__(m_driver)
         self.db_file: str = os.path.join(tempfile.gettempdir(),"smoothieaq-emits.db")
-        self.connection: Optional[aiosqlite.Connection] = None
+        self.layout: str = 'indexed'  # 'indexed' or 'heap' (the old unindexed table)
+        self.partition_days: int = 7  # emits are partitioned into a table per partition_days days
+        self.archive_dir: Optional[str] = None  # closed partitions are moved to a compressed archive, if set
+        self.archive_after: int = 7  # days
+        self.writer: Optional[_SqliteWriter] = None
+        self.reader: Optional[aiosqlite.Connection] = None
+        self.expire_before: Optional[int] = None  # set by expire(), the writer expires for all drivers on the file
+        self.rollups_expire_before: dict[int, int] = {}  # by resolution
 
     def _init(self):
         super()._init()
         self.db_file = self.params.get('db_file', self.db_file)
+        self.layout = self.params.get('layout', self.layout)
+        self.partition_days = int(self.params.get('partition_days', self.partition_days))
+        self.archive_dir = self.params.get('archive_dir', self.archive_dir)
+        self.archive_after = int(self.params.get('archive_after', self.archive_after))
+
+    @property
+    def connection(self) -> Optional[aiosqlite.Connection]:
+        return self.writer.connection if self.writer else None
 
     async def create_if_needed(self):
-        async with self.connection.execute("SELECT count(*) FROM sqlite_schema WHERE tbl_name = 'smoothieaq_emits'") as cursor:
+        await self.connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {_rollup_table} ("
+            "  observable_id TEXT NOT NULL,"
+            "  resolution INTEGER NOT NULL,"  # seconds
+            "  bucket INTEGER NOT NULL,"  # milliseconds since epoch
+            "  min REAL,"
+            "  max REAL,"
+            "  sum REAL,"
+            "  count INTEGER,"
+            "  last REAL,"
+            "  last_stamp INTEGER,"
+            "  PRIMARY KEY (observable_id, resolution, bucket)"
+            ") WITHOUT ROWID")
+        await self.connection.commit()
+        if self.layout == 'heap':
+            await self.create_heap_if_needed()
+
+    async def create_heap_if_needed(self):
+        async with self.connection.execute(f"SELECT count(*) FROM sqlite_schema WHERE tbl_name = '{_heap_table}'") as cursor:
             async for row in cursor:
                 if row[0] >= 1:
-                    log.info("Found existing smoothieaq_emits table")
+                    log.info(f"Found existing {_heap_table} table")
                     return
-        log.info("Creating new smoothieaq_emits table")
+        log.info(f"Creating new {_heap_table} table")
         await self.connection.execute(
-            "CREATE TABLE smoothieaq_emits ("
+            f"CREATE TABLE {_heap_table} ("
             "  observable_id TEXT,"
             "  stamp timestamp,"
             "  value FLOAT,"
@@ -42,17 +271,153 @@ class SqliteEmitDriver(EmitDriver):
             ")")
         await self.connection.commit()
 
+    async def migrate_if_needed(self) -> None:
+        # copies the emits of the tables of earlier layouts into partitions, once: the single table of the indexed
+        # layout from before partitioning, and the heap table, unless a driver on the db file still uses it
+        await self._migrate(_ts_table, 1)
+        if not any(d.layout == 'heap' for d in self.writer.drivers):
+            await self._migrate(_heap_table, 1000)
+
+    async def _migrate(self, from_table: str, to_db: int) -> None:
+        # to_db scales the stamps of from_table to milliseconds, the heap table has float seconds
+        async with self.connection.execute(
+                f"SELECT count(*) FROM sqlite_schema WHERE type = 'table' AND name = '{from_table}'") as cursor:
+            if (await cursor.fetchone())[0] == 0:
+                return
+        log.info(f"Moving emits from the {from_table} table to partitions")
+        await self.writer.put(f"CREATE INDEX IF NOT EXISTS {from_table}_stamp ON {from_table} (stamp)", [()])
+        stamp_sql = f"SELECT min(stamp) FROM {from_table} WHERE stamp >= ?"
+        async with self.connection.execute(stamp_sql, (-2 ** 63,)) as cursor:
+            (stamp,) = await cursor.fetchone()
+        while stamp is not None:
+            table = self.partition(int(stamp * to_db))
+            (start, (end, _)) = next((s, p) for s, p in self.writer.partitions.items() if p[1] == table)
+            await self.writer.put(
+                f"INSERT OR REPLACE INTO {table}"
+                f"  SELECT observable_id, CAST(stamp * {to_db} AS INTEGER), value, enumValue, note FROM {from_table}"
+                "  WHERE observable_id IS NOT NULL AND stamp >= ? AND stamp < ?", [(start / to_db, end / to_db)])
+            async with self.connection.execute(stamp_sql, (end / to_db,)) as cursor:
+                (stamp,) = await cursor.fetchone()
+        await self.writer.put(f"DROP TABLE IF EXISTS {from_table}", [()])
+
+    def partition(self, stamp: int) -> str:
+        # the table of the partition for stamp, created with the next write if it is new
+        for start, (end, table) in self.writer.partitions.items():
+            if start <= stamp < end:
+                return table
+        width = self.partition_days * _day
+        start = (stamp - _monday) // width * width + _monday
+        end = start + width
+        for other_start, (other_end, _) in self.writer.partitions.items():
+            # partitions made with another partition_days
+            if start < other_start < end:
+                end = other_start
+            if start < other_end <= stamp:
+                start = other_end
+        table = _partition_table(start, (end - start) // _day)
+        log.info(f"Creating new {table} table")
+
+        def _created(f: asyncio.Future[None]) -> None:
+            if f.exception():
+                self.writer.partitions.pop(start, None)
+        self.writer.put(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "  observable_id TEXT NOT NULL,"
+            "  stamp INTEGER NOT NULL,"  # milliseconds since epoch
+            "  value REAL,"
+            "  enumValue TEXT,"
+            "  note TEXT,"
+            "  PRIMARY KEY (observable_id, stamp)"
+            ") WITHOUT ROWID", [()]).add_done_callback(_created)
+        self.writer.partitions[start] = (end, table)
+        return table
+
     async def start(self):
         await super().start()
-        log.info(f"Sqlite database {self.db_file}")
-        self.connection = await aiosqlite.connect(self.db_file)
+        log.info(f"Sqlite database {self.db_file} ({self.layout})")
+        self.writer = _get_writer(self.db_file)
+        await self.writer.open(self)
         await self.create_if_needed()
+        if self.layout != 'heap' and not self.writer.migrated:
+            self.writer.migrated = True  # by the first driver started on the db file
+            await self.migrate_if_needed()
+        self.reader = await aiosqlite.connect(self.db_file)
+        if self.archive_dir and self.layout != 'heap':
+            await self.writer.start_archiving(self.archive_dir, self.archive_after)
 
     async def stop(self) -> None:
-        await self.connection.close()
+        await self.reader.close()
+        self.reader = None
+        await self.writer.close(self)
+        self.writer = None
         await super().stop()
 
+    async def flush(self) -> None:
+        await self.writer.flush()
+
     async def emit(self, emits: list[ObservableEmit]) -> None:
-        emit_values = [(e.observable_id, e.stamp, e.value, e.enumValue, e.note) for e in emits]
-        await self.connection.executemany("INSERT INTO smoothieaq_emits VALUES (?, ?, ?, ?, ?)", emit_values)
-        await self.connection.commit()
+        if self.layout == 'heap':
+            await self.writer.put(
+                f"INSERT INTO {_heap_table} VALUES (?, ?, ?, ?, ?)",
+                [(e.observable_id, e.stamp, e.value, e.enumValue, e.note) for e in emits]
+            )
+            return
+        rows: dict[str, list[tuple]] = {}
+        for e in emits:
+            stamp = stamp_to_db(e.stamp)
+            rows.setdefault(self.partition(stamp), []).append((e.observable_id, stamp, e.value, e.enumValue, e.note))
+        await asyncio.gather(*[
+            self.writer.put(f"INSERT OR REPLACE INTO {table} VALUES (?, ?, ?, ?, ?)", table_rows)
+            for table, table_rows in rows.items()
+        ])
+
+    async def emit_rollups(self, rollups: list[Rollup]) -> None:
+        await self.writer.put(
+            f"INSERT INTO {_rollup_table} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+            "  ON CONFLICT (observable_id, resolution, bucket) DO UPDATE SET"
+            "    min = min(min, excluded.min),"
+            "    max = max(max, excluded.max),"
+            "    sum = sum + excluded.sum,"
+            "    count = count + excluded.count,"
+            "    last = CASE WHEN excluded.last_stamp >= last_stamp THEN excluded.last ELSE last END,"
+            "    last_stamp = max(last_stamp, excluded.last_stamp)",
+            [(r.observable_id, r.resolution, stamp_to_db(r.bucket), r.min, r.max, r.sum, r.count, r.last,
+              stamp_to_db(r.last_stamp)) for r in rollups]
+        )
+
+    async def expire(self, before: float) -> None:
+        if self.layout == 'heap':
+            log.warning(f"Emits in the {_heap_table} table can't expire, use the indexed layout")
+            return
+        self.expire_before = stamp_to_db(before)
+        await self.writer.expire()
+
+    async def expire_rollups(self, resolution: int, before: float) -> None:
+        self.rollups_expire_before[resolution] = stamp_to_db(before)
+        await self.writer.expire_rollups(resolution)
+
+    async def history(self, observable_id: str, start: float, end: float) -> AsyncIterator[ObservableEmit]:
+        frm, to = stamp_to_db(start), stamp_to_db(end)
+        archive = self.writer.archive if self.layout != 'heap' else None
+        if archive:
+            # archived partitions are older than the partitions left in the db
+            for block_start in archive.starts(observable_id, frm, to):
+                for e in await asyncio.to_thread(archive.read, observable_id, block_start, frm, to):
+                    yield e
+        if self.layout == 'heap':
+            tables = [_heap_table]
+            frm, to, from_db = start, end, float
+        else:
+            tables = [table for _, _, table in self.writer.partitions_between(frm, to)]
+            from_db = stamp_from_db
+        for table in tables:
+            if self.layout != 'heap' and table not in (t for _, t in self.writer.partitions.values()):
+                continue  # dropped while reading the partitions before it
+            async with self.reader.execute(
+                f"SELECT stamp, value, enumValue, note FROM {table}"
+                "  WHERE observable_id = ? AND stamp BETWEEN ? AND ? ORDER BY stamp",
+                (observable_id, frm, to)
+            ) as cursor:
+                async for row in cursor:
+                    yield ObservableEmit(observable_id=observable_id, stamp=from_db(row[0]), value=row[1],
+                                         enumValue=row[2], note=row[3])
@@ -79,6 +79,7 @@ class ValueRequire:
     warningBelow: Optional[float] = None
     alarmAbove: Optional[float] = None
     alarmBelow: Optional[float] = None
+    hysteresis: Optional[float] = None  # how far back inside a limit a value must be to clear a warning or alarm
     warningConditions: Optional[list[Condition]] = None
     alarmConditions: Optional[list[Condition]] = None
 
@@ -223,6 +224,10 @@ class EmitDevice(Named, Described):
     exclude: Optional[list[EmitDeviceFilter]] = None
     bufferNo: Optional[int] = None
     bufferTime: Optional[float] = None
+    outboxNo: Optional[int] = None  # max emits queued in memory before spilling to disk
+    rollups: Optional[list[str]] = None  # rollup resolutions: minute/hour/day, default all if the driver can rollup
+    retentionDays: Optional[float] = None  # days emits are kept, default forever
+    rollupRetentionDays: Optional[dict[str, float]] = None  # days rollups are kept by resolution, default forever
 
 
 @dataclass
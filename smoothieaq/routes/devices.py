@@ -34,7 +34,7 @@ async def websocket_emits(websocket: WebSocket):
         ix.buffer_with_time(0.5, 5),
         rx.filter(lambda l: len(l) > 0),
     )
-    await streamutil.websocket_stream(websocket, rx_emits)
+    await streamutil.websocket_stream(websocket, rx_emits, "device")
 
 
 @router.get("/stream-test")
@@ -1,14 +1,16 @@
 import logging
-from typing import Any
+from fnmatch import fnmatchcase
+from typing import Any, Annotated, Optional, Literal
 
-import aioreactive as rx
-from fastapi import WebSocket, APIRouter
-from fastapi.responses import HTMLResponse
+from fastapi import WebSocket, APIRouter, HTTPException, Query, Header
+from fastapi.responses import HTMLResponse, StreamingResponse
 
-from ..device import devices
-from ..div.emit import emit_to_transport
+from ..device import devices, replay, journal
+from ..div import time
+from ..div.emit import ObservableEmit, stamp_from_transport
+from ..emitdevice import emitdevices
+from ..emitdevice.outbox import OutboxStatus
 from ..routes import streamutil
-from ..util import rxutil as ix
 
 log = logging.getLogger(__name__)
 
@@ -19,17 +21,155 @@ router = APIRouter(
 )
 
 
+class _Subscriptions:
+    # What a client of /emits/stream subscribes to: everything until it subscribes to something. A subscription may
+    # have observable id patterns, sites and places, and matches an emit if it matches all of those it has. The status
+    # of an observable or device matches as the observable or device.
+
+    def __init__(self) -> None:
+        self._subscriptions: Optional[dict[str, dict[str, set[str]]]] = None
+        self._matches: dict[str, bool] = {}
+
+    def on_message(self, message: dict[str, Any]) -> None:
+        # {"subscribe": name, "ids": [pattern, ...], "sites": [site, ...], "places": [place, ...]} or
+        # {"unsubscribe": name}, where patterns are like 1:* or *:A
+        if "subscribe" in message:
+            subscription = dict((k, set(message[k])) for k in ("ids", "sites", "places") if message.get(k) is not None)
+            if self._subscriptions is None:
+                self._subscriptions = {}
+            self._subscriptions[str(message["subscribe"])] = subscription
+        elif "unsubscribe" in message and self._subscriptions is not None:
+            self._subscriptions.pop(str(message["unsubscribe"]), None)
+        else:
+            raise ValueError(f"Unknown message {message}")
+        self._matches.clear()
+
+    def matches(self, emit: ObservableEmit) -> bool:
+        if self._subscriptions is None:
+            return True
+        match = self._matches.get(emit.observable_id)
+        if match is None:
+            match = self._matches[emit.observable_id] = self._match(emit.observable_id)
+        return match
+
+    def _match(self, id: str) -> bool:
+        id = id.removesuffix('?')
+        site, place = None, None
+        if id in devices.observables:
+            o = devices.observables[id]
+            site = o.m_observable.site or o.device.m_device.site
+            place = o.m_observable.place or o.device.m_device.place
+        elif id in devices.devices:
+            d = devices.devices[id]
+            site, place = d.m_device.site, d.m_device.place
+        return any(
+            ("ids" not in s or any(fnmatchcase(id, pattern) for pattern in s["ids"])) and
+            ("sites" not in s or site in s["sites"]) and
+            ("places" not in s or place in s["places"])
+            for s in self._subscriptions.values())
+
+
+def _emits_hub() -> streamutil.Hub:
+    return streamutil.hub("emits", "emits", lambda: journal.rx_journal)
+
+
 @router.websocket("/stream")
-async def websocket_emits(websocket: WebSocket):
-    rx_emits: rx.AsyncObservable[Any] = rx.pipe(
-        devices.rx_all_observables,
-        rx.map(emit_to_transport),
-        ix.buffer_with_time(1, 20),
-        rx.filter(lambda l: len(l) > 0),
-    )
-    await streamutil.websocket_stream(websocket, rx_emits)
+async def websocket_emits(
+        websocket: WebSocket,
+        queue: int = 1000,
+        overflow: Literal["conflate", "dropOldest"] = "conflate",
+        seq: bool = False,
+        since: Optional[int] = None
+):
+    """
+    Stream emits, in lists of at most 20 each second. Clients send subscribe and unsubscribe messages to get only
+    some emits. Each client has a queue of at most queue emits; on overflow the oldest is dropped, and conflating an
+    emit replaces an emit of the same observable still in the queue. Clients asking for the smoothieaq.binary.v1
+    subprotocol get binary frames of emits, see div/binarytransport.py.
+
+    With seq, lists are sent as {"seq": seq, "emits": [...]}, where seq is the sequence number of the last emit. A
+    client reconnecting with since=seq first gets the emits it missed, or {"seq": seq, "gap": true, "emits": []} if
+    they are no longer in the journal, and it should reload.
+    """
+
+    subscriptions = _Subscriptions()
+    await streamutil.websocket_emit_stream(
+        websocket, _emits_hub(), subscriptions.matches, subscriptions.on_message, queue, overflow == "conflate",
+        seq=seq, journal=(lambda: journal.since(since)) if since is not None else None)
+
+
+@router.get("/events")
+async def get_events(
+        since: Optional[int] = None,
+        last_event_id: Annotated[Optional[int], Header()] = None,
+        ids: Annotated[Optional[list[str]], Query()] = None,
+        queue: int = 1000,
+        overflow: Literal["conflate", "dropOldest"] = "conflate"
+) -> StreamingResponse:
+    """
+    Stream emits as server-sent events, like /stream with seq. The id of an event is the sequence number of its last
+    emit, so a reconnecting EventSource resumes with the Last-Event-ID header, or since. An event of type gap tells the
+    client that emits it missed are no longer in the journal, and it should reload.
+    :param ids: Only emits of observables with ids matching one of these, like 1:* or *:A
+    """
+
+    subscriptions = _Subscriptions()
+    if ids:
+        subscriptions.on_message({"subscribe": "ids", "ids": ids})
+    since = last_event_id if last_event_id is not None else since
+    return StreamingResponse(
+        streamutil.emit_events(_emits_hub(), subscriptions.matches, queue, overflow == "conflate",
+                               journal=(lambda: journal.since(since)) if since is not None else None),
+        media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 @router.get("/stream-test")
 async def get():
     return HTMLResponse(streamutil.stream_test_html("emits"))
+
+
+@router.get("/outboxes")
+async def get_outboxes() -> dict[str, OutboxStatus]:
+    """
+    Get the status of the outbox of each started emit device.
+    :return: Queue depth, spilled emits, lag in seconds and counters by emit device id
+    """
+
+    return dict((id, emit_device.outbox.status()) for (id, emit_device) in emitdevices.emit_devices.items()
+                if emit_device.outbox)
+
+
+@router.post("/replay")
+async def post_replay(
+        frm: Annotated[int, Query(alias="from")],
+        to: Optional[int] = None,
+        speed: float = 60 * 60 * 24 * 7 / 10,
+        ids: Annotated[Optional[list[str]], Query()] = None
+) -> replay.ReplayStatus:
+    """
+    Start replaying stored emits into the drivers on the simulated clock, to backtest expressions, require/alarm
+    conditions and schedules. Live emits are dropped and nothing is stored while replaying.
+
+    :param frm: Start stamp in transport format
+    :param to: End stamp in transport format, default now
+    :param speed: Simulated seconds per second, default a week in 10 seconds
+    :param ids: Observables to replay, default all observables with a driver
+    :return: The replay status
+    """
+
+    if replay.is_replaying():
+        raise HTTPException(409, "Already replaying")
+    if not emitdevices.get_history_emit_device():
+        raise HTTPException(404, "No emit device to replay from")
+    end = stamp_from_transport(to) if to is not None else time.time()
+    return await replay.start(stamp_from_transport(frm), end, speed, ids)
+
+
+@router.get("/replay")
+async def get_replay() -> replay.ReplayStatus:
+    return replay.status
+
+
+@router.delete("/replay")
+async def delete_replay() -> None:
+    await replay.stop()
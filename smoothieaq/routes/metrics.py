@@ -0,0 +1,40 @@
+from typing import Annotated, Literal
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+from ..div import metrics, profiler
+
+router = APIRouter(
+    tags=["metrics"]
+)
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics() -> PlainTextResponse:
+    """
+    Get counters of emits by observable and emit device, durations of emit drivers and websocket sends, and outbox
+    status, in the Prometheus text format.
+    """
+
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@router.get("/profile", response_class=PlainTextResponse)
+async def get_profile(
+        seconds: Annotated[float, Query(gt=0, le=300)] = 10,
+        interval_ms: Annotated[float, Query(ge=1, le=1000)] = 10,
+        format: Literal["collapsed", "top"] = "collapsed"
+) -> PlainTextResponse:
+    """
+    Profile the running event loop by sampling its stack for a number of seconds.
+    :param seconds: How long to profile
+    :param interval_ms: How often to sample
+    :param format: collapsed for stacks, rooted in the observable, device, driver or emit device running them, with
+    their count of samples, as for flame graphs; or top for samples by function, in itself and in total
+    """
+
+    if profiler.is_running():
+        raise HTTPException(409, "Already profiling")
+    profile = await profiler.profile(seconds, interval_ms / 1000)
+    return PlainTextResponse(profile.collapsed() if format == "collapsed" else profile.top())
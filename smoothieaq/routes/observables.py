@@ -1,12 +1,16 @@
-import orjson
-from fastapi import APIRouter, HTTPException, WebSocket
-from fastapi.responses import HTMLResponse
-import aioreactive as rx
+from fnmatch import fnmatchcase
+from typing import Annotated, Optional
 
-from ..device import devices as d
-from ..div.emit import emit_to_transport, RawEmit, emit_to_raw
+import aioreactive as rx
+from fastapi import APIRouter, HTTPException, WebSocket, Query
+from fastapi.responses import HTMLResponse, StreamingResponse, ORJSONResponse
+
+from ..device import devices as d, valuetable, recent
+from ..div import time
+from ..div.downsample import lttb, minmax
+from ..div.emit import emit_to_transport, RawEmit, emit_to_raw, stamp_from_transport
+from ..emitdevice import emitdevices as ed
 from ..model import thing as aqt
-from ..util import rxutil as ix
 from ..routes import streamutil
 
 router = APIRouter(
@@ -16,20 +20,41 @@ router = APIRouter(
 )
 
 
+@router.get("/values")
+async def get_values(
+        since: int = 0,
+        ids: Annotated[Optional[list[str]], Query()] = None
+) -> ORJSONResponse:
+    """
+    Get the current value and status of all observables, or those with ids matching one of ids, like 1:* or *:A, in one
+    response. Statuses have a ? after the id, and the status of devices is included as their id with a ?.
+    :param since: The version of an earlier response, to get only what changed after it
+    :return: The version, and a list of emits as in the streams, [id, stamp, value, enumValue, note]
+    """
+
+    match = (lambda id: any(fnmatchcase(id, pattern) for pattern in ids)) if ids else None
+    return ORJSONResponse({"version": valuetable.version(), "emits": list(valuetable.rows(since, match))})
+
+
+@router.get("/recent")
+async def get_recent_status() -> dict[str, int]:
+    """
+    Get the memory used for the latest emits of observables.
+    :return: Emits kept per observable, observables and bytes
+    """
+    return recent.status()
+
+
 @router.websocket("/{observable_id}/stream")
 async def websocket_emits(websocket: WebSocket, observable_id: str):
     try:
         rx_observable = d.get_rx_observable(observable_id)
         if rx_observable is None:
             raise KeyError
-        rx_emits: rx.AsyncObservable[bytes] = rx.pipe(
-            rx_observable,
-            rx.map(emit_to_transport),
-            ix.buffer_with_time(0.2, 3),
-            rx.filter(lambda l: len(l) > 0),
-            rx.map(orjson.dumps)
-        )
-        await streamutil.websocket_stream(websocket, rx_emits)
+        await streamutil.websocket_emit_stream(
+            websocket, streamutil.hub(
+                "observable " + observable_id, "observable", lambda: rx.pipe(rx_observable, rx.map(lambda e: (0, e)))),
+            conflate=False, batch=3, seconds=0.2)
     except KeyError:
         raise HTTPException(404, f"Observable {observable_id} not found")
 
@@ -62,6 +87,57 @@ async def get_status(observable_id: str,) -> RawEmit:
     return emit_to_raw(_observable(observable_id).current_status)
 
 
+@router.get("/{observable_id}/recent")
+async def get_recent(
+        observable_id: str,
+        points: Optional[int] = None,
+        seconds: Optional[float] = None
+) -> ORJSONResponse:
+    """
+    Get the latest emits of an observable from memory, without reading an emit device. At most the number of emits
+    kept per observable, set by the smoothieaq_recent_depth environment variable, default 720.
+    :param points: At most this many emits
+    :param seconds: Only emits of the last seconds
+    :return: A list of emits in transport format, oldest first
+    """
+    _observable(observable_id)
+    frm = time.time() - seconds if seconds is not None else None
+    return ORJSONResponse(recent.get(observable_id, points, frm))
+
+
+@router.get("/{observable_id}/history")
+async def get_history(
+        observable_id: str,
+        frm: Annotated[Optional[int], Query(alias="from")] = None,
+        to: Optional[int] = None,
+        points: int = 500
+) -> StreamingResponse:
+    """
+    Get stored emits of an observable (or its status, with a ? after the id), downsampled to at most points emits.
+
+    Value series are downsampled with Largest-Triangle-Three-Buckets, enum and status series keep the first and last
+    emit of each time bucket. The emits are read from the first enabled emit device that can be read from.
+
+    :param frm: Start stamp in transport format, default 24 hours before to
+    :param to: End stamp in transport format, default now
+    :param points: Maximum number of emits to return
+    :return: A list of emits in transport format, streamed in chunks
+    """
+    m_observable = _observable(observable_id.removesuffix('?')).m_observable
+    emit_device = ed.get_history_emit_device()
+    if emit_device is None:
+        raise HTTPException(404, f"No emit device to read history of {observable_id} from")
+    end = stamp_from_transport(to) if to is not None else time.time()
+    start = stamp_from_transport(frm) if frm is not None else end - 24 * 60 * 60
+    downsample = lttb if isinstance(m_observable, aqt.ValueObservable) and not observable_id.endswith('?') else minmax
+    emits = downsample(emit_device.history(observable_id, start, end), start, end, max(points, 3))
+
+    async def transport():
+        async for e in emits:
+            yield emit_to_transport(e)
+    return StreamingResponse(streamutil.json_list_stream(transport()), media_type="application/json")
+
+
 @router.post("/{observable_id}/pause")
 async def post_pause(observable_id: str,) -> None:
     await _observable(observable_id).pause()
@@ -1,12 +1,40 @@
-from typing import Any
+import asyncio
+import logging
+import time as t
+from collections import deque
+from itertools import islice
+from typing import Any, AsyncIterator, Callable, Hashable, Optional
 
 import aioreactive as rx
+import orjson
+from aioreactive.observers import AsyncAnonymousObserver
 from starlette.websockets import WebSocketState, WebSocketDisconnect
 from fastapi import WebSocket
 
+from ..div import metrics, binarytransport
+from ..div.emit import ObservableEmit, emit_to_transport
 
-async def websocket_stream(websocket: WebSocket, rx_stream: rx.AsyncObservable[Any]):
-    await websocket.accept()
+log = logging.getLogger(__name__)
+
+
+def binary_requested(websocket: WebSocket) -> bool:
+    # the client asked for the binary transport of emits, as a websocket subprotocol
+    return binarytransport.SUBPROTOCOL in websocket.scope.get("subprotocols", ())
+
+
+async def _send(websocket: WebSocket, message: Any) -> None:
+    if isinstance(message, bytes):
+        await websocket.send_bytes(message)
+    elif isinstance(message, str):
+        await websocket.send_text(message)
+    else:
+        await websocket.send_text(orjson.dumps(message).decode())
+
+
+async def websocket_stream(websocket: WebSocket, rx_stream: rx.AsyncObservable[Any], name: str,
+                           subprotocol: Optional[str] = None):
+    m_send = metrics.websocket_send_seconds.labels(name)
+    await websocket.accept(subprotocol)
     try:
         obv = rx.AsyncIteratorObserver(rx_stream)
         async with await rx_stream.subscribe_async(obv) as subscription:
@@ -16,7 +44,9 @@ async def websocket_stream(websocket: WebSocket, rx_stream: rx.AsyncObservable[A
                     break
                 try:
                     if e != prev:
-                        await websocket.send_json(e)
+                        t0 = t.perf_counter()
+                        await _send(websocket, e)
+                        m_send.observe(t.perf_counter() - t0)
                     prev = e
                 except WebSocketDisconnect:
                     break
@@ -29,6 +59,281 @@ async def websocket_stream(websocket: WebSocket, rx_stream: rx.AsyncObservable[A
                 return
 
 
+class ClientQueue[T]:
+    # A bounded queue of elements to one websocket client. It is filled without waiting, so a slow client never stalls
+    # the emitters or other clients, and emptied in batches. When full, the oldest element is dropped. Conflating by a
+    # key, a new element replaces an element with the same key still in the queue, so a slow client gets the latest
+    # of each key. Elements are kept in the order they were put, also when conflated.
+
+    def __init__(self, name: str, size: int, batch: int, conflate_key: Optional[Callable[[T], Hashable]] = None):
+        self.size = size
+        self.batch = batch
+        self._key = conflate_key
+        self._elements: dict[Hashable, T] | deque[T] = {} if conflate_key else deque()
+        self._ready = asyncio.Event()
+        self._full = asyncio.Event()
+        self.closed = False
+        self._m_overflow = metrics.websocket_emits_dropped.labels(name, "overflow")
+        self._m_conflated = metrics.websocket_emits_dropped.labels(name, "conflated")
+
+    def __len__(self) -> int:
+        return len(self._elements)
+
+    def put(self, e: T) -> None:
+        elements = self._elements
+        if self._key:
+            key = self._key(e)
+            if key in elements:
+                del elements[key]
+                self._m_conflated.inc()
+            elif len(elements) >= self.size:
+                del elements[next(iter(elements))]
+                self._m_overflow.inc()
+            elements[key] = e
+        else:
+            if len(elements) >= self.size:
+                elements.popleft()
+                self._m_overflow.inc()
+            elements.append(e)
+        self._ready.set()
+        if len(elements) >= self.batch:
+            self._full.set()
+
+    async def get(self, seconds: float) -> list[T]:
+        # a batch, when full or the first element has waited for seconds; empty when closed
+        await self._ready.wait()
+        if len(self._elements) < self.batch and not self.closed:
+            try:
+                await asyncio.wait_for(self._full.wait(), seconds)
+            except TimeoutError:
+                pass
+        elements = self._elements
+        if self._key:
+            batch = [elements.pop(k) for k in list(islice(elements, self.batch))]
+        else:
+            batch = [elements.popleft() for _ in range(min(self.batch, len(elements)))]
+        if not elements and not self.closed:
+            self._ready.clear()
+        if len(elements) < self.batch:
+            self._full.clear()
+        return batch
+
+    def close(self) -> None:
+        self.closed = True
+        self._elements.clear()
+        self._ready.set()
+        self._full.set()
+
+
+type Record = tuple[int, ObservableEmit, Optional[bytes]]  # sequence number, emit, JSON of emit_to_transport
+type Journal = Callable[[], tuple[int, Optional[list[tuple[int, ObservableEmit]]]]]  # latest seq, emits or None on a gap
+
+
+class Hub:
+    # One subscription to a stream of emits for all its websocket clients, made when the first client comes and
+    # disposed when the last goes. An emit is encoded to JSON once, if any JSON client accepts it, and put with its
+    # encoding into the queue of each client accepting it, so a batch to a client is a join of those encodings. The
+    # source sends each emit with its sequence number, 0 if it has none.
+
+    def __init__(self, key: str, name: str, source: rx.AsyncObservable[tuple[int, ObservableEmit]]) -> None:
+        self.key = key
+        self.name = name
+        self._source = source
+        self._clients: list[tuple[Callable[[ObservableEmit], bool], ClientQueue[Record], bool]] = []
+        self._disposable: Optional[rx.AsyncDisposable] = None
+
+    async def add(self, accept: Callable[[ObservableEmit], bool], queue: ClientQueue[Record], json: bool) -> None:
+        first = not self._clients
+        self._clients = self._clients + [(accept, queue, json)]
+        if first:
+            disposable = await self._source.subscribe_async(AsyncAnonymousObserver(self._asend))
+            if self._clients:
+                self._disposable = disposable
+            else:  # the client left while subscribing
+                await disposable.dispose_async()
+
+    async def remove(self, queue: ClientQueue[Record]) -> None:
+        self._clients = [c for c in self._clients if c[1] is not queue]
+        if not self._clients:
+            if _hubs.get(self.key) is self:
+                del _hubs[self.key]
+            if self._disposable:
+                disposable, self._disposable = self._disposable, None
+                await disposable.dispose_async()
+
+    async def _asend(self, se: tuple[int, ObservableEmit]) -> None:
+        seq, e = se
+        encoded = None
+        for accept, queue, json in self._clients:
+            if accept(e):
+                if json and encoded is None:
+                    encoded = orjson.dumps(emit_to_transport(e))
+                queue.put((seq, e, encoded))
+
+
+_hubs: dict[str, Hub] = {}
+
+
+def hub(key: str, name: str, source: Callable[[], rx.AsyncObservable[tuple[int, ObservableEmit]]]) -> Hub:
+    h = _hubs.get(key)
+    if h is None:
+        h = _hubs[key] = Hub(key, name, source())
+    return h
+
+
+async def _batches(
+        hub: Hub,
+        accept: Callable[[ObservableEmit], bool],
+        queue: ClientQueue[Record],
+        json: bool,
+        journal: Optional[Journal],
+        seconds: float,
+        idle: Optional[float] = None
+) -> AsyncIterator[int | list[Record]]:
+    # batches of the emits in the journal, if any, and then of those from the hub, without those already in the
+    # journal; the latest seq of the journal first if it is missing some, and an empty batch after idle seconds
+    # without emits. Only emits of a hub sending sequence numbers, as rx_journal, can be told from those replayed
+    await hub.add(accept, queue, json)
+    try:
+        last: Optional[int] = None
+        if journal:
+            latest, backlog = journal()
+            if backlog is None:
+                yield latest
+            else:
+                records = [(seq, e, orjson.dumps(emit_to_transport(e)) if json else None)
+                           for (seq, e) in backlog if accept(e)]
+                for i in range(0, len(records), queue.batch):
+                    yield records[i:i + queue.batch]
+                last = backlog[-1][0] if backlog else None
+        while True:
+            try:
+                batch = await asyncio.wait_for(queue.get(seconds), idle)
+            except TimeoutError:
+                yield []
+                continue
+            if not batch:
+                return
+            if last is None:
+                yield batch
+            elif batch[-1][0] > last:
+                yield [r for r in batch if r[0] > last] if batch[0][0] <= last else batch
+    finally:
+        await hub.remove(queue)
+
+
+def _json_batch(batch: list[Record]) -> bytes:
+    return b'[' + b','.join(encoded for _, _, encoded in batch) + b']'
+
+
+async def websocket_emit_stream(
+        websocket: WebSocket,
+        hub: Hub,
+        accept: Callable[[ObservableEmit], bool] = lambda e: True,
+        on_message: Optional[Callable[[Any], None]] = None,
+        queue_size: int = 1000,
+        conflate: bool = True,
+        batch: int = 20,
+        seconds: float = 1.,
+        seq: bool = False,
+        journal: Optional[Journal] = None
+):
+    # streams emits from the hub to the websocket through a queue, so sending never waits on the client, as JSON lists
+    # of emit_to_transport or in the binary transport, and passes messages from the client to on_message. With seq,
+    # JSON lists are sent as {"seq": seq, "emits": [...]}, with the sequence number of the last emit, and with a
+    # journal, the emits in it are sent first, and {"seq": seq, "gap": true, "emits": []} if it is missing some
+    m_send = metrics.websocket_send_seconds.labels(hub.name)
+    binary = binary_requested(websocket)
+    seq = seq or journal is not None
+    if binary:
+        encoder = binarytransport.Encoder()
+        encode = lambda b: encoder.encode([e for _, e, _ in b], b[-1][0] if seq else None)
+        gap = lambda s: encoder.gap(s)
+    elif seq:
+        encode = lambda b: (b'{"seq":%d,"emits":' % b[-1][0] + _json_batch(b) + b'}').decode()
+        gap = lambda s: '{"seq":%d,"gap":true,"emits":[]}' % s
+    else:
+        encode = lambda b: _json_batch(b).decode()
+    queue = ClientQueue[Record](hub.name, queue_size, batch, (lambda r: r[1].observable_id) if conflate else None)
+    await websocket.accept(binarytransport.SUBPROTOCOL if binary else None)
+
+    async def receive() -> None:
+        try:
+            while True:
+                try:
+                    message = await websocket.receive_json()
+                    if on_message:
+                        on_message(message)
+                except (ValueError, TypeError, KeyError) as e:
+                    log.warning(f"Ignoring message on {hub.name} stream: {e}")
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+        finally:
+            queue.close()
+
+    receiver = asyncio.create_task(receive())
+    batches = _batches(hub, accept, queue, not binary, journal, seconds)
+    try:
+        async for b in batches:
+            if not websocket.client_state == WebSocketState.CONNECTED:
+                break
+            try:
+                t0 = t.perf_counter()
+                await _send(websocket, gap(b) if isinstance(b, int) else encode(b))
+                m_send.observe(t.perf_counter() - t0)
+            except WebSocketDisconnect:
+                break
+
+    finally:
+        await batches.aclose()
+        receiver.cancel()
+        if not websocket.client_state == WebSocketState.DISCONNECTED:
+            try:
+                await websocket.close()
+            except:
+                return
+
+
+async def emit_events(
+        hub: Hub,
+        accept: Callable[[ObservableEmit], bool] = lambda e: True,
+        queue_size: int = 1000,
+        conflate: bool = True,
+        batch: int = 20,
+        seconds: float = 1.,
+        journal: Optional[Journal] = None,
+        keep_alive: float = 15.
+) -> AsyncIterator[bytes]:
+    # server-sent events of emits from the hub, each a JSON list of emits with the sequence number of the last as id,
+    # for the browser to send as Last-Event-ID when it reconnects
+    queue = ClientQueue[Record](hub.name, queue_size, batch, (lambda r: r[1].observable_id) if conflate else None)
+    batches = _batches(hub, accept, queue, True, journal, seconds, keep_alive)
+    try:
+        async for b in batches:
+            if isinstance(b, int):
+                yield b'event: gap\nid: %d\ndata: []\n\n' % b
+            elif not b:
+                yield b': keep alive\n\n'
+            else:
+                yield b'id: %d\ndata: ' % b[-1][0] + _json_batch(b) + b'\n\n'
+    finally:
+        queue.close()
+        await batches.aclose()
+
+
+async def json_list_stream(elements: AsyncIterator[Any], chunk_size: int = 200) -> AsyncIterator[bytes]:
+    chunk: list[bytes] = [b'[']
+    separator = b''
+    async for e in elements:
+        chunk.append(separator + orjson.dumps(e))
+        separator = b','
+        if len(chunk) >= chunk_size:
+            yield b''.join(chunk)
+            chunk = []
+    chunk.append(b']')
+    yield b''.join(chunk)
+
+
 def stream_test_html(p: str) -> str:
     return """
 <!DOCTYPE html>
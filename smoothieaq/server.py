@@ -2,7 +2,8 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 #from .device.devices import observables
-from .routes import drivers, devices, emits, observables, tests
+from .device import lastemits
+from .routes import drivers, devices, emits, metrics, observables, tests
 from .modelobject import objectstore as ostore
 from contextlib import asynccontextmanager
 
@@ -24,6 +25,7 @@ async def lifespan(app: FastAPI):
     await test()
 #    await ostore.load()
     yield
+    await lastemits.stop()
 
 
 app = FastAPI(lifespan=lifespan, separate_input_output_schemas=False)
@@ -41,6 +43,7 @@ app.add_middleware(
 app.include_router(drivers.router)
 app.include_router(devices.router)
 app.include_router(emits.router)
+app.include_router(metrics.router)
 app.include_router(observables.router)
 app.include_router(tests.router)
 
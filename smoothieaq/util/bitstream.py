@@ -0,0 +1,46 @@
+class BitWriter:
+
+    def __init__(self) -> None:
+        self._bytes = bytearray()
+        self._acc: int = 0
+        self._n: int = 0
+
+    def write(self, value: int, bits: int) -> None:
+        self._acc = (self._acc << bits) | (value & ((1 << bits) - 1))
+        self._n += bits
+        if self._n >= 64:
+            rest = self._n & 7
+            self._bytes += (self._acc >> rest).to_bytes((self._n - rest) >> 3, 'big')
+            self._acc &= (1 << rest) - 1
+            self._n = rest
+
+    def getvalue(self) -> bytes:
+        pad = -self._n & 7
+        return bytes(self._bytes) + (self._acc << pad).to_bytes((self._n + pad) >> 3, 'big')
+
+
+class BitReader:
+    # Reads from bytes, or a slice of an mmap, through a small word buffer so every read is on small ints.
+
+    def __init__(self, buf) -> None:
+        self._buf = buf
+        self._next: int = 0  # next byte to load into the word
+        self._word: int = 0
+        self._n: int = 0  # bits in the word
+
+    def _load(self) -> None:
+        chunk = self._buf[self._next:self._next + 16]
+        self._next += len(chunk)
+        self._word = (self._word << (len(chunk) << 3)) | int.from_bytes(chunk, 'big')
+        self._n += len(chunk) << 3
+
+    def read(self, bits: int) -> int:
+        if self._n < bits:
+            self._load()
+            if self._n < bits:
+                raise EOFError("Read past end of bit stream")
+        self._n -= bits
+        value = self._word >> self._n
+        self._word &= (1 << self._n) - 1
+        return value
+
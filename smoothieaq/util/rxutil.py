@@ -1,17 +1,15 @@
 import asyncio
 import logging
 from asyncio import sleep
-from typing import Callable, TypeVar, Iterable, Optional, NoReturn, Awaitable
+from typing import Callable, TypeVar, Iterable, Optional, Awaitable
 
 import aioreactive as rx
 from aioreactive import AsyncObservable, AsyncObserver, AsyncAnonymousObservable, SendAsync, ThrowAsync, CloseAsync
-from aioreactive.msg import Msg
-from aioreactive.notification import Notification, OnNext, OnError, OnCompleted
-from aioreactive.observers import auto_detach_observer, AsyncNotificationObserver, AsyncAnonymousObserver
+from aioreactive.observers import AsyncAnonymousObserver
 from aioreactive.subject import AsyncMultiSubject
 from aioreactive.types import _T_out
 from aioreactive.create import interval
-from expression import MailboxProcessor, pipe, tailrec_async, TailCallResult, TailCall, snd
+from expression import pipe
 from expression.collections import Seq
 from expression.collections.seq import of_iterable
 from expression.system import AsyncDisposable
@@ -21,82 +19,154 @@ log = logging.getLogger(__name__)
 _TSource = TypeVar("_TSource")
 
 
-def buffer(
-        boundaries: AsyncObservable[any], count: int = 0, emitEmpty: bool = True
-) -> Callable[[AsyncObservable[_TSource]], AsyncObservable[list[_TSource]]]:
-    def _buffer(source: AsyncObservable[_TSource]) -> AsyncObservable[_TSource]:
-        async def subscribe_async(aobv: AsyncObserver[_TSource]) -> AsyncDisposable:
-            safe_obv, auto_detach = auto_detach_observer(aobv)
-
-            async def worker(inbox: MailboxProcessor[Msg[_TSource]]) -> None:
-
-                async def message_loop() -> None:
-                    buffer: list[_TSource] = []
-
-                    while True:
-                        cn = await inbox.receive()
-
-                        match cn:
-                            case Msg(tag="source", source=value):
-                                match value:
-                                    case OnNext(value=value):
-                                        buffer.append(value)
-                                        if len(buffer) == count:
-                                            await safe_obv.asend(buffer)
-                                            buffer = []
-                                    case OnError(exception=err):
-                                        await safe_obv.athrow(err)
-                                        return
-                                    case _:
-                                        if len(buffer) > 0:
-                                            await safe_obv.asend(buffer)
-                                        await safe_obv.aclose()
-                                        return
-
-                            case Msg(tag="other", other=value):
-                                match value:
-                                    case OnNext(value=value):
-                                        if len(buffer) > 0 or emitEmpty:
-                                            await safe_obv.asend(buffer)
-                                            buffer = []
-                                    case OnError(exception=err):
-                                        await safe_obv.athrow(err)
-                                        return
-                                    case _:
-                                        if len(buffer) > 0:
-                                            await safe_obv.asend(buffer)
-                                        await safe_obv.aclose()
-                                        return
-
-                            case _:
-                                raise ValueError(f"Unexpected message: {cn}")
-
-                await message_loop()
-
-            agent = MailboxProcessor.start(worker)
-
-            async def obv_fn1(n: Notification[_TSource]) -> None:
-                agent.post(Msg(source=n))
-
-            async def obv_fn2(n: Notification[any]) -> None:
-                agent.post(Msg(other=n))
-
-            obv1: AsyncObserver[_TSource] = AsyncNotificationObserver(obv_fn1)
-            obv2: AsyncObserver[any] = AsyncNotificationObserver(obv_fn2)
-            dispose1 = await pipe(obv1, source.subscribe_async, auto_detach)
-            dispose2 = await pipe(obv2, boundaries.subscribe_async, auto_detach)
-
-            return AsyncDisposable.composite(dispose1, dispose2)
+class _Sink(AsyncObserver[_TSource]):
+    # Base of the operators below: a plain observer between a source and the observer of an operator, without the
+    # MailboxProcessors (i.e. a queue and a task) of aioreactive's operators, auto_detach_observer and safe_observer.
+    # Forwards until the first error or close, and has at most one timer.
+
+    def __init__(self, obv: AsyncObserver[any]) -> None:
+        super().__init__()
+        self._obv = obv
+        self._stopped = False
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_task: Optional[asyncio.Task] = None
+        self._disposables: list[AsyncDisposable] = []
+
+    async def subscribe(self, source: AsyncObservable[_TSource]) -> AsyncDisposable:
+        await self._subscribe(source, self)
+        return AsyncDisposable.create(self._stop)
+
+    async def _subscribe(self, source: AsyncObservable[any], obv: AsyncObserver[any]) -> None:
+        disposable = await source.subscribe_async(obv)
+        if self._stopped:
+            await disposable.dispose_async()
+        else:
+            self._disposables.append(disposable)
+
+    async def asend(self, value: _TSource) -> None:
+        if self._stopped:
+            return
+        try:
+            await self._next(value)
+        except Exception as ex:
+            await self.athrow(ex)
+
+    async def _next(self, value: _TSource) -> None:
+        await self._obv.asend(value)
+
+    async def athrow(self, error: Exception) -> None:
+        if self._stopped:
+            return
+        await self._stop()
+        await self._obv.athrow(error)
+
+    async def aclose(self) -> None:
+        if self._stopped:
+            return
+        try:
+            await self._close()
+        except Exception as ex:
+            await self.athrow(ex)
+            return
+        await self._stop()
+        await self._obv.aclose()
+
+    async def _close(self) -> None:
+        pass
+
+    async def _stop(self) -> None:
+        self._stopped = True
+        self._cancel_timer()
+        disposables, self._disposables = self._disposables, []
+        for disposable in disposables:
+            await disposable.dispose_async()
+
+    def _schedule(self, delay: float, fire: Callable[[], Awaitable[None]]) -> None:
+        self._cancel_timer()
+
+        def _fire() -> None:
+            self._timer = None
+            self._timer_task = asyncio.create_task(self._fire(fire))
+        self._timer = asyncio.get_running_loop().call_later(delay, _fire)
+
+    async def _fire(self, fire: Callable[[], Awaitable[None]]) -> None:
+        if self._stopped:
+            return
+        try:
+            await fire()
+        except Exception as ex:
+            await self.athrow(ex)
+
+    def _cancel_timer(self) -> None:
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+
+def _operator(
+        sink: Callable[[AsyncObserver[any]], _Sink]
+) -> Callable[[AsyncObservable[_TSource]], AsyncObservable[any]]:
+    def _op(source: AsyncObservable[_TSource]) -> AsyncObservable[any]:
+        async def subscribe_async(aobv: AsyncObserver[any]) -> AsyncDisposable:
+            return await sink(aobv).subscribe(source)
 
         return AsyncAnonymousObservable(subscribe_async)
 
-    return _buffer
+    return _op
+
+
+class _Buffer(_Sink[_TSource]):
+
+    def __init__(self, obv: AsyncObserver[list[_TSource]], boundaries: Optional[AsyncObservable[any]],
+                 seconds: Optional[float], count: int, emitEmpty: bool) -> None:
+        super().__init__(obv)
+        self._boundaries = boundaries
+        self._seconds = seconds
+        self._count = count
+        self._emitEmpty = emitEmpty
+        self._buffer: list[_TSource] = []
+
+    async def subscribe(self, source: AsyncObservable[_TSource]) -> AsyncDisposable:
+        if self._boundaries:
+            async def boundary(_) -> None:
+                await self._fire(self._boundary)
+            await self._subscribe(self._boundaries, AsyncAnonymousObserver(boundary, self.athrow))
+        else:
+            self._schedule(self._seconds, self._tick)
+        return await super().subscribe(source)
+
+    async def _next(self, value: _TSource) -> None:
+        self._buffer.append(value)
+        if len(self._buffer) == self._count:
+            await self._send()
+
+    async def _send(self) -> None:
+        buffer, self._buffer = self._buffer, []
+        await self._obv.asend(buffer)
+
+    async def _boundary(self) -> None:
+        if len(self._buffer) > 0 or self._emitEmpty:
+            await self._send()
+
+    async def _tick(self) -> None:
+        self._schedule(self._seconds, self._tick)
+        await self._boundary()
+
+    async def _close(self) -> None:
+        if len(self._buffer) > 0:
+            await self._send()
+
+
+def buffer(
+        boundaries: AsyncObservable[any], count: int = 0, emitEmpty: bool = True
+) -> Callable[[AsyncObservable[_TSource]], AsyncObservable[list[_TSource]]]:
+    return _operator(lambda obv: _Buffer(obv, boundaries, None, count, emitEmpty))
 
 
 def buffer_with_time(
         seconds: float, count: int = 0, emitEmpty: bool = False
 ) -> Callable[[AsyncObservable[_TSource]], AsyncObservable[list[_TSource]]]:
-    return buffer(interval(seconds, seconds), count=count, emitEmpty=emitEmpty)
+    return _operator(lambda obv: _Buffer(obv, None, seconds, count, emitEmpty))
 
 
 async def _buffer_test():
@@ -110,22 +180,21 @@ async def _buffer_test():
     await sleep(15)
 
 
-class AsyncBehaviorSubject[_TSource](AsyncMultiSubject):
-
-    def __init__(self, initialValue: _TSource):
-        super().__init__()
-        self.value = initialValue
+class AsyncPublishSubject[_TSource](AsyncMultiSubject):
+    # the list of observers is replaced, not changed, on subscribe and dispose, so sending an emit needs no copy
 
     async def asend(self, value: _TSource) -> None:
-        self.value = value
         self.check_disposed()
 
         if self._is_stopped:
             return
 
-        for obv in list(self._observers):
+        for obv in self._observers:
             await obv.asend(value)
 
+    async def _initial(self, observer: AsyncObserver[_TSource]) -> None:
+        pass
+
     async def subscribe_async(
         self,
         send: SendAsync[_TSource] | AsyncObserver[_TSource] | None = None,
@@ -137,22 +206,41 @@ class AsyncBehaviorSubject[_TSource](AsyncMultiSubject):
         self.check_disposed()
 
         observer = send if isinstance(send, AsyncObserver) else AsyncAnonymousObserver(send, throw, close)
-        await observer.asend(self.value)  # initial value
-        self._observers.append(observer)
+        await self._initial(observer)
+        self._observers = self._observers + [observer]
 
         async def dispose() -> None:
             log.debug("AsyncMultiStream:dispose()")
             if observer in self._observers:
-                self._observers.remove(observer)
+                self._observers = [o for o in self._observers if o is not observer]
 
         return AsyncDisposable.create(dispose)
 
 
+_no_value = object()
+
+
+class AsyncBehaviorSubject[_TSource](AsyncPublishSubject):
+    # sends the latest value, or the initial value if any, to new observers
+
+    def __init__(self, initialValue: _TSource = _no_value):
+        super().__init__()
+        self.value = initialValue
+
+    async def asend(self, value: _TSource) -> None:
+        self.value = value
+        await super().asend(value)
+
+    async def _initial(self, observer: AsyncObserver[_TSource]) -> None:
+        if self.value is not _no_value:
+            await observer.asend(self.value)
+
+
 class AsyncConnectableObservable(AsyncObservable[_TSource]):
 
     def __init__(self, source: AsyncObservable[_TSource], initialValue: Optional[_TSource] = None):
         self.source = source
-        self.subject = AsyncBehaviorSubject(initialValue) if initialValue is not None else rx.AsyncSubject()
+        self.subject = AsyncBehaviorSubject(initialValue) if initialValue is not None else AsyncBehaviorSubject()
         super().__init__()
 
     async def subscribe_async(
@@ -203,55 +291,23 @@ async def _publish_test():
     await sleep(2)
 
 
-def distinct_until_changed(
-        comparer: Callable[[_TSource, _TSource], bool] = lambda v1, v2: v1 == v2
-) -> Callable[[AsyncObservable[_TSource]], AsyncObservable[_TSource]]:
-    def _distinct_until_changed(
-        source: AsyncObservable[_TSource],
-    ) -> AsyncObservable[_TSource]:
-        async def subscribe_async(aobv: AsyncObserver[_TSource]) -> AsyncDisposable:
-            safe_obv, auto_detach = auto_detach_observer(aobv)
-
-            async def worker(inbox: MailboxProcessor[Notification[_TSource]]) -> None:
-                @tailrec_async
-                async def message_loop(
-                    latest: _TSource | None,
-                ) -> TailCallResult[NoReturn, [_TSource | None]]:
-                    n = await inbox.receive()
-
-                    async def get_latest() -> _TSource | None:
-                        match n:
-                            case OnNext(value=x):
-                                try:
-                                    if (latest is None and x is not None) or not comparer(latest, x):
-                                        await safe_obv.asend(x)
-                                except Exception as ex:
-                                    await safe_obv.athrow(ex)
-                                return x
-                            case OnError(exception=err):
-                                await safe_obv.athrow(err)
+class _DistinctUntilChanged(_Sink[_TSource]):
 
-                            case _:
-                                await safe_obv.aclose()
+    def __init__(self, obv: AsyncObserver[_TSource], comparer: Callable[[_TSource, _TSource], bool]) -> None:
+        super().__init__(obv)
+        self._comparer = comparer
+        self._latest: Optional[_TSource] = None
 
-                        return None
+    async def _next(self, value: _TSource) -> None:
+        latest, self._latest = self._latest, value
+        if (latest is None and value is not None) or not self._comparer(latest, value):
+            await self._obv.asend(value)
 
-                    latest = await get_latest()
-                    return TailCall[_TSource | None](latest)
 
-                await message_loop(None)
-
-            agent = MailboxProcessor.start(worker)
-
-            async def notification(n: Notification[_TSource]) -> None:
-                agent.post(n)
-
-            obv: AsyncObserver[_TSource] = AsyncNotificationObserver(notification)
-            return await pipe(obv, source.subscribe_async, auto_detach)
-
-        return AsyncAnonymousObservable(subscribe_async)
-
-    return _distinct_until_changed
+def distinct_until_changed(
+        comparer: Callable[[_TSource, _TSource], bool] = lambda v1, v2: v1 == v2
+) -> Callable[[AsyncObservable[_TSource]], AsyncObservable[_TSource]]:
+    return _operator(lambda obv: _DistinctUntilChanged(obv, comparer))
 
 
 async def _distinct_until_changed_test():
@@ -277,15 +333,164 @@ async def _distinct_until_changed_test():
     await sleep(2)
 
 
+class _Debounce(_Sink[_TSource]):
+    # the latest value, when there has been no new value for seconds
+
+    def __init__(self, obv: AsyncObserver[_TSource], seconds: float) -> None:
+        super().__init__(obv)
+        self._seconds = seconds
+        self._latest: Optional[_TSource] = None
+
+    async def _next(self, value: _TSource) -> None:
+        self._latest = value
+        self._schedule(self._seconds, self._send)
+
+    async def _send(self) -> None:
+        await self._obv.asend(self._latest)
+
+
+def debounce(seconds: float) -> Callable[[AsyncObservable[_TSource]], AsyncObservable[_TSource]]:
+    return _operator(lambda obv: _Debounce(obv, seconds))
+
+
+class _Throttle(_Sink[_TSource]):
+    # a value right away, and then at most one every seconds: the latest value at the end of each period
+
+    def __init__(self, obv: AsyncObserver[_TSource], seconds: float) -> None:
+        super().__init__(obv)
+        self._seconds = seconds
+        self._latest: Optional[_TSource] = None
+        self._pending = False
+
+    async def _next(self, value: _TSource) -> None:
+        if self._timer:
+            self._latest = value
+            self._pending = True
+        else:
+            self._schedule(self._seconds, self._period_end)
+            await self._obv.asend(value)
+
+    async def _period_end(self) -> None:
+        if self._pending:
+            self._pending = False
+            self._schedule(self._seconds, self._period_end)
+            await self._obv.asend(self._latest)
+
+
+def throttle(seconds: float) -> Callable[[AsyncObservable[_TSource]], AsyncObservable[_TSource]]:
+    return _operator(lambda obv: _Throttle(obv, seconds))
+
+
+class _Sample(_Sink[_TSource]):
+    # the latest value, on every emit of sampler or every sampler seconds
+
+    def __init__(self, obv: AsyncObserver[_TSource], sampler: AsyncObservable[any] | float) -> None:
+        super().__init__(obv)
+        self._sampler = sampler
+        self._latest: Optional[_TSource] = None
+        self._has_latest = False
+
+    async def subscribe(self, source: AsyncObservable[_TSource]) -> AsyncDisposable:
+        if isinstance(self._sampler, AsyncObservable):
+            async def tick(_) -> None:
+                await self._fire(self._send)
+            await self._subscribe(self._sampler, AsyncAnonymousObserver(tick, self.athrow))
+        else:
+            self._schedule(self._sampler, self._tick)
+        return await super().subscribe(source)
+
+    async def _next(self, value: _TSource) -> None:
+        self._latest = value
+        self._has_latest = True
+
+    async def _send(self) -> None:
+        if self._has_latest:
+            await self._obv.asend(self._latest)
+
+    async def _tick(self) -> None:
+        self._schedule(self._sampler, self._tick)
+        await self._send()
+
+
 def sample(
         sampler: AsyncObservable[any] | float
 ) -> Callable[[AsyncObservable[_TSource]], AsyncObservable[_TSource]]:
-    frm = interval(5,5) # sampler if isinstance(sampler, AsyncObservable) else interval(sampler, sampler)
+    return _operator(lambda obv: _Sample(obv, sampler))
+
+
+class _CombineLatest(_Sink[any]):
+    # mapper of the latest values of all sources, kept in one slot list, when all have a value
+
+    def __init__(self, obv: AsyncObserver[_TSource], count: int, mapper: Callable[[list[any]], _TSource]) -> None:
+        super().__init__(obv)
+        self._mapper = mapper
+        self._slots: list[any] = [None] * count
+        self._missing = set(range(count))
+        self._open = count
+
+    async def subscribe_all(self, sources: list[AsyncObservable[any]]) -> AsyncDisposable:
+        for i, source in enumerate(sources):
+            await self._subscribe(source, AsyncAnonymousObserver(self._slot(i), self.athrow, self._source_closed))
+        return AsyncDisposable.create(self._stop)
+
+    def _slot(self, i: int) -> Callable[[any], Awaitable[None]]:
+        slots = self._slots
+
+        async def asend(value: any) -> None:
+            slots[i] = value
+            if self._missing:
+                self._missing.discard(i)
+                if self._missing:
+                    return
+            await self.asend(slots)
+        return asend
+
+    async def _next(self, slots: list[any]) -> None:
+        await self._obv.asend(self._mapper(slots))
+
+    async def _source_closed(self) -> None:
+        self._open -= 1
+        if self._open == 0:
+            await self.aclose()
+
+
+def combine_latest(
+        sources: list[AsyncObservable[any]], mapper: Callable[[list[any]], _TSource]
+) -> AsyncObservable[_TSource]:
+    # like rx.combine_latest over all sources and rx.map, but without nested tuples and a MailboxProcessor per source
+    async def subscribe_async(aobv: AsyncObserver[_TSource]) -> AsyncDisposable:
+        return await _CombineLatest(aobv, len(sources), mapper).subscribe_all(sources)
+
+    return AsyncAnonymousObservable(subscribe_async)
+
+
+class _MergeInner(_Sink[AsyncObservable[_TSource]]):
+    # emits of all inner observables, sent on as they come, closing when the outer and all inner observables are
+
+    def __init__(self, obv: AsyncObserver[_TSource]) -> None:
+        super().__init__(obv)
+        self._open = 1
+
+    async def _next(self, inner: AsyncObservable[_TSource]) -> None:
+        self._open += 1
+        await self._subscribe(inner, AsyncAnonymousObserver(self._send, self.athrow, self._inner_closed))
+
+    async def _send(self, value: _TSource) -> None:
+        if not self._stopped:
+            await self._obv.asend(value)
+
+    async def _inner_closed(self) -> None:
+        self._open -= 1
+        if self._open == 0:
+            await super().aclose()
+
+    async def aclose(self) -> None:
+        await self._inner_closed()
 
-    def _sample(source: AsyncObservable[_TSource]) -> AsyncObservable[_TSource]:
-        return pipe(frm, rx.with_latest_from(source), rx.map(snd))
 
-    return _sample
+def merge_inner() -> Callable[[AsyncObservable[AsyncObservable[_TSource]]], AsyncObservable[_TSource]]:
+    # like rx.merge_inner, but without a MailboxProcessor, so emits of the inner observables are not queued
+    return _operator(lambda obv: _MergeInner(obv))
 
 
 def trace(